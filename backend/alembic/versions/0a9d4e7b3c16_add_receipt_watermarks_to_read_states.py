@@ -0,0 +1,47 @@
+"""Add delivered watermark and unread counter to conversation_read_states
+
+Revision ID: 0a9d4e7b3c16
+Revises: f18c3d6e0a52
+Create Date: 2026-10-18 16:05:11.730294
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0a9d4e7b3c16'
+down_revision: Union[str, None] = 'f18c3d6e0a52'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('conversation_read_states', sa.Column('last_delivered_message_id', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('conversation_read_states', sa.Column('unread_count', sa.Integer(), server_default='0', nullable=False))
+    op.execute("UPDATE conversation_read_states SET last_delivered_message_id = last_read_message_id")
+
+    # every participant gets a row, so message inserts can keep unread_count with a plain UPDATE
+    op.execute(
+        "INSERT INTO conversation_read_states (conversation_id, user_id) "
+        "SELECT conversation_id, user1_id FROM conversations c WHERE NOT EXISTS ("
+        "SELECT 1 FROM conversation_read_states r WHERE r.conversation_id = c.conversation_id AND r.user_id = c.user1_id)"
+    )
+    op.execute(
+        "INSERT INTO conversation_read_states (conversation_id, user_id) "
+        "SELECT conversation_id, user2_id FROM conversations c WHERE c.user2_id <> c.user1_id AND NOT EXISTS ("
+        "SELECT 1 FROM conversation_read_states r WHERE r.conversation_id = c.conversation_id AND r.user_id = c.user2_id)"
+    )
+    op.execute(
+        "UPDATE conversation_read_states SET unread_count = ("
+        "SELECT COUNT(*) FROM messages m WHERE m.conversation_id = conversation_read_states.conversation_id "
+        "AND m.message_id > conversation_read_states.last_read_message_id "
+        "AND m.sender_id <> conversation_read_states.user_id)"
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('conversation_read_states', 'unread_count')
+    op.drop_column('conversation_read_states', 'last_delivered_message_id')
@@ -0,0 +1,26 @@
+"""Add (conversation_id, message_id) index to messages table
+
+Revision ID: 3b8f2c1d9a47
+Revises: 46675d7fe1e9
+Create Date: 2026-10-18 09:12:04.218531
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b8f2c1d9a47'
+down_revision: Union[str, None] = '46675d7fe1e9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_messages_conversation_id_message_id', 'messages', ['conversation_id', 'message_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_messages_conversation_id_message_id', table_name='messages')
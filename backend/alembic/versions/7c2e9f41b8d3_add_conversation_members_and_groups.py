@@ -0,0 +1,57 @@
+"""Add conversation_members and group conversations
+
+Revision ID: 7c2e9f41b8d3
+Revises: 0a9d4e7b3c16
+Create Date: 2026-10-18 17:12:36.402117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c2e9f41b8d3'
+down_revision: Union[str, None] = '0a9d4e7b3c16'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'conversation_members',
+        sa.Column('conversation_id', sa.Integer(), sa.ForeignKey('conversations.conversation_id'), primary_key=True),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.user_id'), primary_key=True),
+        sa.Column('role', sa.String(length=20), server_default='member', nullable=False),
+        sa.Column('joined_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+    )
+    op.create_index('ix_conversation_members_user_id_conversation_id', 'conversation_members', ['user_id', 'conversation_id'])
+
+    op.add_column('conversations', sa.Column('is_group', sa.Boolean(), server_default='0', nullable=False))
+    op.add_column('conversations', sa.Column('title', sa.String(length=100), nullable=True))
+    # groups have no pair; NULLs never collide in the pair's unique index
+    op.alter_column('conversations', 'user1_id', existing_type=sa.Integer(), nullable=True)
+    op.alter_column('conversations', 'user2_id', existing_type=sa.Integer(), nullable=True)
+
+    # every existing 1:1 chat keeps both of its users as members
+    op.execute(
+        "INSERT INTO conversation_members (conversation_id, user_id) "
+        "SELECT conversation_id, user1_id FROM conversations"
+    )
+    op.execute(
+        "INSERT INTO conversation_members (conversation_id, user_id) "
+        "SELECT conversation_id, user2_id FROM conversations WHERE user2_id <> user1_id"
+    )
+
+
+def downgrade() -> None:
+    # groups can't be represented as pairs
+    op.execute("DELETE FROM conversation_read_states WHERE conversation_id IN (SELECT conversation_id FROM conversations WHERE is_group = 1)")
+    op.execute("DELETE FROM messages WHERE conversation_id IN (SELECT conversation_id FROM conversations WHERE is_group = 1)")
+    op.drop_table('conversation_members')
+    op.execute("DELETE FROM conversations WHERE is_group = 1")
+    op.alter_column('conversations', 'user2_id', existing_type=sa.Integer(), nullable=False)
+    op.alter_column('conversations', 'user1_id', existing_type=sa.Integer(), nullable=False)
+    op.drop_column('conversations', 'title')
+    op.drop_column('conversations', 'is_group')
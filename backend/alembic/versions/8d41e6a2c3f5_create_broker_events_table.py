@@ -0,0 +1,38 @@
+"""Create broker_events table
+
+Revision ID: 8d41e6a2c3f5
+Revises: 3b8f2c1d9a47
+Create Date: 2026-10-18 10:03:47.552190
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d41e6a2c3f5'
+down_revision: Union[str, None] = '3b8f2c1d9a47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'broker_events',
+        sa.Column('event_id', sa.Integer(), nullable=False),
+        sa.Column('channel', sa.String(length=255), nullable=False),
+        sa.Column('payload', sa.Text().with_variant(mysql.LONGTEXT(), 'mysql'), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('event_id'),
+    )
+    op.create_index(op.f('ix_broker_events_event_id'), 'broker_events', ['event_id'], unique=False)
+    op.create_index(op.f('ix_broker_events_created_at'), 'broker_events', ['created_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_broker_events_created_at'), table_name='broker_events')
+    op.drop_index(op.f('ix_broker_events_event_id'), table_name='broker_events')
+    op.drop_table('broker_events')
@@ -0,0 +1,43 @@
+"""Add password_reset_tokens and attempt_counters
+
+Revision ID: 9e4b2c7d1a60
+Revises: d3a7f0c84e2b
+Create Date: 2026-10-18 20:11:07.583920
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9e4b2c7d1a60'
+down_revision: Union[str, None] = 'd3a7f0c84e2b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'password_reset_tokens',
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.user_id'), primary_key=True),
+        sa.Column('token_hash', sa.String(length=64), nullable=False),
+        sa.Column('attempts', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+    )
+    op.create_index(op.f('ix_password_reset_tokens_expires_at'), 'password_reset_tokens', ['expires_at'])
+    op.create_table(
+        'attempt_counters',
+        sa.Column('key', sa.String(length=100), primary_key=True),
+        sa.Column('count', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('window_ends_at', sa.DateTime(), nullable=False),
+    )
+    op.create_index(op.f('ix_attempt_counters_window_ends_at'), 'attempt_counters', ['window_ends_at'])
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_attempt_counters_window_ends_at'), table_name='attempt_counters')
+    op.drop_table('attempt_counters')
+    op.drop_index(op.f('ix_password_reset_tokens_expires_at'), table_name='password_reset_tokens')
+    op.drop_table('password_reset_tokens')
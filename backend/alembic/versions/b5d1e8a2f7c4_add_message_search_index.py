@@ -0,0 +1,53 @@
+"""Add a full-text index on messages.message_text
+
+Revision ID: b5d1e8a2f7c4
+Revises: 7c2e9f41b8d3
+Create Date: 2026-10-18 17:41:09.553820
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b5d1e8a2f7c4'
+down_revision: Union[str, None] = '7c2e9f41b8d3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# same statements as search.SQLITE_FTS_DDL, copied so the migration doesn't change with the app
+SQLITE_FTS_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+    "message_text, content='messages', content_rowid='message_id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN "
+    "INSERT INTO messages_fts(rowid, message_text) VALUES (new.message_id, new.message_text); END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN "
+    "INSERT INTO messages_fts(messages_fts, rowid, message_text) VALUES ('delete', old.message_id, old.message_text); END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF message_text ON messages BEGIN "
+    "INSERT INTO messages_fts(messages_fts, rowid, message_text) VALUES ('delete', old.message_id, old.message_text); "
+    "INSERT INTO messages_fts(rowid, message_text) VALUES (new.message_id, new.message_text); END",
+)
+
+
+def upgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    if dialect == 'mysql':
+        # InnoDB builds it from the existing rows and maintains it on every insert
+        op.create_index('ix_messages_message_text_fulltext', 'messages', ['message_text'], mysql_prefix='FULLTEXT')
+    elif dialect == 'sqlite':
+        for statement in SQLITE_FTS_DDL:
+            op.execute(statement)
+        op.execute("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+
+
+def downgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    if dialect == 'mysql':
+        op.drop_index('ix_messages_message_text_fulltext', table_name='messages')
+    elif dialect == 'sqlite':
+        for trigger in ('messages_fts_update', 'messages_fts_delete', 'messages_fts_insert'):
+            op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        op.execute("DROP TABLE IF EXISTS messages_fts")
@@ -0,0 +1,28 @@
+"""Add client_msg_id to messages table
+
+Revision ID: c27a9e5b1f08
+Revises: 8d41e6a2c3f5
+Create Date: 2026-10-18 11:26:15.904337
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c27a9e5b1f08'
+down_revision: Union[str, None] = '8d41e6a2c3f5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('messages', sa.Column('client_msg_id', sa.String(length=64), nullable=True))
+    op.create_unique_constraint('uq_messages_sender_id_client_msg_id', 'messages', ['sender_id', 'client_msg_id'])
+
+
+def downgrade() -> None:
+    op.drop_constraint('uq_messages_sender_id_client_msg_id', 'messages', type_='unique')
+    op.drop_column('messages', 'client_msg_id')
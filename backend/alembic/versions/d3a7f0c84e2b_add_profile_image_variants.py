@@ -0,0 +1,34 @@
+"""Add profile image thumbnails and content-addressed profile_images
+
+Revision ID: d3a7f0c84e2b
+Revises: b5d1e8a2f7c4
+Create Date: 2026-10-18 19:04:51.218406
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd3a7f0c84e2b'
+down_revision: Union[str, None] = 'b5d1e8a2f7c4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('profile_image_thumb_url', sa.String(length=500), nullable=True))
+    op.create_table(
+        'profile_images',
+        sa.Column('content_hash', sa.String(length=64), primary_key=True),
+        sa.Column('url', sa.String(length=500), nullable=False),
+        sa.Column('thumb_url', sa.String(length=500), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('profile_images')
+    op.drop_column('users', 'profile_image_thumb_url')
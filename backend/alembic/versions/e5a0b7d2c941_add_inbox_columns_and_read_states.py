@@ -0,0 +1,46 @@
+"""Add last_message_id, participant indexes and conversation_read_states for the inbox
+
+Revision ID: e5a0b7d2c941
+Revises: c27a9e5b1f08
+Create Date: 2026-10-18 14:02:37.551820
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5a0b7d2c941'
+down_revision: Union[str, None] = 'c27a9e5b1f08'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('conversations', sa.Column('last_message_id', sa.Integer(), server_default='0', nullable=False))
+    # backfill from the (conversation_id, message_id) index
+    op.execute(
+        "UPDATE conversations SET last_message_id = COALESCE("
+        "(SELECT MAX(messages.message_id) FROM messages WHERE messages.conversation_id = conversations.conversation_id), 0)"
+    )
+    op.create_index('ix_conversations_user1_id_last_message_id', 'conversations', ['user1_id', 'last_message_id'], unique=False)
+    op.create_index('ix_conversations_user2_id_last_message_id', 'conversations', ['user2_id', 'last_message_id'], unique=False)
+
+    op.create_table(
+        'conversation_read_states',
+        sa.Column('conversation_id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('last_read_message_id', sa.Integer(), server_default='0', nullable=False),
+        sa.ForeignKeyConstraint(['conversation_id'], ['conversations.conversation_id']),
+        sa.ForeignKeyConstraint(['user_id'], ['users.user_id']),
+        sa.PrimaryKeyConstraint('conversation_id', 'user_id'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('conversation_read_states')
+    op.drop_index('ix_conversations_user2_id_last_message_id', table_name='conversations')
+    op.drop_index('ix_conversations_user1_id_last_message_id', table_name='conversations')
+    op.drop_column('conversations', 'last_message_id')
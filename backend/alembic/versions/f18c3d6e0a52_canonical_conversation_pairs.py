@@ -0,0 +1,76 @@
+"""Store conversations as ordered user pairs with a unique index
+
+Revision ID: f18c3d6e0a52
+Revises: e5a0b7d2c941
+Create Date: 2026-10-18 15:20:48.106395
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f18c3d6e0a52'
+down_revision: Union[str, None] = 'e5a0b7d2c941'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    rows = conn.execute(sa.text(
+        "SELECT conversation_id, user1_id, user2_id, last_message_id FROM conversations ORDER BY conversation_id"
+    )).fetchall()
+
+    # the oldest conversation of a pair survives; later duplicates are merged into it
+    survivors = {}
+    for conversation_id, user1_id, user2_id, last_message_id in rows:
+        pair = (min(user1_id, user2_id), max(user1_id, user2_id))
+        if pair not in survivors:
+            survivors[pair] = conversation_id
+            if (user1_id, user2_id) != pair:
+                conn.execute(
+                    sa.text("UPDATE conversations SET user1_id = :low, user2_id = :high WHERE conversation_id = :id"),
+                    {"low": pair[0], "high": pair[1], "id": conversation_id},
+                )
+            continue
+
+        keep = survivors[pair]
+        params = {"keep": keep, "dup": conversation_id}
+        conn.execute(sa.text("UPDATE messages SET conversation_id = :keep WHERE conversation_id = :dup"), params)
+        conn.execute(
+            sa.text("UPDATE conversations SET last_message_id = :last WHERE conversation_id = :keep AND last_message_id < :last"),
+            {"keep": keep, "last": last_message_id},
+        )
+        # keep the furthest read marker of each user
+        read_states = conn.execute(
+            sa.text("SELECT user_id, last_read_message_id FROM conversation_read_states WHERE conversation_id = :dup"), params
+        ).fetchall()
+        for user_id, last_read_message_id in read_states:
+            current = conn.execute(
+                sa.text("SELECT last_read_message_id FROM conversation_read_states WHERE conversation_id = :keep AND user_id = :user"),
+                {"keep": keep, "user": user_id},
+            ).scalar()
+            if current is None:
+                conn.execute(
+                    sa.text("INSERT INTO conversation_read_states (conversation_id, user_id, last_read_message_id) VALUES (:keep, :user, :last)"),
+                    {"keep": keep, "user": user_id, "last": last_read_message_id},
+                )
+            elif last_read_message_id > current:
+                conn.execute(
+                    sa.text("UPDATE conversation_read_states SET last_read_message_id = :last WHERE conversation_id = :keep AND user_id = :user"),
+                    {"keep": keep, "user": user_id, "last": last_read_message_id},
+                )
+        conn.execute(sa.text("DELETE FROM conversation_read_states WHERE conversation_id = :dup"), params)
+        conn.execute(sa.text("DELETE FROM conversations WHERE conversation_id = :dup"), params)
+
+    op.create_unique_constraint('uq_conversations_user1_id_user2_id', 'conversations', ['user1_id', 'user2_id'])
+    op.create_check_constraint('ck_conversations_ordered_pair', 'conversations', 'user1_id <= user2_id')
+
+
+def downgrade() -> None:
+    # merged duplicates are not split back out
+    op.drop_constraint('ck_conversations_ordered_pair', 'conversations', type_='check')
+    op.drop_constraint('uq_conversations_user1_id_user2_id', 'conversations', type_='unique')
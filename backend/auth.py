@@ -2,9 +2,10 @@ import jwt
 from datetime import datetime, timedelta
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 import crud
 from database import get_db
+from principal_cache import principal_cache
 import os
 from dotenv import load_dotenv  
 
@@ -32,24 +33,39 @@ def verify_token(token: str):
     
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
     
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     
+    user = await get_user_from_token(db, token)
+    if user is None:
+        raise credentials_exception
+    return user
+
+# Resolve a bearer token to its user, or None; shared by HTTP routes and WebSockets
+async def get_user_from_token(db: AsyncSession, token: str):
+    if not token:
+        return None
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
-            raise credentials_exception
+            return None
     except jwt.PyJWTError:
-        raise credentials_exception
-    
-    user = crud.get_user_by_username(db, username=username)
-    if user is None:
-        raise credentials_exception
+        return None
+
+    # tokens from create_access_token carry user_id; older ones fall back to the username lookup
+    user_id = payload.get("user_id")
+    if user_id is not None:
+        user = principal_cache.get(user_id)
+        if user is not None and user.username == username:
+            return user
+    user = await crud.get_user_by_username(db, username=username)
+    if user is not None and user.user_id == user_id:
+        principal_cache.put(user)
     return user
 
 
@@ -0,0 +1,243 @@
+# broker.py
+# Pub/sub transport used to fan WebSocket traffic out across worker processes.
+# Every process subscribes only to the channels it has local sockets for.
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Set
+
+from sqlalchemy import delete, func, select
+
+import database
+import models
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[str, str], Awaitable[None]]
+
+
+class Broker:
+    """Base class: keeps the local channel -> handlers map, backends move the bytes."""
+
+    def __init__(self):
+        self._handlers: Dict[str, Set[Handler]] = {}
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, channel: str, message: str):
+        raise NotImplementedError
+
+    async def subscribe(self, channel: str, handler: Handler):
+        handlers = self._handlers.setdefault(channel, set())
+        first = not handlers
+        handlers.add(handler)
+        if first:
+            await self._subscribe(channel)
+
+    async def unsubscribe(self, channel: str, handler: Handler):
+        handlers = self._handlers.get(channel)
+        if not handlers:
+            return
+        handlers.discard(handler)
+        if not handlers:
+            del self._handlers[channel]
+            await self._unsubscribe(channel)
+
+    # hooks for backends that need to tell a server about (un)subscriptions
+    async def _subscribe(self, channel: str):
+        pass
+
+    async def _unsubscribe(self, channel: str):
+        pass
+
+    async def _dispatch(self, channel: str, message: str):
+        for handler in list(self._handlers.get(channel, ())):
+            try:
+                await handler(channel, message)
+            except Exception:
+                logger.exception("Broker handler failed for channel %s", channel)
+
+
+class InMemoryBroker(Broker):
+    """Single-process broker. Sharing one instance between several ConnectionManagers
+    stands in for a multi-worker deployment in local runs."""
+
+    async def publish(self, channel: str, message: str):
+        await self._dispatch(channel, message)
+
+
+class RedisBroker(Broker):
+    """Broker for anything that speaks the Redis protocol (Redis, Valkey, KeyDB, ...)."""
+
+    def __init__(self, url: str):
+        super().__init__()
+        self.url = url
+        self._redis = None
+        self._pubsub = None
+        self._reader = None
+
+    async def start(self):
+        try:
+            import redis.asyncio as aioredis
+        except ImportError:
+            raise RuntimeError("BROKER_URL points at Redis but the 'redis' package is not installed")
+        self._redis = aioredis.from_url(self.url, decode_responses=True)
+        self._pubsub = self._redis.pubsub()
+        self._reader = asyncio.create_task(self._read_loop())
+
+    async def stop(self):
+        if self._reader:
+            self._reader.cancel()
+        if self._pubsub:
+            await self._pubsub.aclose()
+        if self._redis:
+            await self._redis.aclose()
+
+    async def publish(self, channel: str, message: str):
+        await self._redis.publish(channel, message)
+
+    async def _subscribe(self, channel: str):
+        await self._pubsub.subscribe(channel)
+
+    async def _unsubscribe(self, channel: str):
+        await self._pubsub.unsubscribe(channel)
+
+    async def _read_loop(self):
+        while True:
+            if not self._pubsub.subscribed:
+                await asyncio.sleep(0.05)
+                continue
+            try:
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Redis broker read failed, retrying")
+                await asyncio.sleep(1)
+                continue
+            if message and message["type"] == "message":
+                await self._dispatch(message["channel"], message["data"])
+
+
+class DatabaseBroker(Broker):
+    """Fallback for deployments without Redis: events go through the broker_events table
+    (MySQL, Postgres or SQLite) and every process polls for the channels it serves.
+    Latency is bounded by the poll interval.
+
+    Auto-increment ids are handed out at insert but become visible at commit, so a lower id can
+    show up after a higher one. The cursor therefore only passes an id settle_seconds after it
+    was first seen, rows above it are read again on every poll, and the ids delivered since are
+    remembered so none is dispatched twice. A publish whose commit lags its insert by more than
+    settle_seconds can still be missed."""
+
+    def __init__(self, poll_interval: float = 0.2, retention_seconds: int = 300, settle_seconds: float = 5):
+        super().__init__()
+        self.poll_interval = poll_interval
+        self.retention_seconds = retention_seconds
+        self.settle_seconds = settle_seconds
+        self._last_event_id = 0
+        self._delivered: OrderedDict[int, float] = OrderedDict()  # event_id -> first seen (monotonic)
+        self._poller = None
+
+    async def start(self):
+        self._last_event_id = await self._max_event_id()
+        self._poller = asyncio.create_task(self._poll_loop())
+
+    async def stop(self):
+        if self._poller:
+            self._poller.cancel()
+
+    async def publish(self, channel: str, message: str):
+        async with database.AsyncSessionLocal() as db:
+            db.add(models.BrokerEvent(channel=channel, payload=message))
+            await db.commit()
+
+    async def _max_event_id(self) -> int:
+        async with database.AsyncSessionLocal() as db:
+            return (await db.execute(select(func.max(models.BrokerEvent.event_id)))).scalar() or 0
+
+    FETCH_LIMIT = 500  # rows per query; a poll pages on until a page comes back short
+
+    async def _fetch_events(self, channels, after_id: int):
+        async with database.AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(models.BrokerEvent.event_id, models.BrokerEvent.channel, models.BrokerEvent.payload)
+                .filter(models.BrokerEvent.event_id > after_id)
+                .filter(models.BrokerEvent.channel.in_(channels))
+                .order_by(models.BrokerEvent.event_id)
+                .limit(self.FETCH_LIMIT)
+            )
+            return result.all()
+
+    async def _prune_events(self):
+        cutoff = datetime.utcnow() - timedelta(seconds=self.retention_seconds)
+        async with database.AsyncSessionLocal() as db:
+            await db.execute(delete(models.BrokerEvent).filter(models.BrokerEvent.created_at < cutoff))
+            await db.commit()
+
+    async def _poll(self):
+        channels = list(self._handlers)
+        if not channels:
+            # nothing to serve: skip ahead so a later subscription doesn't replay old events
+            self._last_event_id = await self._max_event_id()
+            self._delivered.clear()
+            return
+        # the whole unsettled range is read, however many pages it takes: stopping at the first
+        # (already delivered) page would hold newer events back until it settles
+        after_id = self._last_event_id
+        while True:
+            events = await self._fetch_events(channels, after_id)
+            for event_id, channel, payload in events:
+                if event_id in self._delivered:
+                    continue
+                self._delivered[event_id] = time.monotonic()
+                await self._dispatch(channel, payload)
+            if len(events) < self.FETCH_LIMIT:
+                break
+            after_id = events[-1][0]
+        # an id seen settle_seconds ago has given every lower id that long to commit
+        settled = time.monotonic() - self.settle_seconds
+        while self._delivered:
+            event_id, seen_at = next(iter(self._delivered.items()))
+            if seen_at > settled:
+                break
+            self._delivered.popitem(last=False)
+            self._last_event_id = max(self._last_event_id, event_id)
+
+    async def _poll_loop(self):
+        polls = 0
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self._poll()
+                polls += 1
+                if polls * self.poll_interval >= self.retention_seconds:
+                    polls = 0
+                    await self._prune_events()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Database broker poll failed, retrying")
+
+
+def create_broker(url: str = None) -> Broker:
+    # BROKER_URL: memory:// (default, single process), redis://host:6379/0, or database
+    url = url or os.getenv("BROKER_URL", "memory://")
+    if url.startswith("memory://"):
+        return InMemoryBroker()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBroker(url)
+    if url == "database":
+        return DatabaseBroker(
+            poll_interval=float(os.getenv("BROKER_POLL_INTERVAL", "0.2")),
+            retention_seconds=int(os.getenv("BROKER_RETENTION_SECONDS", "300")),
+            settle_seconds=float(os.getenv("BROKER_SETTLE_SECONDS", "5")),
+        )
+    raise ValueError(f"Unsupported BROKER_URL: {url}")
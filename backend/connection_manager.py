@@ -0,0 +1,280 @@
+# connection_manager.py
+import asyncio
+import logging
+import os
+import time
+import uuid
+from typing import Dict, Optional
+
+from fastapi import WebSocket
+from dotenv import load_dotenv
+
+from broker import Broker
+from payloads import MSGPACK_SUBPROTOCOL, Frame
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Outbound backpressure: every socket gets a bounded queue drained by its own writer task
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "100"))
+WS_QUEUE_POLICY = os.getenv("WS_QUEUE_POLICY", "drop_oldest")  # drop_oldest | disconnect
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))
+
+# Heartbeat: a ping frame every WS_PING_INTERVAL seconds; a socket that has sent nothing
+# (not even a pong) for WS_IDLE_TIMEOUT seconds is treated as dead and closed
+WS_PING_INTERVAL = float(os.getenv("WS_PING_INTERVAL", "20"))
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", "60"))
+WS_MAX_CONNECTIONS = int(os.getenv("WS_MAX_CONNECTIONS", "50000"))
+WS_MAX_CONNECTIONS_PER_USER = int(os.getenv("WS_MAX_CONNECTIONS_PER_USER", "10"))
+
+DROP_OLDEST = "drop_oldest"
+DISCONNECT = "disconnect"
+
+PING_FRAME = Frame('{"type":"ping"}')  # shared by every socket, packed for msgpack once
+
+
+def conversation_channel(conversation_id: int) -> str:
+    return f"conversation:{conversation_id}"
+
+
+def resident_memory_bytes() -> Optional[int]:
+    # Linux only; elsewhere the per-socket memory gauge is left out
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class Connection:
+    """A local socket plus its outbound queue and writer task."""
+    __slots__ = ("websocket", "conversation_id", "user_id", "binary", "queue", "writer", "dropped", "last_seen")
+
+    def __init__(self, websocket: WebSocket, conversation_id: int, user_id: int, max_queue_size: int,
+                 binary: bool = False):
+        self.websocket = websocket
+        self.conversation_id = conversation_id
+        self.user_id = user_id
+        self.binary = binary  # msgpack binary frames instead of JSON text
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self.writer: asyncio.Task = None
+        self.dropped = 0
+        self.last_seen = time.monotonic()  # last frame received from the client
+
+
+# WebSocket connection manager
+# Sockets are held per process; messages for conversations with sockets on other
+# workers travel through the broker.
+class ConnectionManager:
+    def __init__(self, broker: Broker, max_queue_size: int = WS_SEND_QUEUE_SIZE,
+                 overflow_policy: str = WS_QUEUE_POLICY, send_timeout: float = WS_SEND_TIMEOUT,
+                 ping_interval: float = WS_PING_INTERVAL, idle_timeout: float = WS_IDLE_TIMEOUT,
+                 max_connections: int = WS_MAX_CONNECTIONS, max_connections_per_user: int = WS_MAX_CONNECTIONS_PER_USER):
+        if overflow_policy not in (DROP_OLDEST, DISCONNECT):
+            raise ValueError(f"Unknown WS_QUEUE_POLICY: {overflow_policy}")
+        self.broker = broker
+        self.max_queue_size = max_queue_size
+        self.overflow_policy = overflow_policy
+        self.send_timeout = send_timeout
+        self.ping_interval = ping_interval
+        self.idle_timeout = idle_timeout
+        self.max_connections = max_connections
+        self.max_connections_per_user = max_connections_per_user
+        self.node_id = uuid.uuid4().hex  # lets us skip our own messages coming back from the broker
+        # dicts used as insertion-ordered sets: registering and removing a socket is O(1)
+        self.active_connections: Dict[int, Dict[Connection, None]] = {}  # conversation_id -> Connections
+        self.user_connections: Dict[int, Dict[Connection, None]] = {}  # user_id -> Connections
+        self.connection_count = 0
+        self._cleanup_tasks = set()
+        self._heartbeat: Optional[asyncio.Task] = None
+        # counters for /metrics
+        self.rejected = 0
+        self.reaped = 0
+        self.dropped = 0
+        self.publish_errors = 0
+
+    async def start(self):
+        self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+
+    async def stop(self):
+        if self._heartbeat:
+            self._heartbeat.cancel()
+            try:
+                await self._heartbeat
+            except asyncio.CancelledError:
+                pass
+            self._heartbeat = None
+
+    async def connect(self, websocket: WebSocket, conversation_id: int, user_id: int,
+                      subprotocol: str = None) -> Optional[Connection]:
+        """Accept and register the socket, or close it and return None when a cap is reached."""
+        await websocket.accept(subprotocol=subprotocol)
+        if self.connection_count >= self.max_connections:
+            self.rejected += 1
+            await websocket.close(code=1013, reason="Server at capacity")  # try again later
+            return None
+        if len(self.user_connections.get(user_id, ())) >= self.max_connections_per_user:
+            self.rejected += 1
+            await websocket.close(code=1008, reason="Too many connections")
+            return None
+
+        connection = Connection(websocket, conversation_id, user_id, self.max_queue_size,
+                                binary=subprotocol == MSGPACK_SUBPROTOCOL)
+        connection.writer = asyncio.create_task(self._write_loop(connection))
+        if conversation_id not in self.active_connections:
+            self.active_connections[conversation_id] = {}
+            await self.broker.subscribe(conversation_channel(conversation_id), self._on_broker_message)
+        self.active_connections[conversation_id][connection] = None
+        self.user_connections.setdefault(user_id, {})[connection] = None
+        self.connection_count += 1
+        return connection
+
+    async def disconnect(self, connection: Connection):
+        await self._remove(connection)
+
+    def disconnect_member(self, conversation_id: int, user_id: int):
+        # removed from the conversation: their sockets for it are closed, other chats stay open
+        for connection in list(self.user_connections.get(user_id, ())):
+            if connection.conversation_id == conversation_id:
+                self._schedule_remove(connection, close_code=1008, reason="Removed from conversation")
+
+    async def close(self, connection: Connection, close_code: int, reason: str):
+        # closed by the server, e.g. for flooding; the endpoint's disconnect() is then a no-op
+        await self._remove(connection, close_code=close_code, reason=reason)
+
+    def touch(self, connection: Connection):
+        # any frame from the client, pongs included, proves the socket is alive
+        connection.last_seen = time.monotonic()
+
+    def stats(self) -> dict:
+        queued = sum(connection.queue.qsize()
+                     for connections in self.active_connections.values() for connection in connections)
+        resident = resident_memory_bytes()
+        return {
+            "connections": self.connection_count,
+            "max_connections": self.max_connections,
+            "conversations": len(self.active_connections),
+            "users": len(self.user_connections),
+            "queued_frames": queued,
+            "dropped_frames": self.dropped,
+            "publish_errors": self.publish_errors,
+            "rejected": self.rejected,
+            "reaped": self.reaped,
+            "resident_bytes": resident,
+            # the whole process divided over its sockets: an upper bound, useful as a trend
+            "resident_bytes_per_connection": resident // self.connection_count if resident and self.connection_count else None,
+        }
+
+    async def send_message(self, message: str, conversation_id: int):
+        # deliver to our own sockets right away, then let the other workers know
+        self._deliver(message, conversation_id)
+        # "<origin> <conversation_id> <frame>": the frame travels as-is, never escaped into another JSON string
+        envelope = f"{self.node_id} {conversation_id} {message}"
+        try:
+            await self.broker.publish(conversation_channel(conversation_id), envelope)
+        except Exception:
+            # the message is stored and acked already: other workers' sockets miss the frame
+            # (their clients catch up through /sync), but the sender's request must not fail
+            self.publish_errors += 1
+            logger.exception("Broker publish failed for conversation %s", conversation_id)
+
+    def send_local(self, message: str, conversation_id: int):
+        # for events every worker derives on its own, so nothing goes through the broker
+        self._deliver(message, conversation_id)
+
+    def send_personal(self, connection: Connection, message: str):
+        # replies (acks, errors) go through the same queue so frames to one socket never interleave
+        self._enqueue(connection, Frame(message))
+
+    async def _on_broker_message(self, channel: str, envelope: str):
+        origin, conversation_id, message = envelope.split(" ", 2)
+        if origin == self.node_id:
+            return
+        self._deliver(message, int(conversation_id))
+
+    def _deliver(self, message: str, conversation_id: int):
+        # never awaits a socket: a slow client only fills up its own queue.
+        # Every queue gets the same Frame, so it is packed for binary sockets only once.
+        frame = Frame(message)
+        for connection in list(self.active_connections.get(conversation_id, ())):
+            self._enqueue(connection, frame)
+
+    def _enqueue(self, connection: Connection, frame: Frame):
+        try:
+            connection.queue.put_nowait(frame)
+            return
+        except asyncio.QueueFull:
+            pass
+
+        if self.overflow_policy == DROP_OLDEST:
+            connection.queue.get_nowait()
+            connection.queue.put_nowait(frame)
+            connection.dropped += 1
+            self.dropped += 1
+        else:
+            logger.info("Disconnecting slow consumer in conversation %s", connection.conversation_id)
+            self._schedule_remove(connection, close_code=1008, reason="Slow consumer")
+
+    async def _write_loop(self, connection: Connection):
+        try:
+            while True:
+                frame = await connection.queue.get()
+                if connection.binary:
+                    send = connection.websocket.send_bytes(frame.packed())
+                else:
+                    send = connection.websocket.send_text(frame.text)
+                await asyncio.wait_for(send, self.send_timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # closed, half-dead or timed-out socket: drop it instead of failing the broadcast
+            self._schedule_remove(connection, close_code=1011, reason="Send failed")
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            try:
+                self._check_connections()
+            except Exception:
+                logger.exception("WebSocket heartbeat failed")
+
+    def _check_connections(self):
+        # one pass over all local sockets per interval, instead of a timer per socket
+        deadline = time.monotonic() - self.idle_timeout
+        for connections in list(self.active_connections.values()):
+            for connection in list(connections):
+                if connection.last_seen < deadline:
+                    # half-open or unresponsive: nothing arrived, not even a pong
+                    self.reaped += 1
+                    self._schedule_remove(connection, close_code=1001, reason="Idle timeout")
+                else:
+                    self._enqueue(connection, PING_FRAME)
+
+    def _schedule_remove(self, connection: Connection, close_code: int, reason: str):
+        task = asyncio.create_task(self._remove(connection, close_code, reason))
+        self._cleanup_tasks.add(task)
+        task.add_done_callback(self._cleanup_tasks.discard)
+
+    async def _remove(self, connection: Connection, close_code: int = None, reason: str = None):
+        connections = self.active_connections.get(connection.conversation_id)
+        if connections is None or connection not in connections:
+            return
+        del connections[connection]
+        if not connections:
+            del self.active_connections[connection.conversation_id]
+        user_connections = self.user_connections[connection.user_id]
+        del user_connections[connection]
+        if not user_connections:
+            del self.user_connections[connection.user_id]
+        self.connection_count -= 1
+        if connection.writer is not asyncio.current_task():
+            connection.writer.cancel()
+        if close_code is not None:
+            try:
+                await asyncio.wait_for(connection.websocket.close(code=close_code, reason=reason), self.send_timeout)
+            except Exception:
+                pass  # the peer is already gone
+        # a new socket may have re-registered the conversation while we were closing
+        if connection.conversation_id not in self.active_connections:
+            await self.broker.unsubscribe(conversation_channel(connection.conversation_id), self._on_broker_message)
@@ -1,116 +1,449 @@
-#  crud.py 
-from sqlalchemy.orm import Session
+#  crud.py
+from sqlalchemy import select, insert, update, delete, union_all, func, and_, case, cast, null, Integer
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
+from sqlalchemy.ext.asyncio import AsyncSession
 import models
-from typing import List
-from datetime import datetime
+from message_cache import recent_messages
+from membership_cache import membership_cache
+from principal_cache import principal_cache
+from typing import FrozenSet, Iterable, List, Optional
 # from pydantic import EmailStr
 
-# password hashing setup
-from passlib.context import CryptContext
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# password hashing setup (bcrypt runs on the bounded pool in password_hasher.py)
+from password_hasher import password_hasher
 
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
-
-def verify_password(password:str, hashed_password: str) -> bool:
-    return pwd_context.verify(password, hashed_password)
-
-def create_user(db: Session, username:str, email:str, password:str):
-    password_hash = hash_password(password)
+async def create_user(db: AsyncSession, username:str, email:str, password:str):
+    password_hash = await password_hasher.hash(password)
     db_user = models.User(username=username, email = email, password_hash=password_hash)
     db.add(db_user)
-    db.commit() 
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
-def get_user_by_username(db: Session, username: str):
-    return db.query(models.User).filter(models.User.username==username).first()
+async def get_user_by_username(db: AsyncSession, username: str):
+    result = await db.execute(select(models.User).filter(models.User.username==username))
+    return result.scalars().first()
 
-def get_user_by_id(db: Session, user_id: int):
-    return db.query(models.User).filter(models.User.user_id==user_id).first()
+async def get_user_by_id(db: AsyncSession, user_id: int):
+    result = await db.execute(select(models.User).filter(models.User.user_id==user_id))
+    return result.scalars().first()
 
-def get_user_by_email(db: Session, email: str):
-    return db.query(models.User).filter(models.User.email==email).first()
+async def get_user_by_email(db: AsyncSession, email: str):
+    result = await db.execute(select(models.User).filter(models.User.email==email))
+    return result.scalars().first()
 
-def authenticate_user(db: Session, username: str, password: str):
-    hashed_password = hash_password(password)
-    db_user = get_user_by_username(db, username=username)
+async def authenticate_user(db: AsyncSession, username: str, password: str):
+    db_user = await get_user_by_username(db, username=username)
     if not db_user:
         return False
-    if not verify_password(password, db_user.password_hash):
+    valid, new_hash = await password_hasher.verify_and_update(password, db_user.password_hash)
+    if not valid:
         return False
+    if new_hash:
+        # BCRYPT_ROUNDS changed since this hash was made: upgrade it while we have the password
+        db_user.password_hash = new_hash
+        await db.commit()
+        principal_cache.invalidate(db_user.user_id)
     return db_user
 
 
 #  sub-functions for new-conversation end point
-def get_conversation_between_users(db: Session, user1_id: int, user2_id: int):
-    return db.query(models.Conversation).filter(
-        ((models.Conversation.user1_id==user1_id)&(models.Conversation.user2_id==user2_id))|
-        ((models.Conversation.user1_id==user2_id)&(models.Conversation.user2_id==user1_id))
-    ).first()
+# Conversations are stored with the lower user id in user1_id, so a pair has exactly one
+# row and looking it up is a single seek on the (user1_id, user2_id) unique index.
+def conversation_pair(user1_id: int, user2_id: int):
+    return min(user1_id, user2_id), max(user1_id, user2_id)
+
+async def get_conversation_between_users(db: AsyncSession, user1_id: int, user2_id: int):
+    low, high = conversation_pair(user1_id, user2_id)
+    result = await db.execute(select(models.Conversation).filter(
+        models.Conversation.user1_id == low,
+        models.Conversation.user2_id == high
+    ))
+    return result.scalars().first()
+
+
+# INSERT that leaves an existing row with the same key alone, in the dialect's own upsert syntax
+async def insert_if_missing(db: AsyncSession, model, values: dict, key: List[str]):
+    dialect = db.bind.dialect.name
+    if dialect == "mysql":
+        stmt = mysql_insert(model).values(**values)
+        await db.execute(stmt.on_duplicate_key_update({key[0]: stmt.inserted[key[0]]}))
+    elif dialect in ("sqlite", "postgresql"):
+        stmt = (sqlite_insert if dialect == "sqlite" else postgresql_insert)(model).values(**values)
+        await db.execute(stmt.on_conflict_do_nothing(index_elements=key))
+    else:
+        try:
+            async with db.begin_nested():
+                await db.execute(insert(model).values(**values))
+        except IntegrityError:
+            pass
+
+# Upsert: concurrent requests for the same pair all end up with the one row
+async def get_or_create_conversation(db: AsyncSession, user1_id: int, user2_id: int):
+    low, high = conversation_pair(user1_id, user2_id)
+    await insert_if_missing(db, models.Conversation, {"user1_id": low, "user2_id": high}, ["user1_id", "user2_id"])
+    conversation = await get_conversation_between_users(db, low, high)
+    # both participants get a membership and a read state up front, so message inserts only ever UPDATE
+    for user_id in {low, high}:
+        await insert_if_missing(db, models.ConversationMember,
+                                {"conversation_id": conversation.conversation_id, "user_id": user_id},
+                                ["conversation_id", "user_id"])
+        await insert_if_missing(db, models.ConversationReadState,
+                                {"conversation_id": conversation.conversation_id, "user_id": user_id},
+                                ["conversation_id", "user_id"])
+    await db.commit()
+    return conversation
 
 
-def create_conversation(db: Session, user1_id: int, user2_id: int):
-    conversation = models.Conversation(user1_id=user1_id, user2_id=user2_id)
+# Groups: any number of members in conversation_members, no pair columns
+async def create_group(db: AsyncSession, owner_id: int, title: str, member_ids: Iterable[int]):
+    conversation = models.Conversation(is_group=True, title=title)
     db.add(conversation)
-    db.commit()
-    db.refresh(conversation)
+    await db.flush()
+    member_ids = set(member_ids) - {owner_id}
+    # one multi-row INSERT per table, however big the group
+    await db.execute(insert(models.ConversationMember), [
+        {"conversation_id": conversation.conversation_id, "user_id": user_id, "role": "member"} for user_id in member_ids
+    ] + [{"conversation_id": conversation.conversation_id, "user_id": owner_id, "role": "owner"}])
+    await db.execute(insert(models.ConversationReadState), [
+        {"conversation_id": conversation.conversation_id, "user_id": user_id} for user_id in member_ids | {owner_id}
+    ])
+    await db.commit()
+    await db.refresh(conversation)
     return conversation
 
+async def add_member(db: AsyncSession, conversation: models.Conversation, user_id: int):
+    await insert_if_missing(db, models.ConversationMember,
+                            {"conversation_id": conversation.conversation_id, "user_id": user_id},
+                            ["conversation_id", "user_id"])
+    # history from before they joined doesn't count as unread
+    await insert_if_missing(db, models.ConversationReadState,
+                            {"conversation_id": conversation.conversation_id, "user_id": user_id,
+                             "last_read_message_id": conversation.last_message_id,
+                             "last_delivered_message_id": conversation.last_message_id},
+                            ["conversation_id", "user_id"])
+    await db.commit()
+    await membership_cache.invalidate(conversation.conversation_id)
+
+async def remove_member(db: AsyncSession, conversation_id: int, user_id: int):
+    member = models.ConversationMember
+    role = (await db.execute(select(member.role).where(
+        member.conversation_id == conversation_id,
+        member.user_id == user_id,
+    ))).scalar()
+    await db.execute(delete(member).where(
+        member.conversation_id == conversation_id,
+        member.user_id == user_id,
+    ))
+    if role == "owner":
+        # a group always has an owner: the longest-standing member takes over, in the same transaction
+        successor = (await db.execute(
+            select(member.user_id).where(member.conversation_id == conversation_id)
+            .order_by(member.joined_at, member.user_id).limit(1).with_for_update()
+        )).scalar()
+        if successor is not None:
+            await db.execute(update(member).where(
+                member.conversation_id == conversation_id,
+                member.user_id == successor,
+            ).values(role="owner"))
+    await db.execute(delete(models.ConversationReadState).where(
+        models.ConversationReadState.conversation_id == conversation_id,
+        models.ConversationReadState.user_id == user_id,
+    ))
+    await db.commit()
+    await membership_cache.invalidate(conversation_id, removed=[user_id])
+
+async def get_member(db: AsyncSession, conversation_id: int, user_id: int):
+    return await db.get(models.ConversationMember, (conversation_id, user_id))
+
+# A page of members with their profiles, keyset on user_id
+async def get_members(db: AsyncSession, conversation_id: int, after_user_id: int = 0, limit: int = 100):
+    result = await db.execute(
+        select(models.User.user_id, models.User.username, models.User.profile_image_url, models.ConversationMember.role)
+        .join(models.ConversationMember, models.ConversationMember.user_id == models.User.user_id)
+        .where(models.ConversationMember.conversation_id == conversation_id, models.User.user_id > after_user_id)
+        .order_by(models.User.user_id)
+        .limit(limit)
+    )
+    return result.all()
+
+# Member ids through the membership cache: authorisation is a set lookup after the first load
+async def get_member_ids(db: AsyncSession, conversation_id: int) -> FrozenSet[int]:
+    member_ids = membership_cache.get(conversation_id)
+    if member_ids is None:
+        result = await db.execute(select(models.ConversationMember.user_id).where(
+            models.ConversationMember.conversation_id == conversation_id
+        ))
+        member_ids = frozenset(result.scalars().all())
+        if member_ids:
+            membership_cache.put(conversation_id, member_ids)
+    return member_ids
+
+async def is_member(db: AsyncSession, conversation_id: int, user_id: int) -> bool:
+    return user_id in await get_member_ids(db, conversation_id)
 
-# sub-functions for new-message end point 
-def get_conversation_by_id(db: Session, conversation_id: int):
-    return db.query(models.Conversation).filter(models.Conversation.conversation_id == conversation_id).first()
 
-def create_message(db: Session, conversation_id: int, sender_id: int, message_text: str):
+# sub-functions for new-message end point
+async def get_conversation_by_id(db: AsyncSession, conversation_id: int):
+    result = await db.execute(select(models.Conversation).filter(models.Conversation.conversation_id == conversation_id))
+    return result.scalars().first()
+
+async def create_message(db: AsyncSession, conversation_id: int, sender_id: int, message_text: str, client_msg_id: Optional[str] = None):
     new_message = models.Message(
         conversation_id=conversation_id,
         sender_id=sender_id,
-        message_text=message_text
+        message_text=message_text,
+        client_msg_id=client_msg_id
     )
     db.add(new_message)
-    db.commit()
-    db.refresh(new_message)
+    await db.flush()
+    await advance_last_message_id(db, conversation_id, new_message.message_id)
+    await add_unread(db, conversation_id, sender_id, 1)
+    await db.commit()
+    await db.refresh(new_message)
+    await recent_messages.add([new_message])
     return new_message
 
+# keeps Conversation.last_message_id current; runs in the transaction that inserted the message.
+# Works with an AsyncSession or an AsyncConnection (the MessageWriter batches on a connection).
+async def advance_last_message_id(db, conversation_id: int, message_id: int):
+    await db.execute(
+        update(models.Conversation)
+        .where(models.Conversation.conversation_id == conversation_id,
+               models.Conversation.last_message_id < message_id)
+        .values(last_message_id=message_id)
+    )
+
+# the recipient's unread counter goes up with every message, so the inbox never has to COUNT.
+# Direct chats only: in a group this would be one row per member on every send.
+async def add_unread(db, conversation_id: int, sender_id: int, count: int):
+    direct = select(models.Conversation.conversation_id).where(
+        models.Conversation.conversation_id == conversation_id,
+        ~models.Conversation.is_group,
+    )
+    await db.execute(
+        update(models.ConversationReadState)
+        .where(models.ConversationReadState.conversation_id == conversation_id,
+               models.ConversationReadState.conversation_id.in_(direct),
+               models.ConversationReadState.user_id != sender_id)
+        .values(unread_count=models.ConversationReadState.unread_count + count)
+    )
+
+# idempotency lookup for messages sent over the WebSocket
+async def get_message_by_client_msg_id(db: AsyncSession, sender_id: int, client_msg_id: str):
+    result = await db.execute(select(models.Message).filter(
+        models.Message.sender_id == sender_id,
+        models.Message.client_msg_id == client_msg_id
+    ))
+    return result.scalars().first()
+
 # displaying messages sub-fucntion
-def get_messages_in_conversation(db: Session, conversation_id: int):
-    return db.query(models.Message).filter(models.Message.conversation_id == conversation_id).order_by(models.Message.message_id).all()
+# Keyset pagination on message_id, served by the (conversation_id, message_id) index.
+# Without a cursor (or with before_id) the newest page is returned; with after_id the
+# page starts right after the cursor. Pages are always returned oldest-first.
+# Rows are plain column tuples (attribute access like a Message), not ORM objects: pages
+# are read-only, so they skip the identity map and go straight to payloads.encode_message.
+MESSAGE_COLUMNS = (
+    models.Message.message_id,
+    models.Message.conversation_id,
+    models.Message.sender_id,
+    models.Message.message_text,
+    models.Message.sent_at,
+    models.Message.client_msg_id,
+)
+
+async def get_messages_in_conversation(db: AsyncSession, conversation_id: int, before_id: Optional[int] = None,
+                                       after_id: Optional[int] = None, limit: int = 50):
+    query = select(*MESSAGE_COLUMNS).filter(models.Message.conversation_id == conversation_id)
+    if after_id is not None:
+        query = query.filter(models.Message.message_id > after_id)
+        if before_id is not None:
+            query = query.filter(models.Message.message_id < before_id)
+        result = await db.execute(query.order_by(models.Message.message_id.asc()).limit(limit))
+        return result.all()
+
+    if before_id is not None:
+        query = query.filter(models.Message.message_id < before_id)
+    result = await db.execute(query.order_by(models.Message.message_id.desc()).limit(limit))
+    messages = list(result.all())
+    messages.reverse()
+    return messages
 
 # fetch all conversations for the current user
-def get_user_conversations(db: Session, user_id: int):
-    return db.query(models.Conversation). filter(
-        (models.Conversation.user1_id == user_id) | 
+async def get_user_conversations(db: AsyncSession, user_id: int):
+    result = await db.execute(select(models.Conversation).filter(
+        (models.Conversation.user1_id == user_id) |
         (models.Conversation.user2_id == user_id)
-    ).all()
+    ))
+    return result.scalars().all()
 
 
-# Fetch users based on user IDs(multiple users based on multiple IDs)
-def get_users_by_ids(db: Session, user_ids: List[int]):
-    return db.query(models.User).filter(models.User.user_id.in_(user_ids)).all()
+# Inbox: the user's conversations newest-first, with the peer (or the group title), the last
+# message and the unread count. The direct halves of the UNION seek the (userN_id, last_message_id)
+# indexes instead of OR-scanning; groups come from the user's conversation_members rows.
+# Paging is keyset on (last_message_id, conversation_id).
+INBOX_PREVIEW_LENGTH = 100
+INBOX_UNREAD_CAP = 100  # group unread counts stop here
+
+def user_conversations(user_id: int):
+    Conversation = models.Conversation
+    Member = models.ConversationMember
+    return union_all(
+        select(Conversation.conversation_id, Conversation.user2_id.label("peer_id"), Conversation.last_message_id,
+               Conversation.is_group, Conversation.title)
+        .where(Conversation.user1_id == user_id),
+        # a conversation with yourself only comes back from the first half
+        select(Conversation.conversation_id, Conversation.user1_id.label("peer_id"), Conversation.last_message_id,
+               Conversation.is_group, Conversation.title)
+        .where(Conversation.user2_id == user_id, Conversation.user1_id != user_id),
+        select(Conversation.conversation_id, cast(null(), Integer).label("peer_id"), Conversation.last_message_id,
+               Conversation.is_group, Conversation.title)
+        .join(Member, Member.conversation_id == Conversation.conversation_id)
+        .where(Member.user_id == user_id, Conversation.is_group),
+    ).subquery("mine")
 
+async def get_inbox(db: AsyncSession, user_id: int, before_message_id: Optional[int] = None,
+                    before_conversation_id: Optional[int] = None, limit: int = 50):
+    mine = user_conversations(user_id)
 
-# sub function for get-conversation-id
-def get_conversation_by_usernames(db: Session, user1_id: int, user2_id: int):
-    return db.query(models.Conversation).filter(
-        ((models.Conversation.user1_id == user1_id) & (models.Conversation.user2_id == user2_id)) |
-        ((models.Conversation.user1_id == user2_id) & (models.Conversation.user2_id == user1_id))
-    ).first()
+    last_message = aliased(models.Message)
+    read_state = aliased(models.ConversationReadState)
+    # groups don't keep a counter (a message would update every member's row), so it is counted,
+    # but never past INBOX_UNREAD_CAP rows: clients show the cap as "99+"
+    unread_tail = (
+        select(models.Message.message_id)
+        .where(models.Message.conversation_id == mine.c.conversation_id,
+               models.Message.message_id > func.coalesce(read_state.last_read_message_id, 0),
+               models.Message.sender_id != user_id)
+        .limit(INBOX_UNREAD_CAP)
+        .correlate(mine, read_state)
+        .subquery("unread_tail")
+    )
+    group_unread = select(func.count()).select_from(unread_tail).scalar_subquery()
+
+    query = (
+        select(
+            mine.c.conversation_id,
+            models.User.user_id,
+            models.User.username,
+            func.coalesce(models.User.profile_image_thumb_url, models.User.profile_image_url).label("profile_image_url"),
+            last_message.message_id,
+            last_message.sender_id,
+            func.substr(last_message.message_text, 1, INBOX_PREVIEW_LENGTH).label("message_text"),
+            last_message.sent_at,
+            mine.c.is_group,
+            mine.c.title,
+            case(
+                (mine.c.is_group, group_unread),
+                else_=func.coalesce(read_state.unread_count, 0),
+            ).label("unread_count"),
+        )
+        .outerjoin(models.User, models.User.user_id == mine.c.peer_id)
+        .outerjoin(last_message, last_message.message_id == mine.c.last_message_id)
+        .outerjoin(read_state, and_(read_state.conversation_id == mine.c.conversation_id, read_state.user_id == user_id))
+    )
+    if before_message_id is not None:
+        if before_conversation_id is None:
+            query = query.where(mine.c.last_message_id < before_message_id)
+        else:
+            query = query.where(
+                (mine.c.last_message_id < before_message_id) |
+                ((mine.c.last_message_id == before_message_id) & (mine.c.conversation_id < before_conversation_id))
+            )
+    query = query.order_by(mine.c.last_message_id.desc(), mine.c.conversation_id.desc()).limit(limit)
+    result = await db.execute(query)
+    return result.all()
+
+# (conversation_id, last_message_id) for every conversation of the user: lets sync skip
+# the conversations a reconnecting client is already up to date on without touching messages
+async def get_conversation_heads(db: AsyncSession, user_id: int):
+    mine = user_conversations(user_id)
+    result = await db.execute(select(mine.c.conversation_id, mine.c.last_message_id).order_by(mine.c.conversation_id))
+    return result.all()
+
+# Read/delivered watermarks: the last message_id a user has seen (or received) in a conversation.
+# They only ever move forward; reading also recounts the (usually empty) unread tail.
+# Returns whether anything moved. The caller commits, so a batch of receipts is one transaction.
+async def update_read_state(db: AsyncSession, conversation_id: int, user_id: int,
+                            read_message_id: Optional[int] = None, delivered_message_id: Optional[int] = None):
+    ReadState = models.ConversationReadState
+    key = (ReadState.conversation_id == conversation_id, ReadState.user_id == user_id)
+    moved = 0
+    if read_message_id:
+        unread_after = (
+            select(func.count())
+            .where(models.Message.conversation_id == conversation_id,
+                   models.Message.message_id > read_message_id,
+                   models.Message.sender_id != user_id)
+            .scalar_subquery()
+        )
+        result = await db.execute(
+            update(ReadState)
+            .where(*key, ReadState.last_read_message_id < read_message_id)
+            .values(last_read_message_id=read_message_id, unread_count=unread_after)
+        )
+        moved += result.rowcount
+    delivered_message_id = max(delivered_message_id or 0, read_message_id or 0)
+    if delivered_message_id:
+        result = await db.execute(
+            update(ReadState)
+            .where(*key, ReadState.last_delivered_message_id < delivered_message_id)
+            .values(last_delivered_message_id=delivered_message_id)
+        )
+        moved += result.rowcount
+    return moved > 0
+
+async def mark_conversation_read(db: AsyncSession, conversation_id: int, user_id: int, message_id: int):
+    moved = await update_read_state(db, conversation_id, user_id, read_message_id=message_id)
+    await db.commit()
+    return moved
+
+async def get_read_states(db: AsyncSession, conversation_id: int):
+    result = await db.execute(select(models.ConversationReadState).filter(
+        models.ConversationReadState.conversation_id == conversation_id
+    ))
+    return result.scalars().all()
+
+
+# Fetch users based on user IDs(multiple users based on multiple IDs)
+async def get_users_by_ids(db: AsyncSession, user_ids: List[int]):
+    result = await db.execute(select(models.User).filter(models.User.user_id.in_(user_ids)))
+    return result.scalars().all()
+
+async def get_user_ids_by_usernames(db: AsyncSession, usernames: Iterable[str]):
+    result = await db.execute(select(models.User.user_id).filter(models.User.username.in_(list(usernames))))
+    return result.scalars().all()
 
 # sub function for profile image
-def update_profile_image(db: Session, user_id: int, profile_image_url: str):
-    user = db.query(models.User).filter(models.User.user_id == user_id).first()
+async def update_profile_image(db: AsyncSession, user_id: int, profile_image_url: str, profile_image_thumb_url: Optional[str] = None):
+    user = await get_user_by_id(db, user_id)
     if user:
         user.profile_image_url = profile_image_url
-        db.commit()
-        db.refresh(user)
+        user.profile_image_thumb_url = profile_image_thumb_url
+        await db.commit()
+        principal_cache.invalidate(user_id)
+        await db.refresh(user)
         return user
     return None
 
-def get_users_in_conversation(db: Session, current_user_id: int):
+# content-addressed profile images, see image_storage.py
+async def get_profile_image(db: AsyncSession, content_hash: str):
+    return await db.get(models.ProfileImage, content_hash)
+
+async def save_profile_image(db: AsyncSession, content_hash: str, url: str, thumb_url: str):
+    # two identical uploads racing both store the same URLs; the first row wins
+    await insert_if_missing(db, models.ProfileImage, {"content_hash": content_hash, "url": url, "thumb_url": thumb_url},
+                            ["content_hash"])
+    await db.commit()
+
+async def get_users_in_conversation(db: AsyncSession, current_user_id: int):
     # Fetch user details from conversations where current user is one of the participants
-    return (
-        db.query(models.User)
+    result = await db.execute(
+        select(models.User)
         .join(
             models.Conversation,
             (models.Conversation.user1_id == models.User.user_id) |
@@ -122,34 +455,21 @@ def get_users_in_conversation(db: Session, current_user_id: int):
         )
         .filter(models.User.user_id != current_user_id)  # Exclude current user
         .distinct()
-        .all()
     )
+    return result.scalars().all()
 
-# storing reset tokens
-reset_tokens = {}
-def store_reset_token(user_id: int, reset_token: str, expiration_time: datetime):
-    reset_tokens[reset_token] = {
-        "user_id": user_id,
-        "expiration_time": expiration_time 
-    }
-
-
-def update_user_password(db: Session, user_id: int, new_password: str):
+async def update_user_password(db: AsyncSession, user_id: int, new_password: str):
     # Hash the new password before storing it
-    hashed_new_password = hash_password(new_password)
-    
+    hashed_new_password = await password_hasher.hash(new_password)
+
     # Fetch the user by their ID
-    user = db.query(models.User).filter(models.User.user_id == user_id).first()
-    
+    user = await get_user_by_id(db, user_id)
+
     if user:
         # Update the user's password with the new hashed password
         user.password_hash = hashed_new_password
-        db.commit()
-        db.refresh(user)  # Refresh the user object to reflect the updated data in the session
+        await db.commit()
+        principal_cache.invalidate(user_id)
+        await db.refresh(user)  # Refresh the user object to reflect the updated data in the session
         return user
     return None
-
-
-    
-
-
@@ -1,8 +1,11 @@
+import asyncio
 import time
-from sqlalchemy import create_engine
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.exc import OperationalError
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 import os
 from dotenv import load_dotenv
 
@@ -11,32 +14,115 @@ load_dotenv()
 # MySQL Database URL
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL")
 
-# Retry logic to wait for database connection
-engine = None
-for attempt in range(10):
-    try:
-        engine = create_engine(SQLALCHEMY_DATABASE_URL)
-        conn = engine.connect()
-        conn.close()
-        print("Database connection successful!")
-        break
-    except OperationalError:
-        print(f"Database not ready, retrying ({attempt + 1}/10)...")
-        time.sleep(5)
-else:
-    print("Failed to connect to database after 10 attempts.")
-    raise Exception("Database connection failed.")
+# The app only talks to the database through async drivers, so a query
+# never blocks the event loop that also serves the WebSockets
+ASYNC_DRIVERS = {
+    "mysql": "mysql+aiomysql",
+    "mysql+pymysql": "mysql+aiomysql",
+    "mysql+mysqldb": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+}
+
+def to_async_url(url: str) -> str:
+    parsed = make_url(url)
+    drivername = ASYNC_DRIVERS.get(parsed.drivername, parsed.drivername)
+    return parsed.set(drivername=drivername).render_as_string(hide_password=False)
+
+# ASYNC_DATABASE_URL overrides the driver picked from DATABASE_URL (e.g. mysql+asyncmy)
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or to_async_url(SQLALCHEMY_DATABASE_URL)
+
+# Connection pool, sized per worker: total connections = workers * (size + overflow)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # below MySQL's wait_timeout
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "True") == "True"
+
+
+class MeteredQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long checkouts wait for a free connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            self.checkouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
 
-# Creating a configured "Session" class
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# The one engine factory; nothing connects until the first query
+def create_db_engine(url: str = ASYNC_DATABASE_URL):
+    if make_url(url).database in (None, "", ":memory:"):
+        # in-memory SQLite lives in a single connection, pooling doesn't apply
+        return create_async_engine(url)
+    return create_async_engine(
+        url,
+        poolclass=MeteredQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+    )
+
+async_engine = create_db_engine()
+
+# expire_on_commit=False: objects stay readable after commit without another round trip
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 
 # Base class for our models
 Base = declarative_base()
 
 # Dependency to get DB session
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+
+# Retry logic to wait for database connection, without blocking the event loop
+async def wait_for_database(attempts: int = 10, delay: float = 5):
+    for attempt in range(attempts):
+        try:
+            async with async_engine.connect() as conn:
+                await conn.execute(text("SELECT 1"))
+            print("Database connection successful!")
+            return
+        except OperationalError:
+            print(f"Database not ready, retrying ({attempt + 1}/{attempts})...")
+            await asyncio.sleep(delay)
+    print(f"Failed to connect to database after {attempts} attempts.")
+    raise Exception("Database connection failed.")
+
+
+def pool_stats() -> dict:
+    pool = async_engine.pool
+    stats = {"pool_class": type(pool).__name__}
+    if isinstance(pool, MeteredQueuePool):
+        stats.update({
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": max(pool.overflow(), 0),  # SQLAlchemy reports unused base slots as negative overflow
+            "max_overflow": DB_MAX_OVERFLOW,
+            "checkouts": pool.checkouts,
+            "timeouts": pool.timeouts,
+            "wait_seconds_avg": pool.wait_seconds_total / pool.checkouts if pool.checkouts else 0.0,
+            "wait_seconds_max": pool.wait_seconds_max,
+        })
+    return stats
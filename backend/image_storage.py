@@ -0,0 +1,201 @@
+# image_storage.py
+# Profile images: UploadSizeLimit refuses oversized request bodies before they are read, the
+# parsed upload is copied to a temporary file while it is hashed, resized into
+# fixed square variants in a process pool, and the variants are stored under content-addressed
+# keys. The same picture uploaded again (by anyone) is found by its hash in the profile_images table and
+# neither resized nor uploaded a second time.
+#
+# Where variants go is pluggable: Cloudinary, or the local filesystem (served under /media) for
+# tests and offline runs.
+import asyncio
+import hashlib
+import io
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, UploadFile
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+
+load_dotenv()
+
+IMAGE_STORAGE = os.getenv("IMAGE_STORAGE", "cloudinary")  # cloudinary | local
+IMAGE_STORAGE_DIR = os.getenv("IMAGE_STORAGE_DIR", "media")
+IMAGE_BASE_URL = os.getenv("IMAGE_BASE_URL", "http://localhost:8000/media")
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+PROFILE_IMAGE_MAX_BYTES = int(os.getenv("PROFILE_IMAGE_MAX_BYTES", str(5 * 1024 * 1024)))
+
+# square variants in pixels: "small" for lists (the inbox, /conversations/users), "medium" for the profile
+PROFILE_IMAGE_SIZES = {"small": 96, "medium": 256}
+IMAGE_FORMAT = "WEBP"
+IMAGE_CONTENT_TYPE = "image/webp"
+UPLOAD_CHUNK_SIZE = 64 * 1024
+UPLOAD_FORM_OVERHEAD = 64 * 1024  # multipart boundaries and part headers around the file
+
+
+class ImageTooLarge(Exception):
+    pass
+
+
+class InvalidImage(Exception):
+    pass
+
+
+class ImageStorage:
+    async def put(self, key: str, data: bytes, content_type: str) -> str:
+        """Stores data under key (idempotent for the same key) and returns its public URL."""
+        raise NotImplementedError
+
+
+class LocalImageStorage(ImageStorage):
+    def __init__(self, root: str = IMAGE_STORAGE_DIR, base_url: str = IMAGE_BASE_URL):
+        self.root = root
+        self.base_url = base_url.rstrip("/")
+        os.makedirs(root, exist_ok=True)
+
+    async def put(self, key: str, data: bytes, content_type: str) -> str:
+        path = os.path.join(self.root, key)
+        if not os.path.exists(path):
+            await run_in_threadpool(self._write, path, data)
+        return f"{self.base_url}/{key}"
+
+    @staticmethod
+    def _write(path: str, data: bytes):
+        # write then rename, so a concurrent upload of the same key never serves a partial file
+        partial = f"{path}.{os.getpid()}.partial"
+        with open(partial, "wb") as f:
+            f.write(data)
+        os.replace(partial, path)
+
+
+class CloudinaryImageStorage(ImageStorage):
+    def __init__(self):
+        import cloudinary
+        import cloudinary.uploader
+
+        cloudinary.config(
+            cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
+            api_key=os.getenv("CLOUDINARY_API_KEY"),
+            api_secret=os.getenv("CLOUDINARY_API_SECRET"),
+            secure=True
+        )
+        self.uploader = cloudinary.uploader
+
+    async def put(self, key: str, data: bytes, content_type: str) -> str:
+        # the key becomes the public_id, so a repeated key is the same asset, not a copy
+        public_id = key.rsplit(".", 1)[0]
+        result = await run_in_threadpool(self.uploader.upload, data, public_id=public_id,
+                                         overwrite=False, resource_type="image")
+        return result["secure_url"]
+
+
+def create_image_storage(kind: str = IMAGE_STORAGE) -> ImageStorage:
+    if kind == "local":
+        return LocalImageStorage()
+    if kind == "cloudinary":
+        return CloudinaryImageStorage()
+    raise ValueError(f"Unknown IMAGE_STORAGE: {kind}")
+
+
+def make_variants(path: str, sizes: Dict[str, int]) -> Dict[str, bytes]:
+    """Runs in the process pool: decode once, crop to a centred square, encode each size."""
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    try:
+        with Image.open(path) as image:
+            image = ImageOps.exif_transpose(image)
+            image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        raise InvalidImage(str(e))
+
+    variants = {}
+    for name, size in sizes.items():
+        variant = ImageOps.fit(image, (size, size), Image.LANCZOS)
+        buffer = io.BytesIO()
+        variant.save(buffer, IMAGE_FORMAT, quality=85, method=4)
+        variants[name] = buffer.getvalue()
+    return variants
+
+
+class ImageProcessor:
+    def __init__(self, storage: ImageStorage, workers: int = IMAGE_WORKERS, max_bytes: int = PROFILE_IMAGE_MAX_BYTES):
+        self.storage = storage
+        self.max_bytes = max_bytes
+        self._pool = ProcessPoolExecutor(max_workers=workers)  # worker processes start on first use
+
+    async def spool(self, file: UploadFile):
+        """Copies the parsed upload to a temporary file chunk by chunk while hashing it, and
+        holds the file itself to max_bytes (UploadSizeLimit only caps the whole body).
+        Returns (sha256 hex, path); the caller removes the file."""
+        digest = hashlib.sha256()
+        size = 0
+        spooled = tempfile.NamedTemporaryFile(delete=False, suffix=".upload")
+        try:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > self.max_bytes:
+                    raise ImageTooLarge(f"Images are limited to {self.max_bytes} bytes")
+                digest.update(chunk)
+                await run_in_threadpool(spooled.write, chunk)
+        except BaseException:
+            spooled.close()
+            os.unlink(spooled.name)
+            raise
+        spooled.close()
+        return digest.hexdigest(), spooled.name
+
+    async def store_variants(self, content_hash: str, path: str) -> Dict[str, str]:
+        """Resizes the spooled upload and stores every variant; returns their URLs by name."""
+        loop = asyncio.get_running_loop()
+        variants = await loop.run_in_executor(self._pool, make_variants, path, PROFILE_IMAGE_SIZES)
+        extension = IMAGE_FORMAT.lower()
+        names = list(variants)
+        urls = await asyncio.gather(*(
+            self.storage.put(f"{content_hash}_{PROFILE_IMAGE_SIZES[name]}.{extension}", variants[name], IMAGE_CONTENT_TYPE)
+            for name in names
+        ))
+        return dict(zip(names, urls))
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+class UploadSizeLimit:
+    """ASGI middleware: on the given paths, a body over max_bytes gets 413 before it is parsed.
+    Content-Length is checked up front; a chunked body is counted as it arrives."""
+
+    def __init__(self, app, paths, max_bytes: int):
+        self.app = app
+        self.paths = set(paths)
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        detail = f"Uploads are limited to {self.max_bytes} bytes"
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_bytes:
+            await JSONResponse({"detail": detail}, status_code=413)(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # FastAPI passes an HTTPException from body parsing through unchanged
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+image_storage = create_image_storage()
+image_processor = ImageProcessor(image_storage)
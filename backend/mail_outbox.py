@@ -0,0 +1,287 @@
+# mail_outbox.py
+# Outgoing mail through a durable outbox. enqueue() only inserts a row into email_outbox;
+# a background sender claims due rows in batches and hands them to MAIL_POOL_SIZE senders,
+# each holding one SMTP connection open across messages, so a burst of reset mails costs a
+# few connections and TLS handshakes instead of one per mail.
+#
+# Delivery is at least once: a row is deleted after the server accepted it, a transient
+# failure (4xx, connection trouble) is retried with exponential backoff, a permanent one (5xx)
+# or MAIL_MAX_ATTEMPTS failures drop it with a log line. Rows claimed by a worker that dies are
+# picked up by any worker after MAIL_CLAIM_TIMEOUT.
+#
+# For local runs, point MAIL_SERVER/MAIL_PORT at a stand-in: python -m aiosmtpd -n -l localhost:8025
+import asyncio
+import logging
+import os
+import random
+import uuid
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from email.utils import formatdate, make_msgid
+from typing import List, Optional
+
+import aiosmtplib
+from dotenv import load_dotenv
+from sqlalchemy import delete, func, select, update
+
+import database
+import models
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+MAIL_POOL_SIZE = int(os.getenv("MAIL_POOL_SIZE", "2"))
+MAIL_BATCH_SIZE = int(os.getenv("MAIL_BATCH_SIZE", "50"))
+MAIL_POLL_INTERVAL = float(os.getenv("MAIL_POLL_INTERVAL", "1"))
+MAIL_MAX_ATTEMPTS = int(os.getenv("MAIL_MAX_ATTEMPTS", "8"))
+MAIL_RETRY_BASE = float(os.getenv("MAIL_RETRY_BASE", "5"))
+MAIL_RETRY_MAX = float(os.getenv("MAIL_RETRY_MAX", "900"))
+MAIL_CLAIM_TIMEOUT = float(os.getenv("MAIL_CLAIM_TIMEOUT", "120"))
+# SMTP servers drop idle clients after a few minutes; close first
+MAIL_IDLE_TIMEOUT = float(os.getenv("MAIL_IDLE_TIMEOUT", "60"))
+MAIL_SEND_TIMEOUT = float(os.getenv("MAIL_SEND_TIMEOUT", "30"))
+
+EMAIL_COLUMNS = (
+    models.EmailOutbox.email_id,
+    models.EmailOutbox.recipient,
+    models.EmailOutbox.subject,
+    models.EmailOutbox.body,
+    models.EmailOutbox.attempts,
+)
+
+
+def smtp_settings() -> dict:
+    """aiosmtplib.SMTP arguments from the MAIL_* settings."""
+    settings = {
+        "hostname": os.getenv("MAIL_SERVER", "localhost"),
+        "port": int(os.getenv("MAIL_PORT", "25")),
+        "use_tls": os.getenv("MAIL_SSL_TLS") == "True",
+        "start_tls": os.getenv("MAIL_STARTTLS") == "True",
+        "validate_certs": os.getenv("VALIDATE_CERTS") == "True",
+        "timeout": MAIL_SEND_TIMEOUT,
+    }
+    if os.getenv("USE_CREDENTIALS") == "True":
+        settings["username"] = os.getenv("MAIL_USERNAME")
+        settings["password"] = os.getenv("MAIL_PASSWORD")
+    return settings
+
+
+def is_permanent(error: Exception) -> bool:
+    # a 5xx reply will be the same next time; anything else may not be
+    if isinstance(error, aiosmtplib.SMTPRecipientsRefused):
+        return all(500 <= refusal.code < 600 for refusal in error.recipients)
+    return isinstance(error, aiosmtplib.SMTPResponseException) and 500 <= error.code < 600
+
+
+class MailOutbox:
+    def __init__(self, pool_size: int = MAIL_POOL_SIZE, batch_size: int = MAIL_BATCH_SIZE,
+                 poll_interval: float = MAIL_POLL_INTERVAL, max_attempts: int = MAIL_MAX_ATTEMPTS,
+                 smtp: Optional[dict] = None, sender: Optional[str] = None):
+        self.pool_size = pool_size
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.smtp = smtp or smtp_settings()
+        self.sender = sender or os.getenv("MAIL_FROM")
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._wakeup = asyncio.Event()
+        self._runner: Optional[asyncio.Task] = None
+        self._senders: List[asyncio.Task] = []
+        # outcomes, written back by the runner in one transaction per round
+        self._sent_ids: List[int] = []
+        self._failures: List[tuple] = []  # (row, error)
+        self._open_connections = 0
+        # counters for /metrics
+        self.enqueued = 0
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.connections_opened = 0
+
+    async def start(self):
+        self._runner = asyncio.create_task(self._run())
+        self._senders = [asyncio.create_task(self._send_loop()) for _ in range(self.pool_size)]
+
+    async def stop(self):
+        if self._runner:
+            self._runner.cancel()
+            try:
+                await self._runner
+            except asyncio.CancelledError:
+                pass
+            self._runner = None
+        # whatever no sender has started is handed back for the next start (or another worker)
+        unsent = []
+        while not self._queue.empty():
+            unsent.append(self._queue.get_nowait())
+        for _ in self._senders:
+            self._queue.put_nowait(None)
+        if self._senders:
+            done, pending = await asyncio.wait(self._senders, timeout=MAIL_SEND_TIMEOUT)
+            for task in pending:
+                task.cancel()
+            self._senders = []
+        try:
+            await self._settle()
+            await self._release([row.email_id for row in unsent])
+        except Exception:
+            logger.exception("Mail outbox could not record its last results")
+
+    async def enqueue(self, recipient: str, subject: str, body: str):
+        """Stores the mail; it goes out from the background sender."""
+        async with database.AsyncSessionLocal() as db:
+            db.add(models.EmailOutbox(recipient=recipient, subject=subject, body=body))
+            await db.commit()
+        self.enqueued += 1
+        self._wakeup.set()
+
+    async def stats(self) -> dict:
+        async with database.AsyncSessionLocal() as db:
+            queued = (await db.execute(select(func.count()).select_from(models.EmailOutbox))).scalar()
+        return {
+            "queued": queued,  # across all workers, including retries waiting for their backoff
+            "in_flight": self._queue.qsize(),
+            "enqueued": self.enqueued,
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+            "connections_open": self._open_connections,
+            "connections_opened": self.connections_opened,
+        }
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self._settle()
+                # claim only what the senders can start on soon, so other workers get the rest
+                room = self.batch_size - self._queue.qsize()
+                if room > 0:
+                    for row in await self._claim(room):
+                        self._queue.put_nowait(row)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Mail outbox round failed, retrying")
+
+    async def _claim(self, limit: int) -> list:
+        outbox = models.EmailOutbox
+        now = datetime.utcnow()
+        claim = uuid.uuid4().hex
+        async with database.AsyncSessionLocal() as db:
+            due = (await db.execute(
+                select(outbox.email_id).where(outbox.next_attempt_at <= now).order_by(outbox.next_attempt_at).limit(limit)
+            )).scalars().all()
+            if not due:
+                return []
+            # rows another worker claimed in the meantime no longer match next_attempt_at <= now
+            await db.execute(
+                update(outbox)
+                .where(outbox.email_id.in_(due), outbox.next_attempt_at <= now)
+                .values(claimed_by=claim, next_attempt_at=now + timedelta(seconds=MAIL_CLAIM_TIMEOUT))
+            )
+            rows = (await db.execute(select(*EMAIL_COLUMNS).where(outbox.claimed_by == claim))).all()
+            await db.commit()
+        return rows
+
+    async def _settle(self):
+        sent_ids, self._sent_ids = self._sent_ids, []
+        failures, self._failures = self._failures, []
+        if not sent_ids and not failures:
+            return
+        outbox = models.EmailOutbox
+        now = datetime.utcnow()
+        async with database.AsyncSessionLocal() as db:
+            dropped = list(sent_ids)
+            for row, error in failures:
+                attempts = row.attempts + 1
+                if is_permanent(error) or attempts >= self.max_attempts:
+                    logger.warning("Giving up on mail %s to %s after %s attempts: %s",
+                                   row.email_id, row.recipient, attempts, error)
+                    dropped.append(row.email_id)
+                    self.failed += 1
+                    continue
+                delay = min(MAIL_RETRY_BASE * 2 ** row.attempts, MAIL_RETRY_MAX) * random.uniform(0.8, 1.2)
+                await db.execute(
+                    update(outbox).where(outbox.email_id == row.email_id)
+                    .values(attempts=attempts, next_attempt_at=now + timedelta(seconds=delay),
+                            claimed_by=None, last_error=str(error)[:500])
+                )
+                self.retried += 1
+            if dropped:
+                await db.execute(delete(outbox).where(outbox.email_id.in_(dropped)))
+            await db.commit()
+
+    async def _release(self, email_ids: List[int]):
+        if not email_ids:
+            return
+        async with database.AsyncSessionLocal() as db:
+            await db.execute(
+                update(models.EmailOutbox).where(models.EmailOutbox.email_id.in_(email_ids))
+                .values(claimed_by=None, next_attempt_at=datetime.utcnow())
+            )
+            await db.commit()
+
+    def _message(self, row) -> EmailMessage:
+        message = EmailMessage()
+        message["From"] = self.sender
+        message["To"] = row.recipient
+        message["Subject"] = row.subject
+        message["Date"] = formatdate(localtime=True)
+        message["Message-ID"] = make_msgid()
+        message.set_content(row.body)
+        return message
+
+    async def _send_loop(self):
+        smtp: Optional[aiosmtplib.SMTP] = None
+        try:
+            while True:
+                try:
+                    row = await asyncio.wait_for(self._queue.get(), MAIL_IDLE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    smtp = await self._close(smtp)
+                    continue
+                if row is None:
+                    return
+                try:
+                    if smtp is None or not smtp.is_connected:
+                        smtp = await self._close(smtp)
+                        smtp = await self._connect()
+                    await smtp.send_message(self._message(row))
+                    self._sent_ids.append(row.email_id)
+                    self.sent += 1
+                except Exception as e:
+                    if not isinstance(e, aiosmtplib.SMTPRecipientsRefused):
+                        # the session may be mid-transaction or gone: start the next mail afresh
+                        smtp = await self._close(smtp)
+                    self._failures.append((row, e))
+                if self._queue.empty():
+                    self._wakeup.set()  # record the results now and fetch more
+        finally:
+            await self._close(smtp)
+
+    async def _connect(self) -> aiosmtplib.SMTP:
+        smtp = aiosmtplib.SMTP(**self.smtp)
+        await smtp.connect()
+        self._open_connections += 1
+        self.connections_opened += 1
+        return smtp
+
+    async def _close(self, smtp: Optional[aiosmtplib.SMTP]) -> None:
+        if smtp is None:
+            return None
+        self._open_connections -= 1
+        try:
+            if smtp.is_connected:
+                await smtp.quit()
+        except Exception:
+            smtp.close()
+        return None
+
+
+mail_outbox = MailOutbox()
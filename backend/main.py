@@ -1,44 +1,57 @@
 # main.py
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Depends, status, Query, File, UploadFile, BackgroundTasks
-from sqlalchemy.orm import Session
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Depends, status, Query, File, UploadFile, Request
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.middleware.cors import CORSMiddleware
 import schemas
 import crud
+import models
 import database
-from sqlalchemy import create_engine
 from database import Base
 from fastapi.security import OAuth2PasswordRequestForm
 import auth
+from broker import create_broker
+from connection_manager import ConnectionManager
+from message_writer import MessageWriter, MAX_MESSAGE_LENGTH
+from sqlalchemy.exc import DBAPIError
+from receipts import ReceiptCoalescer, receipt_event
+from presence import PresenceService
+from message_cache import recent_messages
+from membership_cache import membership_cache
+import reset_tokens
+from reset_tokens import reset_token_store
+from mail_outbox import mail_outbox
+import rate_limiter
+from rate_limiter import TokenBucket, limit_by_ip, limit_by_username
+import payloads
+import search
+from principal_cache import principal_cache
+from password_hasher import password_hasher, HashingPoolBusy
 import json
-from typing import List
+from typing import List, Optional
 import uuid
-import random
-from datetime import datetime, timedelta
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig, MessageType
-from starlette.responses import JSONResponse
+import secrets
+from starlette.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 import os
 from dotenv import load_dotenv
 
-# cloudinary for storing profile images
-import cloudinary
-import cloudinary.uploader
+# profile images: resized in a process pool, stored on Cloudinary or the local filesystem
+from image_storage import (image_storage, image_processor, LocalImageStorage, ImageTooLarge, InvalidImage,
+                           UploadSizeLimit, PROFILE_IMAGE_MAX_BYTES, UPLOAD_FORM_OVERHEAD)
+from fastapi.staticfiles import StaticFiles
 
 load_dotenv()
 
-# MySQL Database URL
-DATABASE_URL = os.getenv("DATABASE_URL")
-
-# Create a new engine instance
-engine = create_engine(DATABASE_URL)
-
 # Create the FastAPI app
 app = FastAPI()
 
-# Create all tables in the database if they don't exist
+# Wait for the database, then create all tables in the database if they don't exist
 @app.on_event("startup")
-def startup_event():
-    Base.metadata.create_all(bind=engine)
+async def startup_event():
+    await database.wait_for_database()
+    async with database.async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(search.setup_search)
 
 # CORS settings
 app.add_middleware(
@@ -49,27 +62,20 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Email configuration for sending emails
-conf = ConnectionConfig(
-    MAIL_USERNAME=os.getenv("MAIL_USERNAME"),
-    MAIL_PASSWORD=os.getenv("MAIL_PASSWORD"),
-    MAIL_FROM=os.getenv("MAIL_FROM"),
-    MAIL_PORT=int(os.getenv("MAIL_PORT")),
-    MAIL_SERVER=os.getenv("MAIL_SERVER"),
-    MAIL_STARTTLS=os.getenv("MAIL_STARTTLS") == "True",
-    MAIL_SSL_TLS=os.getenv("MAIL_SSL_TLS") == "True",
-    USE_CREDENTIALS=os.getenv("USE_CREDENTIALS") == "True",
-    VALIDATE_CERTS=os.getenv("VALIDATE_CERTS") == "True"
-)
+# Oversized uploads are turned away before Starlette buffers and parses the body
+app.add_middleware(UploadSizeLimit, paths=["/users/me/profile-image"],
+                   max_bytes=PROFILE_IMAGE_MAX_BYTES + UPLOAD_FORM_OVERHEAD)
 
+# Login/signup storm: shed load instead of queueing bcrypt work without bound
+@app.exception_handler(HashingPoolBusy)
+async def hashing_pool_busy_handler(request, exc):
+    return JSONResponse(status_code=503, content={"detail": "Server busy, please retry"}, headers={"Retry-After": "1"})
 
-# Initialize Cloudinary with credentials (using f******35@gmail.com)
-cloudinary.config(
-    cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
-    api_key=os.getenv("CLOUDINARY_API_KEY"),
-    api_secret=os.getenv("CLOUDINARY_API_SECRET"),
-    secure=True
-)
+# Email goes out through mail_outbox.py, configured from the same MAIL_* settings
+
+# Cloudinary is configured in image_storage.py; with IMAGE_STORAGE=local the images are served from here
+if isinstance(image_storage, LocalImageStorage):
+    app.mount("/media", StaticFiles(directory=image_storage.root), name="media")
 
 # Store messages in memory for simplicity
 # messages = []
@@ -88,43 +94,212 @@ cloudinary.config(
 #         await websocket.send_text(data)  # Echo message back to the client
 
 
-# WebSocket connection manager
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: dict[int, List[WebSocket]] = {}  # conversation_id -> [WebSockets]
-
-    async def connect(self, websocket: WebSocket, conversation_id: int):
-        await websocket.accept()
-        if conversation_id not in self.active_connections:
-            self.active_connections[conversation_id] = []
-        self.active_connections[conversation_id].append(websocket)
-
-    def disconnect(self, websocket: WebSocket, conversation_id: int):
-        self.active_connections[conversation_id].remove(websocket)
-        if not self.active_connections[conversation_id]:
-            del self.active_connections[conversation_id]
-
-    async def send_message(self, message: str, conversation_id: int):
-        if conversation_id in self.active_connections:
-            for connection in self.active_connections[conversation_id]:
-                await connection.send_text(message)
+# WebSocket connections, fanned out across workers through the configured broker
+manager = ConnectionManager(create_broker())
 
-manager = ConnectionManager()
+# Messages from all senders are group-committed by a single writer
+message_writer = MessageWriter()
+receipts = ReceiptCoalescer(manager)
+presence = PresenceService(manager)
 
+@app.on_event("startup")
+async def start_broker():
+    await manager.broker.start()
+    await manager.start()
+    await recent_messages.attach(manager.broker)
+    # removing a member anywhere closes their sockets for that conversation here too
+    await membership_cache.attach(manager.broker, on_removed=manager.disconnect_member)
+    await message_writer.start()
+    await receipts.start()
+    await presence.start()
+    await reset_token_store.start()
+    await mail_outbox.start()
+    await rate_limiter.rate_limiter.start()
+
+@app.on_event("shutdown")
+async def stop_broker():
+    await rate_limiter.rate_limiter.stop()
+    await mail_outbox.stop()
+    await reset_token_store.stop()
+    await presence.stop()
+    await receipts.stop()
+    await message_writer.stop()
+    await membership_cache.detach()
+    await recent_messages.detach()
+    await manager.stop()
+    await manager.broker.stop()
+
+# Runs last: everything above may still need a connection while shutting down
+@app.on_event("shutdown")
+async def shutdown_event():
+    await database.async_engine.dispose()
+    password_hasher.shutdown()
+    image_processor.shutdown()
+
+# WebSocket routes don't get a request-scoped session, so they open their own.
+# Returns the user and the conversation's members, or None.
+async def authorize_websocket(token: str, conversation_id: int):
+    async with database.AsyncSessionLocal() as db:
+        user = await auth.get_user_from_token(db, token)
+        if user is None:
+            return None
+        member_ids = await crud.get_member_ids(db, conversation_id)
+        if user.user_id not in member_ids:
+            return None
+        return user.user_id, member_ids
+
+# Membership is checked on every send too, so a removed member can't keep writing through an
+# open socket; with the cache warm this never opens a session
+async def is_member(conversation_id: int, user_id: int) -> bool:
+    member_ids = membership_cache.get(conversation_id)
+    if member_ids is not None:
+        return user_id in member_ids
+    async with database.AsyncSessionLocal() as db:
+        return await crud.is_member(db, conversation_id, user_id)
+
+# The WebSocket is the write path for messages:
+#   client -> {"type": "message", "client_msg_id": "...", "message_text": "..."}
+#   sender <- {"type": "ack", "client_msg_id": "...", "message": {...}}
+#   everyone in the conversation <- {"type": "message", "message": {...}}
+# and for receipts (coalesced, written and broadcast once per RECEIPT_FLUSH_MS):
+#   client -> {"type": "read" | "delivered", "message_id": 123}
+#   everyone in the conversation <- {"type": "receipt", "user_id": ..., "last_read_message_id": ..., ...}
+# The server sends {"type": "ping"} every WS_PING_INTERVAL; clients answer {"type": "pong"},
+# and a socket silent for WS_IDLE_TIMEOUT is closed.
+# Presence and typing (coalesced, at most one frame per conversation per PRESENCE_FLUSH_MS):
+#   client -> {"type": "typing"} while typing, {"type": "typing", "typing": false} to stop
+#   everyone in the conversation <- {"type": "typing", "typing": [user_ids], "stopped": [user_ids]}
+#   everyone in the conversation <- {"type": "presence", "users": [{"user_id": ..., "online": ..., "last_seen": ...}]}
+# Rate limits: a socket sending more than RATE_LIMIT_WS_FRAMES is closed with 1008; a message or
+# image over the sender's or the conversation's limit is refused with
+#   sender <- {"type": "error", "client_msg_id": "...", "detail": "Rate limit exceeded", "retry_after": 1.5}
+# Frames are JSON text by default. A client offering the "buzz.msgpack" subprotocol gets the
+# same objects as binary msgpack frames, and permessage-deflate is negotiated by the server
+# (uvicorn --ws-per-message-deflate) for clients that support it.
 @app.websocket("/ws/conversations/{conversation_id}")
-async def websocket_endpoint(websocket: WebSocket, conversation_id: int):
-    await manager.connect(websocket, conversation_id)
+async def websocket_endpoint(websocket: WebSocket, conversation_id: int, token: Optional[str] = Query(None)):
+    authorized = await authorize_websocket(token, conversation_id)
+    if authorized is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    user_id, participants = authorized
+
+    subprotocol = payloads.choose_subprotocol(websocket.scope.get("subprotocols", []))
+    connection = await manager.connect(websocket, conversation_id, user_id, subprotocol)
+    if connection is None:
+        return
+    presence.connected(conversation_id, user_id, participants)
+    # the peers' current state; changes follow as "presence" frames. In a group only the
+    # members online right now are listed, not thousands of offline ones.
+    peers = [participant for participant in participants if participant != user_id]
+    if len(peers) > 1:
+        peers = [peer for peer in peers if presence.is_online(peer)]
+    manager.send_personal(connection, json.dumps({
+        "type": "presence",
+        "conversation_id": conversation_id,
+        "users": presence.snapshot(peers),
+    }))
+    # every frame counts, so a flood is cut off before it reaches the fan-out
+    frames = TokenBucket(rate_limiter.RATE_LIMIT_WS_FRAMES) if rate_limiter.RATE_LIMIT_WS_FRAMES else None
     try:
         while True:
-            data = await websocket.receive_text()
-            await manager.send_message(data, conversation_id)
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            manager.touch(connection)
+            if frames is not None and frames.take():
+                await manager.close(connection, status.WS_1008_POLICY_VIOLATION, "Rate limit exceeded")
+                break
+            frame = payloads.decode_client_frame(message)
+            if frame is None:
+                manager.send_personal(connection, json.dumps({"type": "error", "detail": "Frames must be JSON or msgpack objects"}))
+                continue
+
+            if frame.get("type") == "pong":
+                continue
+            elif frame.get("type") == "message":
+                await handle_message_frame(connection, frame, conversation_id, user_id)
+            elif frame.get("type") == "typing":
+                if frame.get("typing") is False:
+                    presence.stop_typing(conversation_id, user_id)
+                else:
+                    presence.typing(conversation_id, user_id)
+            elif frame.get("type") in ("read", "delivered"):
+                message_id = frame.get("message_id")
+                if not isinstance(message_id, int) or isinstance(message_id, bool) or message_id < 1:
+                    manager.send_personal(connection, json.dumps({"type": "error", "detail": "message_id must be a positive integer"}))
+                    continue
+                if frame["type"] == "read":
+                    receipts.record(conversation_id, user_id, read_message_id=message_id)
+                else:
+                    receipts.record(conversation_id, user_id, delivered_message_id=message_id)
+            elif frame.get("type") == "image":
+                if not await is_member(conversation_id, user_id):
+                    manager.send_personal(connection, json.dumps({"type": "error", "detail": "You are not a member of this conversation"}))
+                    continue
+                wait = await rate_limiter.message_wait(user_id, conversation_id)
+                if wait:
+                    manager.send_personal(connection, json.dumps({"type": "error", "detail": "Rate limit exceeded", "retry_after": round(wait, 3)}))
+                    continue
+                # images are relayed as-is, but never with a spoofed sender
+                frame["sender_id"] = user_id
+                frame["conversation_id"] = conversation_id
+                try:
+                    relayed = json.dumps(frame)
+                except (TypeError, ValueError):
+                    # msgpack can carry raw bytes, which JSON clients couldn't receive
+                    manager.send_personal(connection, json.dumps({"type": "error", "detail": "Image frames must be JSON-compatible"}))
+                    continue
+                await manager.send_message(relayed, conversation_id)
+            else:
+                manager.send_personal(connection, json.dumps({"type": "error", "detail": "Unknown frame type"}))
     except WebSocketDisconnect:
-        await manager.disconnect(websocket, conversation_id)
-
-
-
-@app.post('/create-user', response_model=schemas.User)
-def create_user(user: schemas.UserCreate, db: Session = Depends(database.get_db)):
+        pass
+    finally:
+        await manager.disconnect(connection)
+        presence.disconnected(conversation_id, user_id)
+
+async def handle_message_frame(connection, frame: dict, conversation_id: int, user_id: int):
+    client_msg_id = frame.get("client_msg_id")
+    message_text = frame.get("message_text")
+    if not isinstance(message_text, str) or not message_text.strip():
+        manager.send_personal(connection, json.dumps({"type": "error", "client_msg_id": client_msg_id, "detail": "Message text cannot be empty"}))
+        return
+    if len(message_text) > MAX_MESSAGE_LENGTH:
+        manager.send_personal(connection, json.dumps({"type": "error", "client_msg_id": client_msg_id, "detail": f"Message text is limited to {MAX_MESSAGE_LENGTH} characters"}))
+        return
+    if client_msg_id is not None and (not isinstance(client_msg_id, str) or len(client_msg_id) > 64):
+        manager.send_personal(connection, json.dumps({"type": "error", "detail": "client_msg_id must be a string of at most 64 characters"}))
+        return
+
+    if not await is_member(conversation_id, user_id):
+        manager.send_personal(connection, json.dumps({"type": "error", "client_msg_id": client_msg_id, "detail": "You are not a member of this conversation"}))
+        return
+
+    # the same buckets as /send-message; the client may resend the same client_msg_id after retry_after
+    wait = await rate_limiter.message_wait(user_id, conversation_id)
+    if wait:
+        manager.send_personal(connection, json.dumps({"type": "error", "client_msg_id": client_msg_id, "detail": "Rate limit exceeded", "retry_after": round(wait, 3)}))
+        return
+
+    presence.stop_typing(conversation_id, user_id)
+    try:
+        message, duplicate = await message_writer.write(conversation_id, user_id, message_text, client_msg_id)
+    except DBAPIError:
+        # only this message failed; the socket stays open
+        manager.send_personal(connection, json.dumps({"type": "error", "client_msg_id": client_msg_id, "detail": "Message could not be stored"}))
+        return
+    # encoded once, for the ack and for every socket in the conversation
+    encoded = payloads.encode_message(message)
+    manager.send_personal(connection, payloads.ack_event(client_msg_id, encoded))
+    if not duplicate:
+        await manager.send_message(payloads.message_event(encoded), conversation_id)
+
+
+
+@app.post('/create-user', response_model=schemas.User,
+          dependencies=[Depends(limit_by_ip("signup", rate_limiter.RATE_LIMIT_SIGNUP_IP))])
+async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(database.get_db)):
     # check of any field is empty
     if not user.username or not user.email or not user.password:
         raise HTTPException(
@@ -132,20 +307,22 @@ def create_user(user: schemas.UserCreate, db: Session = Depends(database.get_db)
             detail="Any field cannot be left empty"
         )
     # check if user already exists
-    db_user = crud.get_user_by_username(db, username=user.username)
+    db_user = await crud.get_user_by_username(db, username=user.username)
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
     
-    db_user_email = crud.get_user_by_email(db, email = user.email)
+    db_user_email = await crud.get_user_by_email(db, email = user.email)
     if db_user_email:
         raise HTTPException(status_code=400, detail="Email already registered")
     
     # else add the user to the database
-    return crud.create_user(db=db, username=user.username, email=user.email, password=user.password)
+    return await crud.create_user(db=db, username=user.username, email=user.email, password=user.password)
 
 
-@app.post('/token', response_model=schemas.Token)
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(database.get_db)):
+@app.post('/token', response_model=schemas.Token,
+          dependencies=[Depends(limit_by_ip("login", rate_limiter.RATE_LIMIT_LOGIN_IP)),
+                        Depends(limit_by_username("login", rate_limiter.RATE_LIMIT_LOGIN_USER))])
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(database.get_db)):
     # Check if username or password is empty
     if not form_data.username or not form_data.password:
         raise HTTPException(
@@ -154,7 +331,7 @@ def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db:
         )
     
     # Authenticate the user
-    db_user = crud.authenticate_user(db=db, username=form_data.username, password=form_data.password)
+    db_user = await crud.authenticate_user(db=db, username=form_data.username, password=form_data.password)
     
     if not db_user:
         raise HTTPException(
@@ -169,26 +346,42 @@ def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db:
 
 
 @app.get("/users/me", response_model=schemas.User)
-def read_users_me(current_user: schemas.User = Depends(auth.get_current_user)):
+async def read_users_me(current_user: schemas.User = Depends(auth.get_current_user)):
     return current_user
 
 
 @app.post("/users/me/profile-image")
-def upload_profile_image(
+async def upload_profile_image(
     file: UploadFile = File(...), 
-    db: Session = Depends(database.get_db), 
+    db: AsyncSession = Depends(database.get_db), 
     current_user: schemas.User = Depends(auth.get_current_user)
 ):
+    # the body was capped by UploadSizeLimit before it was parsed; the file is copied to disk and
+    # hashed, and a file seen before reuses its stored variants
     try:
-        # Upload the file to Cloudinary
-        result = cloudinary.uploader.upload(file.file)
-        profile_image_url = result.get("secure_url")
-
-        # Update the user's profile image in the database
-        updated_user = crud.update_profile_image(db=db, user_id=current_user.user_id, profile_image_url=profile_image_url)
-        return {"msg": "Profile image updated successfully", "profile_image_url": profile_image_url}
+        content_hash, path = await image_processor.spool(file)
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    try:
+        stored = await crud.get_profile_image(db, content_hash)
+        if stored:
+            profile_image_url, profile_image_thumb_url = stored.url, stored.thumb_url
+        else:
+            urls = await image_processor.store_variants(content_hash, path)
+            profile_image_url, profile_image_thumb_url = urls["medium"], urls["small"]
+            await crud.save_profile_image(db, content_hash, profile_image_url, profile_image_thumb_url)
+    except InvalidImage:
+        raise HTTPException(status_code=400, detail="File is not a supported image")
     except Exception as e:
         raise HTTPException(status_code=500, detail="Failed to upload image")
+    finally:
+        os.unlink(path)
+
+    # Update the user's profile image in the database
+    await crud.update_profile_image(db=db, user_id=current_user.user_id, profile_image_url=profile_image_url,
+                                    profile_image_thumb_url=profile_image_thumb_url)
+    return {"msg": "Profile image updated successfully", "profile_image_url": profile_image_url,
+            "profile_image_thumb_url": profile_image_thumb_url}
     
 @app.get("/users/profile-image")
 async def get_profile_image(current_user: schemas.User = Depends(auth.get_current_user)):
@@ -206,42 +399,139 @@ async def get_profile_image(current_user: schemas.User = Depends(auth.get_curren
 
 # Starting a new conversation
 @app.post("/new-conversation", response_model=schemas.Conversation)
-def new_conversation(recipient_username: str = Query(...), db: Session=Depends(database.get_db), curr_user: schemas.User=Depends(auth.get_current_user)):
-    recipient = crud.get_user_by_username(db, username=recipient_username)
+async def new_conversation(recipient_username: str = Query(...), db: AsyncSession=Depends(database.get_db), curr_user: schemas.User=Depends(auth.get_current_user)):
+    recipient = await crud.get_user_by_username(db, username=recipient_username)
     if not recipient:
         raise HTTPException(status_code=404, detail="Recipient user not found")
     
-    existing_conversation = crud.get_conversation_between_users(db, user1_id=curr_user.user_id, user2_id=recipient.user_id)
-    if existing_conversation:
-        return existing_conversation
-    
-    # If conversation doesn't already exist
-    new_conv = crud.create_conversation(db, user1_id=curr_user.user_id, user2_id=recipient.user_id)
-    return new_conv
+    # returns the existing conversation if there is one, even when two requests race
+    return await crud.get_or_create_conversation(db, user1_id=curr_user.user_id, user2_id=recipient.user_id)
+
+
+# Group conversations: the creator is the owner, members are added by username
+@app.post("/groups", response_model=schemas.Conversation)
+async def create_group(group: schemas.GroupCreate, db: AsyncSession = Depends(database.get_db), current_user: schemas.User = Depends(auth.get_current_user)):
+    usernames = set(group.member_usernames)
+    member_ids = await crud.get_user_ids_by_usernames(db, usernames)
+    if len(member_ids) != len(usernames):
+        raise HTTPException(status_code=404, detail="Some members were not found")
+    return await crud.create_group(db, owner_id=current_user.user_id, title=group.title, member_ids=member_ids)
+
+@app.get("/conversations/{conversation_id}/members", response_model=List[schemas.ConversationMember])
+async def get_conversation_members(
+    conversation_id: int,
+    after_user_id: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=500),
+    db: AsyncSession = Depends(database.get_db),
+    current_user: schemas.User = Depends(auth.get_current_user)
+):
+    if not await crud.is_member(db, conversation_id, current_user.user_id):
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    rows = await crud.get_members(db, conversation_id, after_user_id=after_user_id, limit=limit)
+    return [
+        {
+            "user_id": row.user_id,
+            "username": row.username,
+            "profile_image_url": row.profile_image_url or DEFAULT_PROFILE_IMAGE_URL,
+            "role": row.role,
+        }
+        for row in rows
+    ]
+
+# Any member of a group can add people
+@app.post("/conversations/{conversation_id}/members", status_code=status.HTTP_204_NO_CONTENT)
+async def add_conversation_member(
+    conversation_id: int,
+    username: str = Query(...),
+    db: AsyncSession = Depends(database.get_db),
+    current_user: schemas.User = Depends(auth.get_current_user)
+):
+    conversation = await crud.get_conversation_by_id(db, conversation_id)
+    if not conversation or not await crud.is_member(db, conversation_id, current_user.user_id):
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    if not conversation.is_group:
+        raise HTTPException(status_code=400, detail="Members can only be added to groups")
+    user = await crud.get_user_by_username(db, username=username)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    await crud.add_member(db, conversation, user.user_id)
+
+# Members can leave; only the owner removes others. An owner who leaves hands the group to the
+# longest-standing member.
+@app.delete("/conversations/{conversation_id}/members/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def remove_conversation_member(
+    conversation_id: int,
+    user_id: int,
+    db: AsyncSession = Depends(database.get_db),
+    current_user: schemas.User = Depends(auth.get_current_user)
+):
+    conversation = await crud.get_conversation_by_id(db, conversation_id)
+    me = await crud.get_member(db, conversation_id, current_user.user_id)
+    if not conversation or me is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    if not conversation.is_group:
+        raise HTTPException(status_code=400, detail="Members can only be removed from groups")
+    if user_id != current_user.user_id and me.role != "owner":
+        raise HTTPException(status_code=403, detail="Only the owner can remove members")
+    if not await crud.is_member(db, conversation_id, user_id):
+        raise HTTPException(status_code=404, detail="Member not found")
+    await crud.remove_member(db, conversation_id, user_id)
 
 
+# REST write path for API clients; the web app sends over the WebSocket
 @app.post('/send-message', response_model=schemas.Message)
-def send_message(conversation_id: int, message_text: str, db: Session = Depends(database.get_db), current_user: schemas.User = Depends(auth.get_current_user)):
-    conversation = crud.get_conversation_by_id(db, conversation_id=conversation_id)
-    if not conversation:
+async def send_message(conversation_id: int, message_text: str, db: AsyncSession = Depends(database.get_db), current_user: schemas.User = Depends(auth.get_current_user)):
+    if len(message_text) > MAX_MESSAGE_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Message text is limited to {MAX_MESSAGE_LENGTH} characters")
+
+    member_ids = await crud.get_member_ids(db, conversation_id)
+    if not member_ids:
         raise HTTPException(status_code=404, detail="Conversation not found")
     
-    if current_user.user_id not in [conversation.user1_id, conversation.user2_id]:
+    if current_user.user_id not in member_ids:
         raise HTTPException(status_code=403, detail="You are not a participant in this conversation")
+
+    # charged only once membership is confirmed, so outsiders can't drain the conversation's bucket
+    wait = await rate_limiter.message_wait(current_user.user_id, conversation_id)
+    if wait:
+        raise rate_limiter.too_many_requests(wait)
     
     # Store the message in the database
-    message = crud.create_message(db, conversation_id=conversation_id, sender_id=current_user.user_id, message_text=message_text)
+    message, _ = await message_writer.write(conversation_id, current_user.user_id, message_text)
     
     # Send the message to WebSocket clients
+    await manager.send_message(payloads.message_event(payloads.encode_message(message)), conversation_id)
     return message
 
 
+# Paginated history: newest page first, then walk back with before_id (or forward with after_id)
 @app.get("/conversations/{conversation_id}/messages", response_model=List[schemas.Message])
-def get_conversation_messages(conversation_id: int, db: Session = Depends(database.get_db)):
-    messages = crud.get_messages_in_conversation(db, conversation_id=conversation_id)
-    if not messages:
+async def get_conversation_messages(
+    conversation_id: int,
+    before_id: Optional[int] = Query(None, ge=1),
+    after_id: Optional[int] = Query(None, ge=0),
+    limit: int = Query(50, ge=1, le=200),
+    db: AsyncSession = Depends(database.get_db),
+    current_user: schemas.User = Depends(auth.get_current_user)
+):
+    if not await crud.is_member(db, conversation_id, current_user.user_id):
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    # the page is rendered to bytes here (response_model only documents the shape):
+    # no per-row validation, and cached pages are already encoded
+    encoded = None
+    if after_id is None:
+        # the newest messages of active conversations are usually in memory already
+        encoded = await recent_messages.get_page(
+            conversation_id, before_id, limit,
+            load=lambda n: crud.get_messages_in_conversation(db, conversation_id=conversation_id, limit=n),
+        )
+    if encoded is None:
+        messages = await crud.get_messages_in_conversation(db, conversation_id=conversation_id, before_id=before_id, after_id=after_id, limit=limit)
+        encoded = [payloads.encode_message(message) for message in messages]
+    # an empty page is a normal end of history once the client is paging with a cursor
+    if not encoded and before_id is None and after_id is None:
         raise HTTPException(status_code=404, detail="No messages found in this conversation")
-    return messages
+    return Response(content=payloads.encode_message_page(encoded), media_type="application/json")
 
 
 
@@ -262,17 +552,20 @@ def get_conversation_messages(conversation_id: int, db: Session = Depends(databa
 #     users = crud.get_users_by_ids(db, list(user_ids))
 #     return users
 
+DEFAULT_PROFILE_IMAGE_URL = "https://w7.pngwing.com/pngs/177/551/png-transparent-user-interface-design-computer-icons-default-stephen-salazar-graphy-user-interface-design-computer-wallpaper-sphere-thumbnail.png"
+
 @app.get("/conversations/users", response_model=List[schemas.UserWithProfilePic])
 async def get_users_in_conversations(
-    db: Session = Depends(database.get_db),
+    db: AsyncSession = Depends(database.get_db),
     current_user: schemas.User = Depends(auth.get_current_user)
 ):
-    users = crud.get_users_in_conversation(db=db, current_user_id=current_user.user_id)
+    users = await crud.get_users_in_conversation(db=db, current_user_id=current_user.user_id)
     # print("hi")
     # print(users)
     users_with_pictures = []
     for user in users:
-        profile_image_url = user.profile_image_url if user.profile_image_url else "https://w7.pngwing.com/pngs/177/551/png-transparent-user-interface-design-computer-icons-default-stephen-salazar-graphy-user-interface-design-computer-wallpaper-sphere-thumbnail.png"
+        # the list shows the small variant
+        profile_image_url = user.profile_image_thumb_url or user.profile_image_url or DEFAULT_PROFILE_IMAGE_URL
         users_with_pictures.append({
             "user_id": user.user_id,
             "username": user.username,
@@ -283,16 +576,137 @@ async def get_users_in_conversations(
 
 
 
+# Incremental sync for reconnecting clients, streamed as NDJSON, one JSON object per line:
+#   {"type": "message", "message": {...}}                       oldest first, per conversation
+#   {"type": "conversation", "conversation_id": 1, "last_message_id": 42, "has_more": false}
+#   {"type": "end"}
+# has_more means the gap was bigger than limit_per_conversation: sync again from the last
+# message received, or page the history instead.
+@app.post("/sync")
+async def sync(request: schemas.SyncRequest, current_user: schemas.User = Depends(auth.get_current_user)):
+    return StreamingResponse(sync_stream(current_user.user_id, request), media_type="application/x-ndjson")
+
+async def sync_stream(user_id: int, request: schemas.SyncRequest):
+    # the request's session is gone once streaming starts, and each range scan gets its own
+    # short session so a slow reader never sits on a pooled connection
+    async with database.AsyncSessionLocal() as db:
+        heads = await crud.get_conversation_heads(db, user_id)
+
+    for conversation_id, last_message_id in heads:
+        if conversation_id not in request.cursors and not request.include_new:
+            continue
+        since = request.cursors.get(conversation_id, 0)
+        if last_message_id <= since:
+            continue
+        async with database.AsyncSessionLocal() as db:
+            messages = await crud.get_messages_in_conversation(db, conversation_id=conversation_id, after_id=since,
+                                                               limit=request.limit_per_conversation + 1)
+        has_more = len(messages) > request.limit_per_conversation
+        messages = messages[:request.limit_per_conversation]
+        yield "".join(payloads.message_event(payloads.encode_message(message)) + "\n" for message in messages)
+        yield json.dumps({"type": "conversation", "conversation_id": conversation_id,
+                          "last_message_id": messages[-1].message_id if messages else since, "has_more": has_more}) + "\n"
+    yield json.dumps({"type": "end"}) + "\n"
+
+
+# Ranked full-text search over the caller's conversations (or just one of them);
+# page on with next_offset
+@app.get("/search", response_model=schemas.SearchPage)
+async def search_messages(
+    q: str = Query(..., min_length=1, max_length=200),
+    conversation_id: Optional[int] = Query(None, ge=1),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=search.SEARCH_MAX_OFFSET),
+    db: AsyncSession = Depends(database.get_db),
+    current_user: schemas.User = Depends(auth.get_current_user)
+):
+    rows = await search.search_messages(db, user_id=current_user.user_id, query=q, conversation_id=conversation_id,
+                                        limit=limit + 1, offset=offset)
+    has_more = len(rows) > limit and offset + limit <= search.SEARCH_MAX_OFFSET
+    return {
+        "results": [{"message": payloads.message_dict(row), "score": row.score} for row in rows[:limit]],
+        "next_offset": offset + limit if has_more else None,
+    }
+
+
+# Conversation list for the sidebar in one query: newest first, then page with the last
+# entry's last_message.message_id (0 when it has none) and conversation_id
+@app.get("/inbox", response_model=List[schemas.InboxEntry])
+async def get_inbox(
+    before_message_id: Optional[int] = Query(None, ge=0),
+    before_conversation_id: Optional[int] = Query(None, ge=1),
+    limit: int = Query(50, ge=1, le=200),
+    db: AsyncSession = Depends(database.get_db),
+    current_user: schemas.User = Depends(auth.get_current_user)
+):
+    rows = await crud.get_inbox(db, user_id=current_user.user_id, before_message_id=before_message_id,
+                                before_conversation_id=before_conversation_id, limit=limit)
+    # the previews have now reached the client, which is what "delivered" means
+    for row in rows:
+        if row.message_id is not None and row.sender_id != current_user.user_id:
+            receipts.record(row.conversation_id, current_user.user_id, delivered_message_id=row.message_id)
+    return [
+        {
+            "conversation_id": row.conversation_id,
+            "is_group": row.is_group,
+            "title": row.title,
+            "peer": {
+                "user_id": row.user_id,
+                "username": row.username,
+                "profile_image_url": row.profile_image_url or DEFAULT_PROFILE_IMAGE_URL,
+            } if row.user_id is not None else None,
+            "last_message": {
+                "message_id": row.message_id,
+                "sender_id": row.sender_id,
+                "message_text": row.message_text,
+                "sent_at": row.sent_at,
+            } if row.message_id is not None else None,
+            "unread_count": row.unread_count,
+        }
+        for row in rows
+    ]
+
+
+# Mark a conversation read up to message_id (clears its unread count in the inbox)
+@app.post("/conversations/{conversation_id}/read")
+async def mark_conversation_read(
+    conversation_id: int,
+    message_id: int = Query(..., ge=1),
+    db: AsyncSession = Depends(database.get_db),
+    current_user: schemas.User = Depends(auth.get_current_user)
+):
+    conversation = await crud.get_conversation_by_id(db, conversation_id)
+    if not conversation or not await crud.is_member(db, conversation_id, current_user.user_id):
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    message_id = min(message_id, conversation.last_message_id)
+    if await crud.mark_conversation_read(db, conversation_id=conversation_id, user_id=current_user.user_id, message_id=message_id):
+        read_state = await db.get(models.ConversationReadState, (conversation_id, current_user.user_id))
+        await manager.send_message(receipt_event(read_state), conversation_id)
+    return {"conversation_id": conversation_id, "last_read_message_id": message_id}
+
+
+# Both participants' watermarks, to show receipts before any live "receipt" frame arrives
+@app.get("/conversations/{conversation_id}/read-states", response_model=List[schemas.ReadState])
+async def get_read_states(
+    conversation_id: int,
+    db: AsyncSession = Depends(database.get_db),
+    current_user: schemas.User = Depends(auth.get_current_user)
+):
+    if not await crud.is_member(db, conversation_id, current_user.user_id):
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return await crud.get_read_states(db, conversation_id)
+
+
 # Get conversation-id for two users
 @app.get("/conversations/get-conversation-id", response_model=int)
-def get_conversation_id(recipient_username: str, db: Session = Depends(database.get_db), current_user: schemas.User = Depends(auth.get_current_user)):
-    recipient_user = crud.get_user_by_username(db, recipient_username)
+async def get_conversation_id(recipient_username: str, db: AsyncSession = Depends(database.get_db), current_user: schemas.User = Depends(auth.get_current_user)):
+    recipient_user = await crud.get_user_by_username(db, recipient_username)
 
     if not recipient_user:
         raise HTTPException(status_code=404, detail="Recipient user not found")
 
     # Check if a conversation exists between the current user and the recipient
-    conversation = crud.get_conversation_by_usernames(db, user1_id=current_user.user_id, user2_id=recipient_user.user_id)
+    conversation = await crud.get_conversation_between_users(db, user1_id=current_user.user_id, user2_id=recipient_user.user_id)
 
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
@@ -300,54 +714,50 @@ def get_conversation_id(recipient_username: str, db: Session = Depends(database.
     return conversation.conversation_id
 
 # Handling forgot passowrd request
-background_tasks = BackgroundTasks()
-
-async def send_email(message: MessageSchema):
-    fm = FastMail(conf) 
-    await fm.send_message(message)
- 
+def generate_otp():
+    return f"{secrets.randbelow(1000000):06d}"
 
-# Background task to send the email
-async def send_email(message: MessageSchema):
-    fm = FastMail(conf)
-    await fm.send_message(message)
+def too_many_attempts():
+    return HTTPException(status_code=429, detail="Too many attempts, try again later",
+                         headers={"Retry-After": str(reset_token_store.window)})
 
-def generate_otp():
-    return f"{random.randint(100000, 999999)}"
+# Bursts are cut off here; reset_tokens adds the longer per-user and per-IP quotas
+@app.post("/forgot-password", dependencies=[Depends(limit_by_ip("password_reset", rate_limiter.RATE_LIMIT_PASSWORD_RESET_IP))])
+async def forgot_password(username: str, request: Request, db: AsyncSession = Depends(database.get_db)):
+    # checked before the lookup, so probing usernames counts too
+    if not await reset_token_store.hit(f"reset_request:ip:{request.client.host}", reset_tokens.RESET_REQUESTS_PER_IP):
+        raise too_many_attempts()
 
-@app.post("/forgot-password")
-async def forgot_password(username: str, background_tasks: BackgroundTasks, db: Session = Depends(database.get_db)):
     # Retrieve user from the database
-    user = crud.get_user_by_username(db, username=username)
+    user = await crud.get_user_by_username(db, username=username)
 
     # If user not found, return an error response
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    # Generate a 6-digit OTP and set an expiration time (1 hour)
-    otp = generate_otp()
-    expiration_time = datetime.utcnow() + timedelta(hours=1)
+    # a few mails per user and window, however many addresses ask
+    if not await reset_token_store.hit(f"reset_request:user:{user.user_id}", reset_tokens.RESET_REQUESTS_PER_USER):
+        raise too_many_attempts()
 
-    # Store the OTP and expiration time in the database for the user
-    crud.store_reset_token(user.user_id, otp, expiration_time)
+    # Generate a 6-digit OTP; it replaces any earlier one and expires after RESET_TOKEN_TTL
+    otp = generate_otp()
+    await reset_token_store.issue(user.user_id, otp)
+    valid_for = f"{reset_token_store.ttl // 60} minutes"
 
-    # Prepare the email message with the OTP
-    message = MessageSchema(
+    # Queue the email with the OTP; it survives a restart and is retried until the server takes it
+    await mail_outbox.enqueue(
+        recipient=user.email,
         subject="Your Password Reset OTP",
-        recipients=[user.email],  # Send to the user's email
-        body=f"Your OTP for resetting your password on BUZZ! is: {otp}\n\nThis OTP is valid for 1 hour.",
-        subtype=MessageType.plain  # Plain text email
+        body=f"Your OTP for resetting your password on BUZZ! is: {otp}\n\nThis OTP is valid for {valid_for}.",
     )
 
-    # Send the email in the background
-    background_tasks.add_task(send_email, message)
-
     # Return success response
     return JSONResponse(status_code=200, content={"message": "OTP sent to your email address."})
 
 
 # Define the request schema
 class ResetPasswordSchema(BaseModel):
+    username: str
     reset_token: str
     new_password: str
 
@@ -356,29 +766,44 @@ class MessageResponse(BaseModel):
     message: str
 
 # Route for resetting password
-@app.post("/reset-password", response_model=MessageResponse)
-async def reset_password(password_change: ResetPasswordSchema, db: Session = Depends(database.get_db)):
-    reset_token = password_change.reset_token
-    new_password = password_change.new_password
-
-    # Retrieve the reset request details from the stored tokens
-    reset_request = crud.reset_tokens.get(reset_token)
-    if not reset_request:
+@app.post("/reset-password", response_model=MessageResponse,
+          dependencies=[Depends(limit_by_ip("password_reset", rate_limiter.RATE_LIMIT_PASSWORD_RESET_IP))])
+async def reset_password(password_change: ResetPasswordSchema, request: Request, db: AsyncSession = Depends(database.get_db)):
+    if not await reset_token_store.hit(f"reset_attempt:ip:{request.client.host}", reset_tokens.RESET_ATTEMPTS_PER_IP):
+        raise too_many_attempts()
+
+    # The code is checked against the user's live one: single use, and burned after a few wrong guesses
+    user = await crud.get_user_by_username(db, username=password_change.username)
+    if not user or not await reset_token_store.consume(user.user_id, password_change.reset_token):
         raise HTTPException(status_code=400, detail="Invalid or expired reset token")
 
-    # Check if the reset token is expired
-    if reset_request["expiration_time"] < datetime.utcnow():
-        raise HTTPException(status_code=400, detail="Reset token expired")
-    
     # Update the user's password
-    crud.update_user_password(db, reset_request["user_id"], new_password)
+    await crud.update_user_password(db, user.user_id, password_change.new_password)
     
     return {"message": "Password successfully reset"}
 
 
-    
-
-
-
-    
-
+# Runtime statistics for sizing and debugging. Operators only: sent with
+# "Authorization: Bearer <METRICS_TOKEN>", and not served at all while METRICS_TOKEN is unset
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+def require_metrics_token(request: Request):
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not secrets.compare_digest(token.encode(), METRICS_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid metrics token", headers={"WWW-Authenticate": "Bearer"})
+
+@app.get("/metrics", dependencies=[Depends(require_metrics_token)])
+async def get_metrics():
+    return {"db_pool": database.pool_stats(),
+            "principal_cache": principal_cache.stats(),
+            "password_hasher": password_hasher.stats(),
+            "receipts": {"received": receipts.received, "written": receipts.written},
+            "message_cache": recent_messages.stats(),
+            "websockets": manager.stats(),
+            "presence": presence.stats(),
+            "membership_cache": membership_cache.stats(),
+            "reset_tokens": reset_token_store.stats(),
+            "mail_outbox": await mail_outbox.stats(),
+            "rate_limiter": rate_limiter.rate_limiter.stats()}
@@ -0,0 +1,67 @@
+# membership_cache.py
+# Bounded TTL/LRU cache of conversation members, keyed by conversation_id. Every access check
+# (REST, WebSocket connect, each WebSocket send) is a set lookup once the conversation has
+# been loaded by crud.get_member_ids.
+#
+# Membership changes invalidate the entry here and, with a broker attached, on every other
+# worker; they also tell the other workers who was removed, so their sockets can be closed.
+import json
+import os
+from typing import Callable, Iterable, Optional
+
+from dotenv import load_dotenv
+
+from broker import Broker
+from ttl_cache import TTLCache
+
+load_dotenv()
+
+MEMBERSHIP_CACHE_SIZE = int(os.getenv("MEMBERSHIP_CACHE_SIZE", "10000"))
+# bounds how long a missed broker message can leave another worker with stale members
+MEMBERSHIP_CACHE_TTL = float(os.getenv("MEMBERSHIP_CACHE_TTL", "300"))
+
+MEMBERSHIP_CHANNEL = "membership"
+
+RemovedHandler = Callable[[int, int], None]  # (conversation_id, user_id)
+
+
+class MembershipCache(TTLCache):
+    def __init__(self, max_size: int = MEMBERSHIP_CACHE_SIZE, ttl: float = MEMBERSHIP_CACHE_TTL):
+        super().__init__(max_size, ttl)
+        self.broker: Optional[Broker] = None
+        self.on_removed: Optional[RemovedHandler] = None
+
+    async def attach(self, broker: Broker, on_removed: Optional[RemovedHandler] = None):
+        self.broker = broker
+        self.on_removed = on_removed
+        await broker.subscribe(MEMBERSHIP_CHANNEL, self._on_broker_message)
+
+    async def detach(self):
+        if self.broker:
+            await self.broker.unsubscribe(MEMBERSHIP_CHANNEL, self._on_broker_message)
+            self.broker = None
+        self.on_removed = None
+
+    def put(self, conversation_id: int, member_ids: Iterable[int]):
+        super().put(conversation_id, frozenset(member_ids))
+
+    async def invalidate(self, conversation_id: int, removed: Iterable[int] = ()):
+        """Call after committing a membership change."""
+        removed = list(removed)
+        self._forget(conversation_id, removed)
+        if self.broker:
+            await self.broker.publish(MEMBERSHIP_CHANNEL, json.dumps({"conversation_id": conversation_id, "removed": removed}))
+
+    async def _on_broker_message(self, channel: str, message: str):
+        # our own invalidations come back too; forgetting twice is harmless
+        event = json.loads(message)
+        self._forget(event["conversation_id"], event["removed"])
+
+    def _forget(self, conversation_id: int, removed: Iterable[int]):
+        self.discard(conversation_id)
+        if self.on_removed:
+            for user_id in removed:
+                self.on_removed(conversation_id, user_id)
+
+
+membership_cache = MembershipCache()
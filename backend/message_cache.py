@@ -0,0 +1,221 @@
+# message_cache.py
+# The newest messages of recently opened conversations, kept in process so the first page
+# of an active chat is served without a database round trip.
+#
+# Every insert writes through (MessageWriter, crud.create_message). With a broker attached
+# the cache also follows the conversation channels that already carry every new message to
+# the sockets (connection_manager), but only for the conversations it holds, so other
+# workers' messages arrive here without any worker receiving every conversation's traffic.
+# MESSAGE_CACHE_TTL bounds how long an entry can be wrong if a broker message is ever lost.
+# Messages are kept as their encoded JSON (payloads.encode_message), so a cached page is
+# a byte join with no per-row serialisation.
+import asyncio
+import os
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+import orjson
+from dotenv import load_dotenv
+
+import payloads
+from broker import Broker
+from connection_manager import conversation_channel
+
+load_dotenv()
+
+MESSAGE_CACHE_PER_CONVERSATION = int(os.getenv("MESSAGE_CACHE_PER_CONVERSATION", "100"))
+MESSAGE_CACHE_MAX_BYTES = int(os.getenv("MESSAGE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+MESSAGE_CACHE_TTL = float(os.getenv("MESSAGE_CACHE_TTL", "300"))
+
+MESSAGE_OVERHEAD_BYTES = 100  # rough size of a CachedMessage besides its payload
+
+
+class CachedMessage:
+    __slots__ = ("message_id", "conversation_id", "payload")
+
+    def __init__(self, message_id: int, conversation_id: int, payload: bytes):
+        self.message_id = message_id
+        self.conversation_id = conversation_id
+        self.payload = payload
+
+    @classmethod
+    def from_message(cls, message) -> "CachedMessage":
+        return cls(message.message_id, message.conversation_id, payloads.encode_message(message))
+
+
+def message_size(message: CachedMessage) -> int:
+    return MESSAGE_OVERHEAD_BYTES + len(message.payload)
+
+
+class _Entry:
+    def __init__(self, messages: List[CachedMessage], complete: bool, ttl: float):
+        self.messages = messages  # oldest first, at most per_conversation
+        self.complete = complete  # True when this is the conversation's whole history
+        self.expires_at = time.monotonic() + ttl
+        self.size = sum(message_size(message) for message in messages)
+
+
+class RecentMessageCache:
+    def __init__(self, per_conversation: int = MESSAGE_CACHE_PER_CONVERSATION,
+                 max_bytes: int = MESSAGE_CACHE_MAX_BYTES, ttl: float = MESSAGE_CACHE_TTL):
+        self.per_conversation = per_conversation
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.broker: Optional[Broker] = None
+        self._unsubscribe_tasks: Set[asyncio.Task] = set()
+        self._entries: OrderedDict[int, _Entry] = OrderedDict()  # conversation_id -> entry, LRU order
+        self._filling: Dict[int, List[CachedMessage]] = {}  # writes that raced a fill
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def attach(self, broker: Broker):
+        self.broker = broker
+        for conversation_id in self._entries:
+            await broker.subscribe(conversation_channel(conversation_id), self._on_broker_message)
+
+    async def detach(self):
+        if self.broker:
+            for conversation_id in list(self._entries):
+                await self.broker.unsubscribe(conversation_channel(conversation_id), self._on_broker_message)
+            self.broker = None
+
+    async def get_page(self, conversation_id: int, before_id: Optional[int], limit: int,
+                       load: Callable[[int], Awaitable[list]]) -> Optional[List[bytes]]:
+        """Encoded newest `limit` messages (before before_id), oldest first, or None when the
+        cache can't answer. The newest page of an uncached conversation is loaded through
+        load(n) and kept."""
+        entry = self._get(conversation_id)
+        if entry is not None:
+            page = self._slice(entry, before_id, limit)
+            if page is not None:
+                self.hits += 1
+                return page
+        self.misses += 1
+        if before_id is not None or limit > self.per_conversation or conversation_id in self._filling:
+            return None
+
+        self._filling[conversation_id] = []
+        try:
+            # subscribed before loading: what arrives meanwhile is merged in below
+            if self.broker:
+                await self.broker.subscribe(conversation_channel(conversation_id), self._on_broker_message)
+            loaded = [CachedMessage.from_message(message) for message in await load(self.per_conversation)]
+            raced = self._filling[conversation_id]
+        finally:
+            del self._filling[conversation_id]
+            self._unsubscribe(conversation_id)  # a no-op once the entry is installed
+        entry = _Entry(loaded, complete=len(loaded) < self.per_conversation, ttl=self.ttl)
+        self._install(conversation_id, entry)
+        for message in raced:
+            self._append(conversation_id, entry, message)
+        self._evict()
+        return [message.payload for message in entry.messages[-limit:]]
+
+    async def add(self, messages: list):
+        """Write-through for freshly stored messages (anything with the message columns)."""
+        for message in messages:
+            self._apply(CachedMessage.from_message(message))
+        self._evict()
+
+    def invalidate(self, conversation_id: int):
+        entry = self._entries.pop(conversation_id, None)
+        if entry is not None:
+            self.size -= entry.size
+            self._unsubscribe(conversation_id)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "conversations": len(self._entries),
+            "messages": sum(len(entry.messages) for entry in self._entries.values()),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+    async def _on_broker_message(self, channel: str, envelope: str):
+        # connection_manager's "<origin> <conversation_id> <frame>"; only new messages matter here,
+        # and this worker's own were written through already (_append skips them)
+        frame = envelope.split(" ", 2)[2]
+        if not frame.startswith(payloads.MESSAGE_EVENT_PREFIX):
+            return
+        message = orjson.loads(frame)["message"]
+        self._apply(CachedMessage(message["message_id"], message["conversation_id"], orjson.dumps(message)))
+        self._evict()
+
+    def _unsubscribe(self, conversation_id: int):
+        if self.broker is None:
+            return
+        task = asyncio.create_task(self._unsubscribe_later(conversation_id))
+        self._unsubscribe_tasks.add(task)
+        task.add_done_callback(self._unsubscribe_tasks.discard)
+
+    async def _unsubscribe_later(self, conversation_id: int):
+        # the conversation may have been cached again in the meantime
+        if conversation_id not in self._entries and conversation_id not in self._filling and self.broker:
+            await self.broker.unsubscribe(conversation_channel(conversation_id), self._on_broker_message)
+
+    def _get(self, conversation_id: int) -> Optional[_Entry]:
+        entry = self._entries.get(conversation_id)
+        if entry is None:
+            return None
+        if entry.expires_at < time.monotonic():
+            self.invalidate(conversation_id)
+            return None
+        self._entries.move_to_end(conversation_id)
+        return entry
+
+    def _slice(self, entry: _Entry, before_id: Optional[int], limit: int) -> Optional[List[bytes]]:
+        messages = entry.messages
+        if before_id is not None:
+            messages = messages[:bisect_left([message.message_id for message in messages], before_id)]
+        if len(messages) < limit and not entry.complete:
+            # fewer than asked for is only the right answer when nothing older exists
+            return None
+        return [message.payload for message in messages[-limit:]]
+
+    def _apply(self, message: CachedMessage):
+        if message.conversation_id in self._filling:
+            self._filling[message.conversation_id].append(message)
+        entry = self._entries.get(message.conversation_id)
+        if entry is not None:
+            self._append(message.conversation_id, entry, message)
+
+    def _append(self, conversation_id: int, entry: _Entry, message: CachedMessage):
+        ids = [cached.message_id for cached in entry.messages]
+        position = bisect_left(ids, message.message_id)
+        if position < len(ids) and ids[position] == message.message_id:
+            return
+        if position == 0 and len(ids) >= self.per_conversation:
+            entry.complete = False  # older than everything we keep
+            return
+        entry.messages.insert(position, message)
+        entry.size += message_size(message)
+        self.size += message_size(message)
+        while len(entry.messages) > self.per_conversation:
+            dropped = entry.messages.pop(0)
+            entry.size -= message_size(dropped)
+            self.size -= message_size(dropped)
+            entry.complete = False
+
+    def _install(self, conversation_id: int, entry: _Entry):
+        self.invalidate(conversation_id)
+        self._entries[conversation_id] = entry
+        self.size += entry.size
+
+    def _evict(self):
+        while self.size > self.max_bytes and self._entries:
+            conversation_id, entry = self._entries.popitem(last=False)
+            self.size -= entry.size
+            self.evictions += 1
+            self._unsubscribe(conversation_id)
+
+
+recent_messages = RecentMessageCache()
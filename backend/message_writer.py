@@ -0,0 +1,188 @@
+# message_writer.py
+# Group commit for chat messages: concurrent senders are collected for a few
+# milliseconds (or until the batch is full) and written in one multi-row INSERT,
+# so a burst of N messages costs one transaction instead of N commits + N refreshes.
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import List, Optional, Tuple, Union
+
+from dotenv import load_dotenv
+from sqlalchemy import insert
+from sqlalchemy.exc import DBAPIError, IntegrityError
+
+import crud
+import database
+import models
+import schemas
+from message_cache import recent_messages
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_WRITER_FLUSH_MS = float(os.getenv("MESSAGE_WRITER_FLUSH_MS", "5"))
+MESSAGE_WRITER_BATCH_SIZE = int(os.getenv("MESSAGE_WRITER_BATCH_SIZE", "200"))
+# checked by the callers before write(), well inside MySQL's 64 KiB TEXT at 4 bytes a character
+MAX_MESSAGE_LENGTH = int(os.getenv("MAX_MESSAGE_LENGTH", "4000"))
+
+
+class _PendingMessage:
+    def __init__(self, row: dict, future: asyncio.Future):
+        self.row = row
+        self.future = future
+
+
+class MessageWriter:
+    def __init__(self, flush_interval_ms: float = MESSAGE_WRITER_FLUSH_MS, max_batch_size: int = MESSAGE_WRITER_BATCH_SIZE):
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_batch_size = max_batch_size
+        self._pending: List[_PendingMessage] = []
+        self._wakeup = asyncio.Event()
+        self._batch_full = asyncio.Event()
+        self._runner: Optional[asyncio.Task] = None
+        self._stopping = False
+        # counters for benchmarks and debugging
+        self.batches = 0
+        self.rows = 0
+
+    async def start(self):
+        self._stopping = False
+        self._runner = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # drain what is queued so no sender is left hanging on shutdown
+        self._stopping = True
+        self._wakeup.set()
+        if self._runner:
+            await self._runner
+            self._runner = None
+
+    async def write(self, conversation_id: int, sender_id: int, message_text: str,
+                    client_msg_id: Optional[str] = None) -> Tuple[schemas.Message, bool]:
+        """Queue a message and wait until its batch is committed.
+        Returns (stored message, duplicate) like a resent client_msg_id would."""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(_PendingMessage({
+            "conversation_id": conversation_id,
+            "sender_id": sender_id,
+            "message_text": message_text,
+            "client_msg_id": client_msg_id,
+        }, future))
+        self._wakeup.set()
+        if len(self._pending) >= self.max_batch_size:
+            self._batch_full.set()
+        return await future
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            if not self._stopping:
+                # give concurrent senders a moment to join this batch
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            await self._flush()
+            if self._stopping and not self._pending:
+                return
+
+    async def _flush(self):
+        batch = self._pending[:self.max_batch_size]
+        del self._pending[:self.max_batch_size]
+        if len(self._pending) < self.max_batch_size:
+            self._batch_full.clear()
+        if not self._pending:
+            self._wakeup.clear()
+        if not batch:
+            return
+
+        try:
+            results = await self._insert_batch([pending.row for pending in batch])
+        except Exception as exc:
+            logger.exception("Message batch of %s rows failed", len(batch))
+            for pending in batch:
+                if not pending.future.done():
+                    pending.future.set_exception(exc)
+            return
+
+        self.batches += 1
+        self.rows += len(batch)
+        for pending, result in zip(batch, results):
+            if pending.future.done():
+                continue
+            if isinstance(result, Exception):
+                pending.future.set_exception(result)
+            else:
+                pending.future.set_result(result)
+        try:
+            await recent_messages.add([result[0] for result in results
+                                       if not isinstance(result, Exception) and not result[1]])
+        except Exception:
+            logger.exception("Message cache write-through failed")
+
+    async def _insert_batch(self, rows: List[dict]) -> List[Union[Tuple[schemas.Message, bool], Exception]]:
+        """One result per row: (stored message, duplicate), or the error that row alone failed with."""
+        sent_at = datetime.utcnow()
+        for row in rows:
+            row["sent_at"] = sent_at
+        try:
+            async with database.async_engine.begin() as conn:
+                message_ids = await self._insert_rows(conn, rows)
+                await self._advance_conversations(conn, rows, message_ids)
+        except DBAPIError:
+            # one bad row (a resent client_msg_id, a value the database refuses) poisoned the
+            # batch; settle it row by row, so only that row's sender gets the error
+            results = []
+            for row in rows:
+                try:
+                    results.append(await self._insert_one(row))
+                except DBAPIError as exc:
+                    logger.warning("Message from sender %s failed: %s", row["sender_id"], exc)
+                    results.append(exc)
+            return results
+        return [(schemas.Message(message_id=message_id, **row), False) for message_id, row in zip(message_ids, rows)]
+
+    async def _insert_rows(self, conn, rows: List[dict]) -> List[int]:
+        dialect = conn.dialect
+        if dialect.insert_executemany_returning_sort_by_parameter_order:
+            # SQLite, Postgres, MariaDB: one INSERT ... VALUES (...), (...) RETURNING message_id
+            result = await conn.execute(
+                insert(models.Message).returning(models.Message.message_id, sort_by_parameter_order=True),
+                rows,
+            )
+            return [row.message_id for row in result]
+        if dialect.name == "mysql":
+            # no RETURNING: a multi-row "simple insert" gets consecutive ids starting at
+            # LAST_INSERT_ID() (InnoDB allocates them in one go, auto_increment_increment=1)
+            result = await conn.execute(insert(models.Message).values(rows))
+            return list(range(result.lastrowid, result.lastrowid + len(rows)))
+        return [(await conn.execute(insert(models.Message).values(row))).inserted_primary_key[0] for row in rows]
+
+    async def _advance_conversations(self, conn, rows: List[dict], message_ids: List[int]):
+        # one UPDATE per conversation (and per sender for unread counts) in the batch,
+        # in id order so concurrent workers lock rows alike
+        newest = {}
+        sent = {}
+        for row, message_id in zip(rows, message_ids):
+            newest[row["conversation_id"]] = max(newest.get(row["conversation_id"], 0), message_id)
+            key = (row["conversation_id"], row["sender_id"])
+            sent[key] = sent.get(key, 0) + 1
+        for conversation_id in sorted(newest):
+            await crud.advance_last_message_id(conn, conversation_id, newest[conversation_id])
+        for conversation_id, sender_id in sorted(sent):
+            await crud.add_unread(conn, conversation_id, sender_id, sent[(conversation_id, sender_id)])
+
+    async def _insert_one(self, row: dict) -> Tuple[schemas.Message, bool]:
+        try:
+            async with database.async_engine.begin() as conn:
+                message_id = (await self._insert_rows(conn, [row]))[0]
+                await self._advance_conversations(conn, [row], [message_id])
+            return schemas.Message(message_id=message_id, **row), False
+        except IntegrityError:
+            async with database.AsyncSessionLocal() as db:
+                existing = await crud.get_message_by_client_msg_id(db, sender_id=row["sender_id"], client_msg_id=row["client_msg_id"])
+                if existing is None:
+                    raise
+                return schemas.Message.model_validate(existing), True
@@ -1,7 +1,9 @@
 # models.py
-from sqlalchemy import Column, Integer, String, ForeignKey, Text, DateTime, Boolean
+from sqlalchemy import Column, Integer, String, ForeignKey, Text, DateTime, Boolean, Index, UniqueConstraint, CheckConstraint
+from sqlalchemy.dialects import mysql
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
+from datetime import datetime
 from database import Base
 
 # users table
@@ -15,6 +17,7 @@ class User(Base):
     
     # New column to store Cloudinary URL for profile picture
     profile_image_url = Column(String(500), nullable=True)  # URL to the profile picture
+    profile_image_thumb_url = Column(String(500), nullable=True)  # small variant for lists
     
     # relationships
     conversations1 = relationship('Conversation', foreign_keys='Conversation.user1_id', back_populates='user1')
@@ -26,10 +29,24 @@ class User(Base):
 # conversations table
 class Conversation(Base):
     __tablename__ = 'conversations'
+    __table_args__ = (
+        # one direct conversation per pair of users: stored as (low user id, high user id), see
+        # crud.conversation_pair. Groups leave both NULL; membership is in conversation_members.
+        UniqueConstraint('user1_id', 'user2_id', name='uq_conversations_user1_id_user2_id'),
+        CheckConstraint('user1_id <= user2_id', name='ck_conversations_ordered_pair'),
+        # the inbox seeks each participant column and reads it newest-first
+        Index('ix_conversations_user1_id_last_message_id', 'user1_id', 'last_message_id'),
+        Index('ix_conversations_user2_id_last_message_id', 'user2_id', 'last_message_id'),
+    )
     
     conversation_id = Column(Integer, primary_key=True, index=True)
-    user1_id = Column(Integer, ForeignKey('users.user_id'), nullable=False)
-    user2_id = Column(Integer, ForeignKey('users.user_id'), nullable=False)
+    user1_id = Column(Integer, ForeignKey('users.user_id'), nullable=True)
+    user2_id = Column(Integer, ForeignKey('users.user_id'), nullable=True)
+    is_group = Column(Boolean, nullable=False, default=False, server_default='0')
+    title = Column(String(100), nullable=True)  # groups only
+    # denormalised newest message_id (0 = no messages yet), kept up to date by every message insert;
+    # no foreign key so conversations and messages don't depend on each other
+    last_message_id = Column(Integer, nullable=False, default=0, server_default='0')
 
     # Relationships
     user1 = relationship('User', foreign_keys=[user1_id], back_populates='conversations1')
@@ -37,17 +54,40 @@ class Conversation(Base):
     messages = relationship('Message', back_populates='conversation')
 
 
+# Who takes part in a conversation: both users of a direct chat, every member of a group
+class ConversationMember(Base):
+    __tablename__ = 'conversation_members'
+    __table_args__ = (
+        # "my conversations" for the inbox and sync
+        Index('ix_conversation_members_user_id_conversation_id', 'user_id', 'conversation_id'),
+    )
+
+    conversation_id = Column(Integer, ForeignKey('conversations.conversation_id'), primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.user_id'), primary_key=True)
+    role = Column(String(20), nullable=False, default='member', server_default='member')  # owner | member
+    joined_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
 
 # Messages table
 class Message(Base):
     __tablename__ = 'messages'
-    
+    __table_args__ = (
+        # serves keyset pagination of a conversation's history
+        Index('ix_messages_conversation_id_message_id', 'conversation_id', 'message_id'),
+        # a retried WebSocket send carries the same client_msg_id and must not be stored twice
+        UniqueConstraint('sender_id', 'client_msg_id', name='uq_messages_sender_id_client_msg_id'),
+        # message search on MySQL; SQLite uses an FTS5 table instead (search.py)
+        Index('ix_messages_message_text_fulltext', 'message_text', mysql_prefix='FULLTEXT').ddl_if(dialect='mysql'),
+    )
+
     message_id = Column(Integer, primary_key=True, index=True)
     conversation_id = Column(Integer, ForeignKey('conversations.conversation_id'), nullable=False)
     sender_id = Column(Integer, ForeignKey('users.user_id'), nullable=False)
     message_text = Column(Text, nullable=False)
     sent_at = Column(DateTime(timezone=True), server_default=func.now())
-    # is_read = Column(Boolean, default=False)
+    client_msg_id = Column(String(64), nullable=True)  # set by the sending client for idempotent retries
+    # read state lives in ConversationReadState watermarks, not a per-message is_read flag
 
     # Relationships
     conversation = relationship('Conversation', back_populates='messages')
@@ -55,3 +95,75 @@ class Message(Base):
 
 
 
+# Stored profile images by the SHA-256 of the uploaded file: the same file uploaded again
+# reuses these variants instead of being resized and uploaded once more
+class ProfileImage(Base):
+    __tablename__ = 'profile_images'
+
+    content_hash = Column(String(64), primary_key=True)
+    url = Column(String(500), nullable=False)  # medium variant
+    thumb_url = Column(String(500), nullable=False)  # small variant
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+
+# Events relayed between worker processes by broker.DatabaseBroker
+class BrokerEvent(Base):
+    __tablename__ = 'broker_events'
+
+    event_id = Column(Integer, primary_key=True, index=True)
+    channel = Column(String(255), nullable=False)
+    # relayed image frames carry data URLs of a few MB, far past MySQL's 64 KB TEXT
+    payload = Column(Text().with_variant(mysql.LONGTEXT(), 'mysql'), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+
+# Password-reset codes for reset_tokens.DatabaseResetTokenStore: one live code per user, stored
+# as an HMAC, deleted on use, after too many wrong guesses, or by the sweep once expired
+class PasswordResetToken(Base):
+    __tablename__ = 'password_reset_tokens'
+
+    user_id = Column(Integer, ForeignKey('users.user_id'), primary_key=True)
+    token_hash = Column(String(64), nullable=False)
+    attempts = Column(Integer, nullable=False, default=0, server_default='0')  # wrong codes so far
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+# Fixed-window attempt counters (reset requests per user/IP, reset attempts per IP)
+class AttemptCounter(Base):
+    __tablename__ = 'attempt_counters'
+
+    key = Column(String(100), primary_key=True)
+    count = Column(Integer, nullable=False, default=0, server_default='0')
+    window_ends_at = Column(DateTime, nullable=False, index=True)
+
+
+# Outgoing mail for mail_outbox.MailOutbox: written in the request, sent by a background sender.
+# A row is deleted once delivered (or given up on); next_attempt_at is when it is due again,
+# and a claimed row becomes due once more if its sender dies before finishing
+class EmailOutbox(Base):
+    __tablename__ = 'email_outbox'
+
+    email_id = Column(Integer, primary_key=True)
+    recipient = Column(String(255), nullable=False)
+    subject = Column(String(255), nullable=False)
+    body = Column(Text, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0, server_default='0')
+    next_attempt_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+    claimed_by = Column(String(32), nullable=True)  # the batch that is sending it
+    last_error = Column(String(500), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+# Per-(conversation, user) receipts: watermarks instead of a flag on every message, so opening
+# a chat is one row update however much was unread
+class ConversationReadState(Base):
+    __tablename__ = 'conversation_read_states'
+
+    conversation_id = Column(Integer, ForeignKey('conversations.conversation_id'), primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.user_id'), primary_key=True)
+    last_read_message_id = Column(Integer, nullable=False, default=0, server_default='0')
+    last_delivered_message_id = Column(Integer, nullable=False, default=0, server_default='0')
+    # messages from the other participant after last_read_message_id, maintained on insert in
+    # direct chats only; for groups the inbox counts them, so a send never touches every member
+    unread_count = Column(Integer, nullable=False, default=0, server_default='0')
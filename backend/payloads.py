@@ -0,0 +1,83 @@
+# payloads.py
+# JSON for the hot paths. A message is encoded once, straight from its columns with orjson,
+# and those bytes are reused for the page response, the cache, the ack and the broadcast
+# frame that every socket in the conversation receives.
+#
+# A WebSocket speaks JSON text frames unless the client negotiates the msgpack subprotocol,
+# in which case both directions use binary msgpack maps with the same shape as the JSON.
+import json
+from typing import Iterable, Optional
+
+import msgpack
+import orjson
+
+JSON_SUBPROTOCOL = "buzz.json"
+MSGPACK_SUBPROTOCOL = "buzz.msgpack"
+SUBPROTOCOLS = (MSGPACK_SUBPROTOCOL, JSON_SUBPROTOCOL)
+
+
+def message_dict(message) -> dict:
+    # any object with the message columns as attributes: a column-tuple Row, an ORM Message, a schemas.Message
+    return {
+        "message_id": message.message_id,
+        "conversation_id": message.conversation_id,
+        "sender_id": message.sender_id,
+        "message_text": message.message_text,
+        "sent_at": message.sent_at,
+        "client_msg_id": message.client_msg_id,
+    }
+
+
+def encode_message(message) -> bytes:
+    return orjson.dumps(message_dict(message))
+
+
+def encode_message_page(encoded_messages: Iterable[bytes]) -> bytes:
+    return b"[" + b",".join(encoded_messages) + b"]"
+
+
+# WebSocket frames are text, so these return str built around the already encoded message
+MESSAGE_EVENT_PREFIX = '{"type":"message","message":'
+
+
+def message_event(encoded_message: bytes) -> str:
+    return MESSAGE_EVENT_PREFIX + encoded_message.decode() + "}"
+
+
+def ack_event(client_msg_id: Optional[str], encoded_message: bytes) -> str:
+    return '{"type":"ack","client_msg_id":' + orjson.dumps(client_msg_id).decode() + ',"message":' + encoded_message.decode() + "}"
+
+
+class Frame:
+    """An outbound event. It is produced as JSON text, which is also what crosses the broker,
+    and packed to msgpack at most once, by the first binary socket that needs it."""
+    __slots__ = ("text", "_packed")
+
+    def __init__(self, text: str):
+        self.text = text
+        self._packed: Optional[bytes] = None
+
+    def packed(self) -> bytes:
+        if self._packed is None:
+            self._packed = msgpack.packb(orjson.loads(self.text))
+        return self._packed
+
+
+def choose_subprotocol(offered: Iterable[str]) -> Optional[str]:
+    # the client lists its preference first; no match means plain JSON without a subprotocol
+    for subprotocol in offered:
+        if subprotocol in SUBPROTOCOLS:
+            return subprotocol
+    return None
+
+
+def decode_client_frame(message: dict) -> Optional[dict]:
+    """The object in a received text (JSON) or binary (msgpack) frame, or None if there isn't one."""
+    try:
+        if message.get("bytes") is not None:
+            frame = msgpack.unpackb(message["bytes"])
+        else:
+            frame = json.loads(message["text"])
+    except (ValueError, msgpack.UnpackException):
+        return None
+    return frame if isinstance(frame, dict) else None
@@ -0,0 +1,241 @@
+# presence.py
+# Online, last-seen and typing state, kept in memory and expired by TTL; nothing is written
+# to the database.
+#
+# Online means "has a socket on some worker". Each worker announces its users going online
+# or offline on the presence channel and re-announces all of them every PRESENCE_TTL / 3, so
+# the users of a worker that dies go offline once PRESENCE_TTL passes. Every worker merges
+# these into the same view and tells its own sockets about the peers they are chatting with.
+#
+# Typing is held by the worker the typist is connected to. Keystrokes only refresh a
+# deadline; what goes out, once per PRESENCE_FLUSH_MS and conversation, is one frame with the
+# users who started or stopped typing, through the conversation channel so only workers with
+# sockets in that conversation receive it.
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+
+from connection_manager import ConnectionManager
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+PRESENCE_FLUSH_MS = float(os.getenv("PRESENCE_FLUSH_MS", "250"))
+PRESENCE_TTL = float(os.getenv("PRESENCE_TTL", "30"))
+TYPING_TTL = float(os.getenv("TYPING_TTL", "6"))
+LAST_SEEN_TTL = float(os.getenv("LAST_SEEN_TTL", str(24 * 60 * 60)))
+
+PRESENCE_CHANNEL = "presence"
+
+
+class PresenceService:
+    def __init__(self, manager: ConnectionManager, flush_interval_ms: float = PRESENCE_FLUSH_MS,
+                 ttl: float = PRESENCE_TTL, typing_ttl: float = TYPING_TTL, last_seen_ttl: float = LAST_SEEN_TTL):
+        self.manager = manager
+        self.flush_interval = flush_interval_ms / 1000
+        self.ttl = ttl
+        self.typing_ttl = typing_ttl
+        self.last_seen_ttl = last_seen_ttl
+        self.node_id = uuid.uuid4().hex
+        self._runner: Optional[asyncio.Task] = None
+        self._next_announce = 0.0
+
+        self._remote: Dict[int, Dict[str, float]] = {}  # user_id -> {node_id: expires_at}, other workers
+        self._last_seen: Dict[int, datetime] = {}  # user_id -> when they went offline
+        self._local_changes: Dict[int, bool] = {}  # user_id -> online, not yet announced
+
+        # conversations with local sockets: who takes part, and the reverse index
+        self._participants: Dict[int, Tuple[int, ...]] = {}
+        self._watchers: Dict[int, Set[int]] = {}  # user_id -> conversation_ids
+        self._presence_outbox: Dict[int, Dict[int, bool]] = {}  # conversation_id -> {user_id: online}
+
+        self._typing: Dict[Tuple[int, int], float] = {}  # (conversation_id, user_id) -> expires_at
+        self._typing_outbox: Dict[int, Dict[int, bool]] = {}  # conversation_id -> {user_id: typing}
+
+        # counters for /metrics
+        self.typing_received = 0
+        self.frames_sent = 0
+
+    async def start(self):
+        await self.manager.broker.subscribe(PRESENCE_CHANNEL, self._on_broker_message)
+        self._runner = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._runner:
+            self._runner.cancel()
+            try:
+                await self._runner
+            except asyncio.CancelledError:
+                pass
+            self._runner = None
+        await self.manager.broker.unsubscribe(PRESENCE_CHANNEL, self._on_broker_message)
+
+    def is_online(self, user_id: int) -> bool:
+        return user_id in self.manager.user_connections or bool(self._remote.get(user_id))
+
+    def snapshot(self, user_ids: Iterable[int]) -> list:
+        return [self._user_state(user_id) for user_id in user_ids]
+
+    def connected(self, conversation_id: int, user_id: int, participants: Iterable[int]):
+        """Call after ConnectionManager.connect registered the socket."""
+        if conversation_id not in self._participants:
+            self._participants[conversation_id] = tuple(participants)
+            for participant in self._participants[conversation_id]:
+                self._watchers.setdefault(participant, set()).add(conversation_id)
+        if len(self.manager.user_connections.get(user_id, ())) == 1:
+            self._set_local(user_id, True)
+
+    def disconnected(self, conversation_id: int, user_id: int):
+        """Call after ConnectionManager.disconnect removed the socket."""
+        if not any(connection.conversation_id == conversation_id
+                   for connection in self.manager.user_connections.get(user_id, ())):
+            self.stop_typing(conversation_id, user_id)
+        if user_id not in self.manager.user_connections:
+            self._set_local(user_id, False)
+        if conversation_id in self._participants and conversation_id not in self.manager.active_connections:
+            for participant in self._participants.pop(conversation_id):
+                watched = self._watchers.get(participant)
+                if watched is not None:
+                    watched.discard(conversation_id)
+                    if not watched:
+                        del self._watchers[participant]
+
+    def typing(self, conversation_id: int, user_id: int):
+        """A keystroke; only the transition to typing ever leaves this worker."""
+        self.typing_received += 1
+        key = (conversation_id, user_id)
+        if key not in self._typing:
+            self._typing_outbox.setdefault(conversation_id, {})[user_id] = True
+        self._typing[key] = time.monotonic() + self.typing_ttl
+
+    def stop_typing(self, conversation_id: int, user_id: int):
+        if self._typing.pop((conversation_id, user_id), None) is not None:
+            self._typing_outbox.setdefault(conversation_id, {})[user_id] = False
+
+    def stats(self) -> dict:
+        return {
+            "online_local": len(self.manager.user_connections),
+            "online_remote": len(self._remote),
+            "typing": len(self._typing),
+            "last_seen": len(self._last_seen),
+            "typing_received": self.typing_received,
+            "frames_sent": self.frames_sent,
+        }
+
+    def _user_state(self, user_id: int) -> dict:
+        last_seen = self._last_seen.get(user_id)
+        return {
+            "user_id": user_id,
+            "online": self.is_online(user_id),
+            "last_seen": last_seen.isoformat() if last_seen else None,
+        }
+
+    def _set_local(self, user_id: int, online: bool):
+        self._local_changes[user_id] = online
+        if not self._remote.get(user_id):  # no other worker has a socket for them either
+            if not online:
+                self._last_seen[user_id] = datetime.utcnow()
+            self._changed(user_id)
+
+    def _changed(self, user_id: int):
+        online = self.is_online(user_id)
+        for conversation_id in self._watchers.get(user_id, ()):
+            self._presence_outbox.setdefault(conversation_id, {})[user_id] = online
+
+    async def _on_broker_message(self, channel: str, message: str):
+        event = json.loads(message)
+        node_id = event["node"]
+        if node_id == self.node_id:
+            return
+        expires_at = time.monotonic() + self.ttl
+        for user_id in event.get("online", ()):
+            nodes = self._remote.setdefault(user_id, {})
+            was_online = user_id in self.manager.user_connections or bool(nodes)
+            nodes[node_id] = expires_at
+            if not was_online:
+                self._changed(user_id)
+        for user_id in event.get("offline", ()):
+            nodes = self._remote.get(user_id)
+            if nodes is None or nodes.pop(node_id, None) is None:
+                continue
+            if not nodes:
+                del self._remote[user_id]
+            if not self.is_online(user_id):
+                self._last_seen[user_id] = datetime.utcnow()
+                self._changed(user_id)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Presence flush failed")
+
+    async def flush(self):
+        now = time.monotonic()
+        self._expire_typing(now)
+        if now >= self._next_announce:
+            self._next_announce = now + self.ttl / 3
+            self._expire_remote(now)
+            # a full announcement also refreshes our users' entries on every other worker
+            online = list(self.manager.user_connections)
+            offline = [user_id for user_id, is_online in self._local_changes.items() if not is_online]
+        else:
+            online = [user_id for user_id, is_online in self._local_changes.items() if is_online]
+            offline = [user_id for user_id, is_online in self._local_changes.items() if not is_online]
+        self._local_changes = {}
+        if online or offline:
+            await self.manager.broker.publish(
+                PRESENCE_CHANNEL, json.dumps({"node": self.node_id, "online": online, "offline": offline})
+            )
+
+        presence_outbox, self._presence_outbox = self._presence_outbox, {}
+        for conversation_id, users in presence_outbox.items():
+            # each worker has the same view, so presence frames only go to local sockets
+            self.manager.send_local(json.dumps({
+                "type": "presence",
+                "conversation_id": conversation_id,
+                "users": self.snapshot(users),
+            }), conversation_id)
+            self.frames_sent += 1
+
+        typing_outbox, self._typing_outbox = self._typing_outbox, {}
+        for conversation_id, users in typing_outbox.items():
+            await self.manager.send_message(json.dumps({
+                "type": "typing",
+                "conversation_id": conversation_id,
+                "typing": [user_id for user_id, is_typing in users.items() if is_typing],
+                "stopped": [user_id for user_id, is_typing in users.items() if not is_typing],
+            }), conversation_id)
+            self.frames_sent += 1
+
+    def _expire_typing(self, now: float):
+        for key, expires_at in list(self._typing.items()):
+            if expires_at < now:
+                del self._typing[key]
+                conversation_id, user_id = key
+                self._typing_outbox.setdefault(conversation_id, {})[user_id] = False
+
+    def _expire_remote(self, now: float):
+        for user_id, nodes in list(self._remote.items()):
+            for node_id, expires_at in list(nodes.items()):
+                if expires_at < now:
+                    del nodes[node_id]  # that worker stopped announcing: gone
+            if not nodes:
+                del self._remote[user_id]
+                if user_id not in self.manager.user_connections:
+                    self._last_seen[user_id] = datetime.utcnow()
+                    self._changed(user_id)
+        cutoff = datetime.utcnow().timestamp() - self.last_seen_ttl
+        for user_id, last_seen in list(self._last_seen.items()):
+            if last_seen.timestamp() < cutoff:
+                del self._last_seen[user_id]
@@ -0,0 +1,42 @@
+# principal_cache.py
+# Bounded TTL/LRU cache of authenticated users, keyed by the user_id claim.
+# The JWT is still decoded and checked on every request; the cache only saves the
+# SELECT that turns a valid token back into a user row.
+import os
+from typing import Optional
+
+from dotenv import load_dotenv
+
+import models
+from ttl_cache import TTLCache
+
+load_dotenv()
+
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+# also bounds how long another worker can serve a stale profile after an update
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+
+USER_COLUMNS = ("user_id", "username", "email", "password_hash", "profile_image_url", "profile_image_thumb_url")
+
+
+class PrincipalCache(TTLCache):
+    """Holds the user's columns rather than the ORM object."""
+
+    def __init__(self, max_size: int = PRINCIPAL_CACHE_SIZE, ttl: float = PRINCIPAL_CACHE_TTL):
+        super().__init__(max_size, ttl)
+
+    def get(self, user_id: int) -> Optional[models.User]:
+        columns = super().get(user_id)
+        if columns is None:
+            return None
+        # a fresh transient copy, so a handler can't change what other requests see
+        return models.User(**columns)
+
+    def put(self, user: models.User):
+        super().put(user.user_id, {name: getattr(user, name) for name in USER_COLUMNS})
+
+    def invalidate(self, user_id: int):
+        self.discard(user_id)
+
+
+principal_cache = PrincipalCache()
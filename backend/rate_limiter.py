@@ -0,0 +1,238 @@
+# rate_limiter.py
+# Token-bucket rate limits. A bucket holds up to `capacity` tokens and refills continuously at
+# `rate` per second; each request takes one. Checking is O(1): the refill since the last check
+# is computed, nothing runs in the background.
+#
+# Limits are written "<count>/<period>", e.g. "30/10s" (a burst of 30, then 3 per second) or
+# "5/m"; "off" disables one. They apply:
+#   - as FastAPI dependencies (limit_by_ip, limit_by_username), answering 429 with Retry-After
+#   - to messages, through message_wait once the sender is known to be a member: /send-message
+#     answers 429, WebSocket message/image frames get an error frame saying when to retry
+#   - to WebSocket traffic: every frame takes from a per-socket TokenBucket (a flood closes the
+#     socket with 1008)
+#
+# Per-user, per-IP and per-conversation buckets live in the backend chosen by RATE_LIMIT_STORE:
+# memory:// (default; each worker enforces the limit on its own) or redis://... (one bucket
+# shared by all workers, one round trip per check). Per-socket buckets are always local.
+import logging
+import math
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from dotenv import load_dotenv
+from fastapi import Depends, HTTPException, Request, status
+from fastapi.security import OAuth2PasswordRequestForm
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+class Limit(NamedTuple):
+    capacity: float
+    rate: float  # tokens per second
+
+
+PERIODS = {"s": 1, "m": 60, "h": 3600}
+LIMIT_SPEC = re.compile(r"^\s*(\d+)\s*/\s*(\d*)\s*([smh])\s*$")
+
+
+def parse_limit(spec: str) -> Optional[Limit]:
+    if spec.strip().lower() in ("", "off", "0"):
+        return None
+    match = LIMIT_SPEC.match(spec)
+    if not match:
+        raise ValueError(f"Invalid rate limit: {spec!r} (expected e.g. '30/10s' or '5/m')")
+    count, multiple, unit = int(match.group(1)), int(match.group(2) or 1), match.group(3)
+    if count < 1 or multiple < 1:
+        # a bucket that never refills would have no retry time to give; disable a limit with "off"
+        raise ValueError(f"Invalid rate limit: {spec!r} (count and period must be at least 1; use 'off' to disable)")
+    return Limit(capacity=count, rate=count / (multiple * PERIODS[unit]))
+
+
+RATE_LIMIT_MESSAGES_USER = parse_limit(os.getenv("RATE_LIMIT_MESSAGES_USER", "30/10s"))
+RATE_LIMIT_MESSAGES_CONVERSATION = parse_limit(os.getenv("RATE_LIMIT_MESSAGES_CONVERSATION", "100/10s"))
+RATE_LIMIT_WS_FRAMES = parse_limit(os.getenv("RATE_LIMIT_WS_FRAMES", "120/10s"))
+RATE_LIMIT_LOGIN_IP = parse_limit(os.getenv("RATE_LIMIT_LOGIN_IP", "20/m"))
+RATE_LIMIT_LOGIN_USER = parse_limit(os.getenv("RATE_LIMIT_LOGIN_USER", "10/m"))
+RATE_LIMIT_SIGNUP_IP = parse_limit(os.getenv("RATE_LIMIT_SIGNUP_IP", "10/m"))
+RATE_LIMIT_PASSWORD_RESET_IP = parse_limit(os.getenv("RATE_LIMIT_PASSWORD_RESET_IP", "10/m"))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+
+
+class TokenBucket:
+    __slots__ = ("capacity", "rate", "tokens", "updated_at")
+
+    def __init__(self, limit: Limit):
+        self.capacity = limit.capacity
+        self.rate = limit.rate
+        self.tokens = limit.capacity
+        self.updated_at = time.monotonic()
+
+    def take(self, cost: float = 1) -> float:
+        """Takes cost tokens if there are enough; returns 0, or the seconds until there will be."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Base class: counters for /metrics, backends keep the buckets."""
+
+    def __init__(self):
+        self.checks = 0
+        self.limited = 0
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def acquire(self, key: str, limit: Optional[Limit], cost: float = 1) -> float:
+        """0 if allowed, otherwise the seconds to wait; a disabled limit always allows."""
+        if limit is None:
+            return 0.0
+        self.checks += 1
+        wait = await self._take(key, limit, cost)
+        if wait:
+            self.limited += 1
+        return wait
+
+    def stats(self) -> dict:
+        return {"checks": self.checks, "limited": self.limited}
+
+    async def _take(self, key: str, limit: Limit, cost: float) -> float:
+        raise NotImplementedError
+
+
+class InMemoryRateLimiter(RateLimiter):
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        super().__init__()
+        self.max_keys = max_keys
+        self._buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+        self.evicted = 0
+
+    async def _take(self, key: str, limit: Limit, cost: float) -> float:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(limit)
+            # the least recently used bucket has had the longest to refill, so forgetting it
+            # (it comes back full) loses the least
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+                self.evicted += 1
+        else:
+            self._buckets.move_to_end(key)
+        return bucket.take(cost)
+
+    def stats(self) -> dict:
+        return {**super().stats(), "buckets": len(self._buckets), "max_keys": self.max_keys, "evicted": self.evicted}
+
+
+class RedisRateLimiter(RateLimiter):
+    """Buckets shared by all workers, for anything that speaks the Redis protocol. The server's
+    clock is used, so workers' clocks don't need to agree."""
+
+    TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(bucket[1]) or capacity
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate)
+local wait = 0
+if tokens >= cost then tokens = tokens - cost else wait = (cost - tokens) / rate end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000))
+return tostring(wait)
+"""
+
+    def __init__(self, url: str):
+        super().__init__()
+        self.url = url
+        self._redis = None
+        self.errors = 0
+
+    async def start(self):
+        try:
+            import redis.asyncio as aioredis
+        except ImportError:
+            raise RuntimeError("RATE_LIMIT_STORE points at Redis but the 'redis' package is not installed")
+        self._redis = aioredis.from_url(self.url, decode_responses=True)
+
+    async def stop(self):
+        if self._redis:
+            await self._redis.aclose()
+
+    async def _take(self, key: str, limit: Limit, cost: float) -> float:
+        try:
+            return float(await self._redis.eval(self.TAKE_SCRIPT, 1, f"rate:{key}", limit.capacity, limit.rate, cost))
+        except Exception:
+            # an unreachable Redis must not take chat down with it: allow, and say so
+            self.errors += 1
+            logger.exception("Rate limit check failed, allowing")
+            return 0.0
+
+    def stats(self) -> dict:
+        return {**super().stats(), "errors": self.errors}
+
+
+def create_rate_limiter(url: str = None) -> RateLimiter:
+    # RATE_LIMIT_STORE: memory:// (default, per worker) or redis://host:6379/0
+    url = url or os.getenv("RATE_LIMIT_STORE", "memory://")
+    if url.startswith("memory://"):
+        return InMemoryRateLimiter()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisRateLimiter(url)
+    raise ValueError(f"Unsupported RATE_LIMIT_STORE: {url}")
+
+
+rate_limiter = create_rate_limiter()
+
+
+def too_many_requests(wait: float) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Rate limit exceeded",
+        headers={"Retry-After": str(math.ceil(wait))},
+    )
+
+
+async def enforce(key: str, limit: Optional[Limit]):
+    wait = await rate_limiter.acquire(key, limit)
+    if wait:
+        raise too_many_requests(wait)
+
+
+# FastAPI dependencies; `scope` keeps the buckets of different endpoints apart
+def limit_by_ip(scope: str, limit: Optional[Limit]):
+    async def dependency(request: Request):
+        await enforce(f"{scope}:ip:{request.client.host}", limit)
+    return dependency
+
+
+def limit_by_username(scope: str, limit: Optional[Limit]):
+    # for the login form: failed and successful attempts alike, so guessing one account is slow
+    async def dependency(form_data: OAuth2PasswordRequestForm = Depends()):
+        await enforce(f"{scope}:username:{form_data.username.lower()}", limit)
+    return dependency
+
+
+async def message_wait(user_id: int, conversation_id: int) -> float:
+    """The per-user and per-conversation message limits: 0, or seconds to wait.
+    Only call it for a confirmed member; anyone else could drain the conversation's bucket."""
+    wait = await rate_limiter.acquire(f"messages:user:{user_id}", RATE_LIMIT_MESSAGES_USER)
+    if not wait:
+        wait = await rate_limiter.acquire(f"messages:conversation:{conversation_id}", RATE_LIMIT_MESSAGES_CONVERSATION)
+    return wait
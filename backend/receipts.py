@@ -0,0 +1,107 @@
+# receipts.py
+# Read/delivered receipts arrive with every message a client shows. They are folded into
+# one pending watermark per (conversation, user) and written once per RECEIPT_FLUSH_MS,
+# after which the peer is told about the new watermarks through the ConnectionManager.
+import asyncio
+import json
+import logging
+import os
+from typing import Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import select
+
+import crud
+import database
+import models
+from connection_manager import ConnectionManager
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+RECEIPT_FLUSH_MS = float(os.getenv("RECEIPT_FLUSH_MS", "1000"))
+
+
+def receipt_event(read_state) -> str:
+    return json.dumps({
+        "type": "receipt",
+        "conversation_id": read_state.conversation_id,
+        "user_id": read_state.user_id,
+        "last_read_message_id": read_state.last_read_message_id,
+        "last_delivered_message_id": read_state.last_delivered_message_id,
+    })
+
+
+class ReceiptCoalescer:
+    def __init__(self, manager: ConnectionManager, flush_interval_ms: float = RECEIPT_FLUSH_MS):
+        self.manager = manager
+        self.flush_interval = flush_interval_ms / 1000
+        self._pending: Dict[Tuple[int, int], Dict[str, int]] = {}  # (conversation_id, user_id) -> watermarks
+        self._runner: Optional[asyncio.Task] = None
+        # counters for benchmarks and debugging
+        self.received = 0
+        self.written = 0
+
+    async def start(self):
+        self._runner = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._runner:
+            self._runner.cancel()
+            try:
+                await self._runner
+            except asyncio.CancelledError:
+                pass
+            self._runner = None
+        await self.flush()
+
+    def record(self, conversation_id: int, user_id: int, read_message_id: Optional[int] = None,
+               delivered_message_id: Optional[int] = None):
+        """Remember the highest watermarks seen since the last flush; never touches the database."""
+        self.received += 1
+        pending = self._pending.setdefault((conversation_id, user_id), {"read": 0, "delivered": 0})
+        pending["read"] = max(pending["read"], read_message_id or 0)
+        pending["delivered"] = max(pending["delivered"], delivered_message_id or 0, pending["read"])
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Receipt flush failed")
+
+    async def flush(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        conversation_ids = {conversation_id for conversation_id, _ in batch}
+
+        async with database.AsyncSessionLocal() as db:
+            # a client can't mark messages read that don't exist yet
+            result = await db.execute(
+                select(models.Conversation.conversation_id, models.Conversation.last_message_id)
+                .filter(models.Conversation.conversation_id.in_(conversation_ids))
+            )
+            newest = dict(result.all())
+
+            moved = []
+            for (conversation_id, user_id), watermarks in sorted(batch.items()):
+                if conversation_id not in newest:
+                    continue
+                if await crud.update_read_state(
+                    db, conversation_id, user_id,
+                    read_message_id=min(watermarks["read"], newest[conversation_id]),
+                    delivered_message_id=min(watermarks["delivered"], newest[conversation_id]),
+                ):
+                    moved.append((conversation_id, user_id))
+            await db.commit()
+            self.written += len(moved)
+
+            states = []
+            for conversation_id, user_id in moved:
+                states.append(await db.get(models.ConversationReadState, (conversation_id, user_id)))
+
+        for read_state in states:
+            await self.manager.send_message(receipt_event(read_state), read_state.conversation_id)
@@ -0,0 +1,323 @@
+# reset_tokens.py
+# Password-reset codes and the attempt limits around them.
+#
+# Each user has at most one live code; issuing a new one replaces it. Codes are stored as an
+# HMAC keyed with SECRET_KEY (a 6-digit code would be trivial to brute-force from a plain hash),
+# are single use, expire after RESET_TOKEN_TTL and are burned after RESET_TOKEN_MAX_ATTEMPTS
+# wrong guesses. Attempt counters are fixed windows of RESET_LIMIT_WINDOW seconds.
+#
+# Backends, chosen by RESET_TOKEN_STORE like the broker:
+#   - memory:// (default, single process): insertion-ordered dicts. The TTL and the window are
+#     the same for every entry, so insertion order is expiry order and expired entries are
+#     popped from the front, O(1) each. Entries are capped at RESET_TOKEN_MAX_ENTRIES.
+#   - redis://...: keys expire on their own.
+#   - database: the password_reset_tokens and attempt_counters tables, swept through their
+#     expiry indexes every RESET_SWEEP_INTERVAL.
+import asyncio
+import hashlib
+import hmac
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+
+import database
+import models
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+RESET_TOKEN_TTL = int(os.getenv("RESET_TOKEN_TTL", "3600"))
+RESET_TOKEN_MAX_ATTEMPTS = int(os.getenv("RESET_TOKEN_MAX_ATTEMPTS", "5"))
+RESET_LIMIT_WINDOW = int(os.getenv("RESET_LIMIT_WINDOW", "900"))
+RESET_REQUESTS_PER_USER = int(os.getenv("RESET_REQUESTS_PER_USER", "3"))
+RESET_REQUESTS_PER_IP = int(os.getenv("RESET_REQUESTS_PER_IP", "20"))
+RESET_ATTEMPTS_PER_IP = int(os.getenv("RESET_ATTEMPTS_PER_IP", "30"))
+RESET_TOKEN_MAX_ENTRIES = int(os.getenv("RESET_TOKEN_MAX_ENTRIES", "100000"))
+RESET_SWEEP_INTERVAL = float(os.getenv("RESET_SWEEP_INTERVAL", "60"))
+
+
+def hash_token(user_id: int, token: str) -> str:
+    return hmac.new(os.getenv("SECRET_KEY", "").encode(), f"{user_id}:{token}".encode(), hashlib.sha256).hexdigest()
+
+
+class ResetTokenStore:
+    """Base class: the counters for /metrics, backends keep the codes and the attempt counts."""
+
+    def __init__(self, ttl: int = RESET_TOKEN_TTL, max_attempts: int = RESET_TOKEN_MAX_ATTEMPTS,
+                 window: int = RESET_LIMIT_WINDOW):
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        self.window = window
+        self.issued = 0
+        self.consumed = 0
+        self.rejected = 0
+        self.limited = 0
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def issue(self, user_id: int, token: str):
+        """Stores token as the user's only live code."""
+        await self._issue(user_id, hash_token(user_id, token))
+        self.issued += 1
+
+    async def consume(self, user_id: int, token: str) -> bool:
+        """True exactly once for the user's live code; a wrong code counts against it."""
+        ok = await self._consume(user_id, hash_token(user_id, token))
+        if ok:
+            self.consumed += 1
+        else:
+            self.rejected += 1
+        return ok
+
+    async def hit(self, key: str, limit: int) -> bool:
+        """Counts an attempt against key; False once it is over limit in the current window."""
+        ok = await self._increment(key) <= limit
+        if not ok:
+            self.limited += 1
+        return ok
+
+    def stats(self) -> dict:
+        return {
+            "issued": self.issued,
+            "consumed": self.consumed,
+            "rejected": self.rejected,
+            "limited": self.limited,
+        }
+
+    async def _issue(self, user_id: int, token_hash: str):
+        raise NotImplementedError
+
+    async def _consume(self, user_id: int, token_hash: str) -> bool:
+        raise NotImplementedError
+
+    async def _increment(self, key: str) -> int:
+        raise NotImplementedError
+
+
+class InMemoryResetTokenStore(ResetTokenStore):
+    def __init__(self, max_entries: int = RESET_TOKEN_MAX_ENTRIES, **kwargs):
+        super().__init__(**kwargs)
+        self.max_entries = max_entries
+        self._tokens: OrderedDict[int, list] = OrderedDict()  # user_id -> [expires_at, token_hash, attempts]
+        self._counters: OrderedDict[str, list] = OrderedDict()  # key -> [window_ends_at, count]
+        self.evicted = 0
+
+    async def _issue(self, user_id: int, token_hash: str):
+        now = time.monotonic()
+        self._tokens.pop(user_id, None)  # re-inserted at the back, where the latest expiry goes
+        self._tokens[user_id] = [now + self.ttl, token_hash, 0]
+        self._sweep(self._tokens, now)
+
+    async def _consume(self, user_id: int, token_hash: str) -> bool:
+        now = time.monotonic()
+        self._sweep(self._tokens, now)
+        entry = self._tokens.get(user_id)
+        if entry is None:
+            return False
+        if hmac.compare_digest(entry[1], token_hash):
+            del self._tokens[user_id]
+            return True
+        entry[2] += 1
+        if entry[2] >= self.max_attempts:
+            del self._tokens[user_id]
+        return False
+
+    async def _increment(self, key: str) -> int:
+        now = time.monotonic()
+        self._sweep(self._counters, now)
+        entry = self._counters.get(key)
+        if entry is None:
+            entry = self._counters[key] = [now + self.window, 0]
+        entry[1] += 1
+        return entry[1]
+
+    def _sweep(self, entries: OrderedDict, now: float):
+        while entries:
+            expires_at = next(iter(entries.values()))[0]
+            if expires_at >= now:
+                break
+            entries.popitem(last=False)
+        # under a flood the soonest to expire go first
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+            self.evicted += 1
+
+    def stats(self) -> dict:
+        return {
+            **super().stats(),
+            "tokens": len(self._tokens),
+            "counters": len(self._counters),
+            "max_entries": self.max_entries,
+            "evicted": self.evicted,
+        }
+
+
+class RedisResetTokenStore(ResetTokenStore):
+    """For anything that speaks the Redis protocol; every key carries its own expiry."""
+
+    # the compare, the attempt count and the delete have to be one step, or a code could be used twice
+    CONSUME_SCRIPT = """
+local stored = redis.call('HGET', KEYS[1], 'hash')
+if not stored then return 0 end
+if stored == ARGV[1] then redis.call('DEL', KEYS[1]) return 1 end
+if redis.call('HINCRBY', KEYS[1], 'attempts', 1) >= tonumber(ARGV[2]) then redis.call('DEL', KEYS[1]) end
+return 0
+"""
+    INCREMENT_SCRIPT = """
+local count = redis.call('INCR', KEYS[1])
+if count == 1 then redis.call('EXPIRE', KEYS[1], ARGV[1]) end
+return count
+"""
+
+    def __init__(self, url: str, **kwargs):
+        super().__init__(**kwargs)
+        self.url = url
+        self._redis = None
+
+    async def start(self):
+        try:
+            import redis.asyncio as aioredis
+        except ImportError:
+            raise RuntimeError("RESET_TOKEN_STORE points at Redis but the 'redis' package is not installed")
+        self._redis = aioredis.from_url(self.url, decode_responses=True)
+
+    async def stop(self):
+        if self._redis:
+            await self._redis.aclose()
+
+    async def _issue(self, user_id: int, token_hash: str):
+        key = f"reset_token:{user_id}"
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            pipe.hset(key, mapping={"hash": token_hash, "attempts": 0})
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
+
+    async def _consume(self, user_id: int, token_hash: str) -> bool:
+        return bool(await self._redis.eval(self.CONSUME_SCRIPT, 1, f"reset_token:{user_id}", token_hash, self.max_attempts))
+
+    async def _increment(self, key: str) -> int:
+        return int(await self._redis.eval(self.INCREMENT_SCRIPT, 1, f"attempts:{key}", self.window))
+
+
+class DatabaseResetTokenStore(ResetTokenStore):
+    """Shared between workers through the database; a periodic indexed DELETE drops expired rows."""
+
+    def __init__(self, sweep_interval: float = RESET_SWEEP_INTERVAL, **kwargs):
+        super().__init__(**kwargs)
+        self.sweep_interval = sweep_interval
+        self._sweeper: Optional[asyncio.Task] = None
+        self.swept = 0
+
+    async def start(self):
+        self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self):
+        if self._sweeper:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+
+    async def _issue(self, user_id: int, token_hash: str):
+        values = {"token_hash": token_hash, "attempts": 0,
+                  "expires_at": datetime.utcnow() + timedelta(seconds=self.ttl)}
+        replace = update(models.PasswordResetToken).where(models.PasswordResetToken.user_id == user_id).values(**values)
+        async with database.AsyncSessionLocal() as db:
+            if (await db.execute(replace)).rowcount == 0:
+                db.add(models.PasswordResetToken(user_id=user_id, **values))
+                try:
+                    await db.commit()
+                    return
+                except IntegrityError:
+                    # a concurrent request inserted first; ours is the newer code
+                    await db.rollback()
+                    await db.execute(replace)
+            await db.commit()
+
+    async def _consume(self, user_id: int, token_hash: str) -> bool:
+        token = models.PasswordResetToken
+        async with database.AsyncSessionLocal() as db:
+            # deleting the row is the check: of two concurrent uses only one deletes it
+            used = await db.execute(
+                delete(token)
+                .where(token.user_id == user_id, token.token_hash == token_hash, token.expires_at > datetime.utcnow())
+            )
+            if used.rowcount == 0:
+                await db.execute(update(token).where(token.user_id == user_id).values(attempts=token.attempts + 1))
+                await db.execute(delete(token).where(token.user_id == user_id, token.attempts >= self.max_attempts))
+            await db.commit()
+            return used.rowcount == 1
+
+    async def _increment(self, key: str) -> int:
+        counter = models.AttemptCounter
+        now = datetime.utcnow()
+        bump = (
+            update(counter)
+            .where(counter.key == key, counter.window_ends_at > now)
+            .values(count=counter.count + 1)
+        )
+        async with database.AsyncSessionLocal() as db:
+            if (await db.execute(bump)).rowcount == 0:
+                # no row, or the previous window's: start a new window
+                await db.execute(delete(counter).where(counter.key == key))
+                db.add(counter(key=key, count=1, window_ends_at=now + timedelta(seconds=self.window)))
+                try:
+                    await db.commit()
+                    return 1
+                except IntegrityError:
+                    await db.rollback()
+                    await db.execute(bump)
+            count = (await db.execute(select(counter.count).where(counter.key == key))).scalar() or 0
+            await db.commit()
+            return count
+
+    async def sweep(self):
+        now = datetime.utcnow()
+        async with database.AsyncSessionLocal() as db:
+            tokens = await db.execute(delete(models.PasswordResetToken).where(models.PasswordResetToken.expires_at <= now))
+            counters = await db.execute(delete(models.AttemptCounter).where(models.AttemptCounter.window_ends_at <= now))
+            await db.commit()
+        self.swept += tokens.rowcount + counters.rowcount
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Reset token sweep failed, retrying")
+
+    def stats(self) -> dict:
+        return {**super().stats(), "swept": self.swept}
+
+
+def create_reset_token_store(url: str = None) -> ResetTokenStore:
+    # RESET_TOKEN_STORE: memory:// (default, single process), redis://host:6379/0, or database
+    url = url or os.getenv("RESET_TOKEN_STORE", "memory://")
+    if url.startswith("memory://"):
+        return InMemoryResetTokenStore()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisResetTokenStore(url)
+    if url == "database":
+        return DatabaseResetTokenStore()
+    raise ValueError(f"Unsupported RESET_TOKEN_STORE: {url}")
+
+
+reset_token_store = create_reset_token_store()
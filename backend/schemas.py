@@ -1,5 +1,6 @@
-from pydantic import BaseModel, EmailStr
-from typing import Optional, List
+from pydantic import BaseModel, EmailStr, Field
+from typing import Optional, List, Dict
+from datetime import datetime
 
 # Schema for creating a user
 class UserCreate(BaseModel):
@@ -30,8 +31,10 @@ class TokenData(BaseModel):
 
 class Conversation(BaseModel):
     conversation_id: int
-    user1_id: int
-    user2_id: int
+    user1_id: Optional[int] = None  # direct chats only
+    user2_id: Optional[int] = None
+    is_group: bool = False
+    title: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -43,6 +46,8 @@ class Message(BaseModel):
     conversation_id: int
     sender_id: int
     message_text: str
+    sent_at: Optional[datetime] = None
+    client_msg_id: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -55,10 +60,61 @@ class UserWithProfilePic(BaseModel):
     class Config:
         from_attributes = True
     
+# One row of the inbox: the peer, a preview of the newest message and how many are unread
+class InboxMessage(BaseModel):
+    message_id: int
+    sender_id: int
+    message_text: str  # preview, cut to crud.INBOX_PREVIEW_LENGTH characters
+    sent_at: Optional[datetime] = None
+
+class InboxEntry(BaseModel):
+    conversation_id: int
+    is_group: bool = False
+    title: Optional[str] = None  # groups
+    peer: Optional[UserWithProfilePic] = None  # direct chats
+    last_message: Optional[InboxMessage] = None
+    unread_count: int  # groups stop counting at crud.INBOX_UNREAD_CAP ("99+")
+
+class GroupCreate(BaseModel):
+    title: str = Field(..., min_length=1, max_length=100)
+    member_usernames: List[str] = Field(..., min_length=1)
+
+class ConversationMember(BaseModel):
+    user_id: int
+    username: str
+    profile_image_url: str
+    role: str
+
+class SearchResult(BaseModel):
+    message: Message
+    score: Optional[float] = None  # relevance, higher is better; None without a full-text index
+
+class SearchPage(BaseModel):
+    results: List[SearchResult]
+    next_offset: Optional[int] = None
+
+class ReadState(BaseModel):
+    conversation_id: int
+    user_id: int
+    last_read_message_id: int
+    last_delivered_message_id: int
+
+    class Config:
+        from_attributes = True
+
+# Catch-up after a reconnect: the newest message_id the client holds per conversation.
+# Conversations missing from cursors are sent from the start (up to the limit) unless
+# include_new is false, e.g. for a client that only shows one conversation.
+class SyncRequest(BaseModel):
+    cursors: Dict[int, int] = {}
+    include_new: bool = True
+    limit_per_conversation: int = Field(200, ge=1, le=1000)
+
 class EmailSchema(BaseModel):
     email: List[EmailStr]
 
 class ResetPasswordSchema(BaseModel):
+    username: str
     reset_token: str
     new_password: str
 
@@ -0,0 +1,101 @@
+# search.py
+# Full-text search over messages, limited to the conversations the caller is a member of.
+#
+# The inverted index is the database's own and is kept current by the database on every
+# insert, whichever path wrote the row (crud.create_message or the MessageWriter batches):
+#   - MySQL: a FULLTEXT index on messages.message_text (models.Message), ranked by MATCH ... AGAINST
+#     in boolean mode
+#   - SQLite (development): an FTS5 table over messages kept in step by triggers, ranked by bm25
+# Other databases fall back to a LIKE scan, newest first, which is only fit for small data.
+import re
+from typing import Optional
+
+from sqlalchemy import Integer, column, func, literal_column, select, table, text
+from sqlalchemy.dialects.mysql import match
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import crud
+import models
+
+SEARCH_MAX_OFFSET = 1000  # ranked pages deeper than this are never worth computing
+
+# External-content FTS5 table: it stores only the index, the text stays in messages
+SQLITE_FTS_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+    "message_text, content='messages', content_rowid='message_id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN "
+    "INSERT INTO messages_fts(rowid, message_text) VALUES (new.message_id, new.message_text); END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN "
+    "INSERT INTO messages_fts(messages_fts, rowid, message_text) VALUES ('delete', old.message_id, old.message_text); END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF message_text ON messages BEGIN "
+    "INSERT INTO messages_fts(messages_fts, rowid, message_text) VALUES ('delete', old.message_id, old.message_text); "
+    "INSERT INTO messages_fts(rowid, message_text) VALUES (new.message_id, new.message_text); END",
+)
+
+messages_fts = table("messages_fts", column("rowid", Integer))
+
+WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def setup_search(connection):
+    """Creates the SQLite index next to create_all (run through AsyncConnection.run_sync).
+    MySQL's FULLTEXT index is part of the model and comes with create_all or the migration."""
+    if connection.dialect.name != "sqlite":
+        return
+    created = connection.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'")).first() is None
+    for statement in SQLITE_FTS_DDL:
+        connection.execute(text(statement))
+    if created:
+        # messages stored before the index existed
+        connection.execute(text("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')"))
+
+
+def search_terms(query: str) -> list:
+    return WORD.findall(query)
+
+
+def search_statement(dialect: str, user_id: int, terms: list, conversation_id: Optional[int] = None):
+    """The search query for one database; every term must match, as on every backend."""
+    mine = select(models.ConversationMember.conversation_id).where(models.ConversationMember.user_id == user_id)
+
+    if dialect == "mysql":
+        # boolean mode with every term required; natural language mode would match any of them
+        against = " ".join('+"' + term + '"' for term in terms)
+        relevance = match(models.Message.message_text, against=against).in_boolean_mode()
+        stmt = (
+            select(*crud.MESSAGE_COLUMNS, relevance.label("score"))
+            .where(relevance > 0)
+            .order_by(relevance.desc(), models.Message.message_id.desc())
+        )
+    elif dialect == "sqlite":
+        # every term quoted: user input is never FTS5 query syntax, and all terms must match
+        fts_query = " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+        rank = func.bm25(literal_column("messages_fts"))  # lower is better
+        stmt = (
+            select(*crud.MESSAGE_COLUMNS, (-rank).label("score"))
+            .select_from(messages_fts)
+            .join(models.Message, models.Message.message_id == messages_fts.c.rowid)
+            .where(literal_column("messages_fts").op("MATCH")(fts_query))
+            .order_by(rank, models.Message.message_id.desc())
+        )
+    else:
+        stmt = select(*crud.MESSAGE_COLUMNS, literal_column("NULL").label("score"))
+        for term in terms:
+            stmt = stmt.where(models.Message.message_text.contains(term, autoescape=True))
+        stmt = stmt.order_by(models.Message.message_id.desc())
+
+    stmt = stmt.where(models.Message.conversation_id.in_(mine))
+    if conversation_id is not None:
+        stmt = stmt.where(models.Message.conversation_id == conversation_id)
+    return stmt
+
+
+async def search_messages(db: AsyncSession, user_id: int, query: str, conversation_id: Optional[int] = None,
+                          limit: int = 20, offset: int = 0):
+    """Rows of crud.MESSAGE_COLUMNS plus a score (higher is better), best first."""
+    terms = search_terms(query)
+    if not terms:
+        return []
+    stmt = search_statement(db.bind.dialect.name, user_id, terms, conversation_id)
+    result = await db.execute(stmt.limit(limit).offset(offset))
+    return result.all()
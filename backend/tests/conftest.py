@@ -0,0 +1,68 @@
+# tests/conftest.py
+# The app runs in-process against a throwaway SQLite file, with in-memory brokers and stores.
+# Settings are fixed here, before anything imports database or main.
+import os
+import sys
+import tempfile
+import uuid
+from types import SimpleNamespace
+
+import jwt
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+os.environ.update({
+    "DATABASE_URL": "sqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db"),
+    "SECRET_KEY": "test-secret",
+    "BCRYPT_ROUNDS": "4",
+    "BROKER_URL": "memory://",
+    "RESET_TOKEN_STORE": "memory://",
+    "RATE_LIMIT_STORE": "memory://",
+    # tests sign up and log in many users from one address
+    "RATE_LIMIT_SIGNUP_IP": "off",
+    "RATE_LIMIT_LOGIN_IP": "off",
+    "RATE_LIMIT_LOGIN_USER": "off",
+    "IMAGE_STORAGE": "local",
+    "IMAGE_STORAGE_DIR": tempfile.mkdtemp(),
+    "MAIL_SERVER": "localhost",
+    "MAIL_PORT": "8025",
+    "MAIL_FROM": "buzz@example.com",
+})
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+
+    import main
+
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture
+def make_user(client):
+    def make():
+        username = f"user-{uuid.uuid4().hex[:12]}"
+        response = client.post("/create-user", json={"username": username, "email": f"{username}@example.com",
+                                                     "password": "secret"})
+        assert response.status_code == 200, response.text
+        token = client.post("/token", data={"username": username, "password": "secret"}).json()["access_token"]
+        return SimpleNamespace(
+            username=username,
+            user_id=jwt.decode(token, options={"verify_signature": False})["user_id"],
+            token=token,
+            headers={"Authorization": f"Bearer {token}"},
+        )
+    return make
+
+
+@pytest.fixture
+def make_chat(client):
+    def make(first, second) -> int:
+        response = client.post(f"/new-conversation?recipient_username={second.username}", headers=first.headers)
+        assert response.status_code == 200, response.text
+        return response.json()["conversation_id"]
+    return make
@@ -0,0 +1,61 @@
+import broker
+import database
+import models
+
+
+def test_database_broker_delivers_ids_committed_out_of_order(client, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(broker.time, "monotonic", lambda: clock[0])
+    received = []
+
+    async def handler(channel, message):
+        received.append(message)
+
+    async def insert(event_id, payload):
+        async with database.AsyncSessionLocal() as db:
+            db.add(models.BrokerEvent(event_id=event_id, channel="test-order", payload=payload))
+            await db.commit()
+
+    async def scenario():
+        db_broker = broker.DatabaseBroker(settle_seconds=5)
+        db_broker._last_event_id = base = await db_broker._max_event_id()
+        await db_broker.subscribe("test-order", handler)
+        # base + 2 commits first, base + 1 (inserted earlier, slower transaction) after it
+        await insert(base + 2, "second")
+        await db_broker._poll()
+        await insert(base + 1, "first")
+        await db_broker._poll()
+        await db_broker._poll()
+        clock[0] += 10
+        await db_broker._poll()
+        return base, db_broker
+
+    base, db_broker = client.portal.call(scenario)
+    assert received == ["second", "first"]
+    # both have settled: the cursor has passed them and nothing is remembered
+    assert db_broker._last_event_id == base + 2
+    assert not db_broker._delivered
+
+
+def test_database_broker_pages_past_a_full_unsettled_window(client):
+    received = []
+
+    async def handler(channel, message):
+        received.append(message)
+
+    async def scenario():
+        db_broker = broker.DatabaseBroker(settle_seconds=60)
+        db_broker._last_event_id = await db_broker._max_event_id()
+        await db_broker.subscribe("test-burst", handler)
+        count = db_broker.FETCH_LIMIT + 100
+        async with database.AsyncSessionLocal() as db:
+            db.add_all(models.BrokerEvent(channel="test-burst", payload=str(n)) for n in range(count))
+            await db.commit()
+        await db_broker._poll()
+        # nothing has settled yet, so this one sits behind more than a page of delivered rows
+        await db_broker.publish("test-burst", "after")
+        await db_broker._poll()
+        return count
+
+    count = client.portal.call(scenario)
+    assert received == [str(n) for n in range(count)] + ["after"]
@@ -0,0 +1,19 @@
+import main
+
+
+def test_a_broker_failure_does_not_fail_a_stored_message(client, make_user, make_chat, monkeypatch):
+    alice, bob = make_user(), make_user()
+    conversation_id = make_chat(alice, bob)
+
+    async def broken_publish(channel, message):
+        raise ConnectionError("broker unreachable")
+
+    monkeypatch.setattr(main.manager.broker, "publish", broken_publish)
+    errors = main.manager.publish_errors
+    response = client.post(f"/send-message?conversation_id={conversation_id}&message_text=still here", headers=alice.headers)
+    assert response.status_code == 200
+    assert main.manager.publish_errors == errors + 1
+    monkeypatch.undo()
+
+    page = client.get(f"/conversations/{conversation_id}/messages", headers=bob.headers).json()
+    assert [message["message_text"] for message in page] == ["still here"]
@@ -0,0 +1,50 @@
+import crud
+
+
+def roles(client, user, conversation_id):
+    members = client.get(f"/conversations/{conversation_id}/members", headers=user.headers).json()
+    return {member["user_id"]: member["role"] for member in members}
+
+
+def test_owner_leaving_hands_the_group_to_the_longest_standing_member(client, make_user):
+    alice, bob, carol = make_user(), make_user(), make_user()
+    group = client.post("/groups", json={"title": "trip", "member_usernames": [bob.username, carol.username]},
+                        headers=alice.headers).json()
+    conversation_id = group["conversation_id"]
+
+    response = client.delete(f"/conversations/{conversation_id}/members/{alice.user_id}", headers=alice.headers)
+    assert response.status_code == 204
+
+    # bob and carol joined together; the tie goes to the lower user_id
+    assert roles(client, bob, conversation_id) == {bob.user_id: "owner", carol.user_id: "member"}
+    # and the new owner can remove members
+    response = client.delete(f"/conversations/{conversation_id}/members/{carol.user_id}", headers=bob.headers)
+    assert response.status_code == 204
+    assert roles(client, bob, conversation_id) == {bob.user_id: "owner"}
+
+
+def test_a_member_leaving_leaves_the_owner_alone(client, make_user):
+    alice, bob, carol = make_user(), make_user(), make_user()
+    group = client.post("/groups", json={"title": "book club", "member_usernames": [bob.username, carol.username]},
+                        headers=alice.headers).json()
+    conversation_id = group["conversation_id"]
+
+    assert client.delete(f"/conversations/{conversation_id}/members/{bob.user_id}", headers=bob.headers).status_code == 204
+    assert roles(client, alice, conversation_id) == {alice.user_id: "owner", carol.user_id: "member"}
+
+
+def test_group_unread_counts_stop_at_the_cap(client, make_user, monkeypatch):
+    alice, bob = make_user(), make_user()
+    group = client.post("/groups", json={"title": "news", "member_usernames": [bob.username]}, headers=alice.headers).json()
+    conversation_id = group["conversation_id"]
+    for n in range(3):
+        client.post(f"/send-message?conversation_id={conversation_id}&message_text=update {n}", headers=alice.headers)
+
+    def unread(user):
+        inbox = client.get("/inbox", headers=user.headers).json()
+        return next(entry["unread_count"] for entry in inbox if entry["conversation_id"] == conversation_id)
+
+    assert unread(bob) == 3
+    assert unread(alice) == 0  # your own messages are never unread
+    monkeypatch.setattr(crud, "INBOX_UNREAD_CAP", 2)
+    assert unread(bob) == 2
@@ -0,0 +1,48 @@
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+
+import orjson
+
+import payloads
+from broker import InMemoryBroker
+from message_cache import RecentMessageCache
+
+
+def message(message_id, conversation_id):
+    return SimpleNamespace(message_id=message_id, conversation_id=conversation_id, sender_id=1,
+                           message_text=f"message {message_id}", sent_at=datetime(2024, 1, 1), client_msg_id=None)
+
+
+async def broadcast(broker, msg):
+    # what connection_manager publishes for a new message on another worker
+    event = payloads.message_event(payloads.encode_message(msg))
+    await broker.publish(f"conversation:{msg.conversation_id}", f"other-worker {msg.conversation_id} {event}")
+
+
+def test_cache_follows_only_the_conversations_it_holds():
+    async def scenario():
+        broker = InMemoryBroker()
+        cache = RecentMessageCache(per_conversation=10)
+        await cache.attach(broker)
+
+        async def load(limit):
+            return [message(1, 7)]
+
+        await cache.get_page(7, None, 10, load)
+        assert set(broker._handlers) == {"conversation:7"}
+
+        await broadcast(broker, message(2, 7))
+        await broker.publish("conversation:7", 'other-worker 7 {"type":"typing","user_id":1}')
+        page = await cache.get_page(7, None, 10, load)
+        assert [orjson.loads(payload)["message_id"] for payload in page] == [1, 2]
+
+        # a conversation nobody here has opened is not followed at all
+        await broadcast(broker, message(3, 8))
+        assert cache.stats()["conversations"] == 1
+
+        cache.invalidate(7)
+        await asyncio.sleep(0)
+        assert not broker._handlers
+
+    asyncio.run(scenario())
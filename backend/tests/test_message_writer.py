@@ -0,0 +1,57 @@
+import asyncio
+import json
+
+from message_writer import MAX_MESSAGE_LENGTH, MessageWriter
+
+
+def test_oversized_messages_are_refused_before_the_writer(client, make_user, make_chat):
+    alice, bob = make_user(), make_user()
+    conversation_id = make_chat(alice, bob)
+    text = "x" * (MAX_MESSAGE_LENGTH + 1)
+
+    response = client.post(f"/send-message?conversation_id={conversation_id}&message_text={text}", headers=alice.headers)
+    assert response.status_code == 400
+
+    with client.websocket_connect(f"/ws/conversations/{conversation_id}?token={alice.token}") as ws:
+        ws.send_text(json.dumps({"type": "message", "client_msg_id": "long", "message_text": text}))
+        frame = ws.receive_json()
+        while frame["type"] == "presence":
+            frame = ws.receive_json()
+        assert frame["type"] == "error" and frame["client_msg_id"] == "long"
+        # the socket is still usable
+        ws.send_text(json.dumps({"type": "message", "client_msg_id": "short", "message_text": "hi"}))
+        while frame["type"] != "ack":
+            frame = ws.receive_json()
+        assert frame["client_msg_id"] == "short"
+
+
+def test_a_failing_row_fails_only_its_own_sender(client, make_user, make_chat):
+    alice, bob = make_user(), make_user()
+    conversation_id = make_chat(alice, bob)
+    client.post(f"/send-message?conversation_id={conversation_id}&message_text=first", headers=alice.headers)
+
+    async def write_batch():
+        # a long flush interval puts every write in the same batch
+        writer = MessageWriter(flush_interval_ms=200)
+        await writer.start()
+        try:
+            await writer.write(conversation_id, alice.user_id, "original", "resent")
+            return await asyncio.gather(
+                writer.write(conversation_id, alice.user_id, "one", "one"),
+                writer.write(conversation_id, bob.user_id, None, "broken"),  # NOT NULL violation
+                writer.write(conversation_id, alice.user_id, "original again", "resent"),
+                writer.write(conversation_id, bob.user_id, "two", "two"),
+                return_exceptions=True,
+            )
+        finally:
+            await writer.stop()
+
+    one, broken, resent, two = client.portal.call(write_batch)
+    assert isinstance(broken, Exception)
+    assert one[0].message_text == "one" and not one[1]
+    assert resent[0].message_text == "original" and resent[1]
+    assert two[0].message_text == "two" and not two[1]
+
+    page = client.get(f"/conversations/{conversation_id}/messages", headers=alice.headers).json()
+    texts = [message["message_text"] for message in page]
+    assert sorted(texts) == ["first", "one", "original", "two"]
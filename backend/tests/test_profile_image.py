@@ -0,0 +1,28 @@
+from image_storage import PROFILE_IMAGE_MAX_BYTES, UPLOAD_FORM_OVERHEAD
+
+TOO_LARGE = PROFILE_IMAGE_MAX_BYTES + UPLOAD_FORM_OVERHEAD + 1
+
+
+def test_oversized_upload_is_refused_from_its_content_length(client, make_user):
+    user = make_user()
+    response = client.post("/users/me/profile-image", headers=user.headers,
+                           files={"file": ("big.png", b"\0" * TOO_LARGE, "image/png")})
+    assert response.status_code == 413
+    assert response.json()["detail"].startswith("Uploads are limited")
+
+
+def test_oversized_chunked_upload_is_refused_while_it_arrives(client, make_user):
+    user = make_user()
+    boundary = "limit-test"
+
+    def body():
+        yield (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"big.png\"\r\n"
+               "Content-Type: image/png\r\n\r\n").encode()
+        for _ in range(TOO_LARGE // 65536 + 1):
+            yield b"\0" * 65536
+        yield f"\r\n--{boundary}--\r\n".encode()
+
+    response = client.post("/users/me/profile-image", content=body(),
+                           headers={**user.headers, "Content-Type": f"multipart/form-data; boundary={boundary}"})
+    assert response.status_code == 413
+    assert response.json()["detail"].startswith("Uploads are limited")
@@ -0,0 +1,41 @@
+import pytest
+
+import rate_limiter
+
+
+def send(client, user, conversation_id, text="hi"):
+    return client.post(f"/send-message?conversation_id={conversation_id}&message_text={text}", headers=user.headers)
+
+
+def test_outsiders_cannot_drain_a_conversation_bucket(client, make_user, make_chat, monkeypatch):
+    monkeypatch.setattr(rate_limiter, "RATE_LIMIT_MESSAGES_USER", None)
+    monkeypatch.setattr(rate_limiter, "RATE_LIMIT_MESSAGES_CONVERSATION", rate_limiter.Limit(capacity=5, rate=0.001))
+    alice, bob = make_user(), make_user()
+    conversation_id = make_chat(alice, bob)
+
+    for _ in range(4):
+        outsider = make_user()
+        for _ in range(10):
+            assert send(client, outsider, conversation_id).status_code == 403
+
+    assert [send(client, alice, conversation_id).status_code for _ in range(5)] == [200] * 5
+    # members still share the bucket
+    limited = send(client, bob, conversation_id)
+    assert limited.status_code == 429
+    assert int(limited.headers["Retry-After"]) >= 1
+
+
+def test_token_bucket_refills_over_time(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(rate_limiter.time, "monotonic", lambda: now[0])
+    bucket = rate_limiter.TokenBucket(rate_limiter.parse_limit("2/s"))
+    assert bucket.take() == 0 and bucket.take() == 0
+    assert bucket.take() == 0.5
+    now[0] += 0.5
+    assert bucket.take() == 0
+
+
+@pytest.mark.parametrize("spec", ["0/m", "5/0s", "ten/m"])
+def test_limits_that_cannot_refill_are_rejected(spec):
+    with pytest.raises(ValueError):
+        rate_limiter.parse_limit(spec)
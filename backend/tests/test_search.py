@@ -0,0 +1,22 @@
+from sqlalchemy.dialects import mysql
+
+import search
+
+
+def test_sqlite_search_requires_every_term(client, make_user, make_chat):
+    alice, bob = make_user(), make_user()
+    conversation_id = make_chat(alice, bob)
+    for text in ("pelican sunrise", "pelican only", "sunrise only"):
+        client.post(f"/send-message?conversation_id={conversation_id}&message_text={text}", headers=alice.headers)
+
+    page = client.get(f"/search?q=pelican sunrise&conversation_id={conversation_id}", headers=bob.headers).json()
+    assert [result["message"]["message_text"] for result in page["results"]] == ["pelican sunrise"]
+
+
+def test_mysql_search_requires_every_term():
+    stmt = search.search_statement("mysql", 1, search.search_terms('pelican "sunrise'))
+    compiled = stmt.compile(dialect=mysql.dialect(), compile_kwargs={"literal_binds": True})
+    sql = str(compiled)
+    assert "IN BOOLEAN MODE" in sql
+    assert "NATURAL LANGUAGE" not in sql
+    assert "'+\"pelican\" +\"sunrise\"'" in sql.replace("\\", "")
@@ -0,0 +1,29 @@
+import ttl_cache
+from membership_cache import MembershipCache
+from ttl_cache import TTLCache
+
+
+def test_entries_expire_and_the_least_recently_used_go_first(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(ttl_cache.time, "monotonic", lambda: clock[0])
+    cache = TTLCache(max_size=2, ttl=10)
+
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # "b" is now the least recently used
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+
+    clock[0] += 11
+    assert cache.get("a") is None
+    assert cache.stats()["size"] == 1
+
+
+def test_membership_cache_shares_the_ttl_cache():
+    cache = MembershipCache(max_size=10, ttl=60)
+    cache.put(1, [3, 4, 4])
+    assert cache.get(1) == frozenset({3, 4})
+    cache.discard(1)
+    assert cache.get(1) is None
+    assert cache.stats()["invalidations"] == 1
@@ -2,11 +2,22 @@ import React, { useState, useEffect, useRef } from "react";
 import './styles/ChatWindow.css'; // Import the CSS file for ChatWindow component
 import {jwtDecode} from 'jwt-decode';  // Correct import for jwt-decode
 import ImageIcon from '@mui/icons-material/ImageOutlined';
+import { syncMessages } from './sync';
+
+const PAGE_SIZE = 50;
+const MAX_RECONNECT_DELAY = 30000;
+const TYPING_THROTTLE = 2000; // the server keeps us "typing" for a few seconds per frame
 
 function ChatWindow({ username, conversationId }) {
     const [message, setMessage] = useState("");
     const [messages, setMessages] = useState([]);
+    const [hasOlder, setHasOlder] = useState(false);
+    const [peerReceipt, setPeerReceipt] = useState({ last_read_message_id: 0, last_delivered_message_id: 0 });
+    const [peerPresence, setPeerPresence] = useState({ online: false, last_seen: null });
+    const [peerTyping, setPeerTyping] = useState(false);
     const wsRef = useRef(null);
+    const lastTypingSentRef = useRef(0);
+    const lastSeenIdRef = useRef(0);
     const messageListRef = useRef(null);
     const token = localStorage.getItem('token');
     const decodedToken = jwtDecode(token); // Use jwtDecode instead of jwtDecode
@@ -17,14 +28,18 @@ function ChatWindow({ username, conversationId }) {
 
         const fetchMessages = async () => {
             try {
-                const response = await fetch(`http://localhost:8000/conversations/${conversationId}/messages`, {
+                const response = await fetch(`http://localhost:8000/conversations/${conversationId}/messages?limit=${PAGE_SIZE}`, {
                     headers: {
                         'Authorization': `Bearer ${token}`,
                     },
                 });
                 if (response.ok) {
                     const data = await response.json();
-                    setMessages(data); // Load initial messages
+                    setMessages(data); // Load the newest page
+                    setHasOlder(data.length === PAGE_SIZE);
+                } else if (response.status === 404) {
+                    setMessages([]); // No messages yet
+                    setHasOlder(false);
                 } else {
                     console.error('Failed to fetch messages');
                 }
@@ -33,58 +48,219 @@ function ChatWindow({ username, conversationId }) {
             }
         };
 
+        // The peer's watermarks so far; live "receipt" frames move them on
+        const fetchReadStates = async () => {
+            try {
+                const response = await fetch(`http://localhost:8000/conversations/${conversationId}/read-states`, {
+                    headers: {
+                        'Authorization': `Bearer ${token}`,
+                    },
+                });
+                if (response.ok) {
+                    const data = await response.json();
+                    const peer = data.find(state => state.user_id !== current_user_Id);
+                    if (peer) setPeerReceipt(peer);
+                }
+            } catch (error) {
+                console.error("Error fetching read states:", error);
+            }
+        };
+
         fetchMessages();
+        fetchReadStates();
 
-        const socket = new WebSocket(`ws://localhost:8000/ws/conversations/${conversationId}`);
-        wsRef.current = socket;
+        // Adds a stored message once, replacing our own pending copy if it is still on screen
+        const upsertMessage = (stored) => {
+            setMessages((prevMessages) => {
+                if (prevMessages.find(msg => msg.message_id === stored.message_id)) {
+                    return prevMessages;
+                }
+                const pendingIndex = stored.client_msg_id
+                    ? prevMessages.findIndex(msg => msg.pending && msg.client_msg_id === stored.client_msg_id)
+                    : -1;
+                if (pendingIndex !== -1) {
+                    const updated = [...prevMessages];
+                    updated[pendingIndex] = stored;
+                    return updated;
+                }
+                return [...prevMessages, stored];
+            });
+        };
 
         const handleMessage = (event) => {
-            const newMessage = JSON.parse(event.data);
-            setMessages((prevMessages) => {
-                if (!prevMessages.find(msg => msg.message_id === newMessage.message_id)) {
-                    return [...prevMessages, newMessage];
+            const frame = JSON.parse(event.data);
+            if (frame.type === 'ping') {
+                // the server closes sockets that stop answering
+                event.target.send(JSON.stringify({ type: 'pong' }));
+            } else if (frame.type === 'message' || frame.type === 'ack') {
+                if (frame.message.sender_id !== current_user_Id) setPeerTyping(false);
+                upsertMessage(frame.message);
+            } else if (frame.type === 'presence') {
+                const peer = frame.users.find(user => user.user_id !== current_user_Id);
+                if (peer) setPeerPresence(peer);
+            } else if (frame.type === 'typing') {
+                if (frame.typing.some(id => id !== current_user_Id)) setPeerTyping(true);
+                if (frame.stopped.some(id => id !== current_user_Id)) setPeerTyping(false);
+            } else if (frame.type === 'receipt') {
+                if (frame.user_id !== current_user_Id) {
+                    setPeerReceipt(frame);
+                }
+            } else if (frame.type === 'image') {
+                if (frame.sender_id !== current_user_Id) {
+                    setMessages((prevMessages) => [...prevMessages, frame]);
+                }
+            } else if (frame.type === 'error') {
+                console.error("Message rejected:", frame.detail);
+                if (frame.client_msg_id) {
+                    setMessages((prevMessages) => prevMessages.filter(msg => msg.client_msg_id !== frame.client_msg_id || !msg.pending));
                 }
-                return prevMessages;
+            }
+        };
+
+        let closed = false;
+        let attempts = 0;
+        let reconnectTimer = null;
+
+        // After a reconnect only the gap is fetched, via /sync, not the whole history again
+        const catchUp = async () => {
+            let cursor = lastSeenIdRef.current;
+            let hasMore = true;
+            while (hasMore && !closed) {
+                hasMore = false;
+                await syncMessages(token, { [conversationId]: cursor }, (frame) => {
+                    if (frame.type === 'message') {
+                        upsertMessage(frame.message);
+                    } else if (frame.type === 'conversation' && frame.conversation_id === conversationId) {
+                        cursor = frame.last_message_id;
+                        hasMore = frame.has_more;
+                    }
+                }, false);
+            }
+        };
+
+        const connect = () => {
+            const socket = new WebSocket(`ws://localhost:8000/ws/conversations/${conversationId}?token=${encodeURIComponent(token)}`);
+            wsRef.current = socket;
+            socket.addEventListener('message', handleMessage);
+            socket.addEventListener('open', () => {
+                if (attempts > 0) {
+                    catchUp().catch((error) => console.error("Error syncing messages:", error));
+                }
+                attempts = 0;
+            });
+            socket.addEventListener('close', () => {
+                if (closed) return;
+                // exponential backoff with jitter, so a network blip doesn't reconnect everyone at once
+                const delay = Math.min(MAX_RECONNECT_DELAY, 1000 * 2 ** attempts) * (0.5 + Math.random() / 2);
+                attempts += 1;
+                reconnectTimer = setTimeout(connect, delay);
             });
         };
 
-        socket.addEventListener('message', handleMessage);
+        connect();
 
         return () => {
-            socket.removeEventListener('message', handleMessage);
-            socket.close();
+            closed = true;
+            clearTimeout(reconnectTimer);
+            wsRef.current.close();
         };
-    }, [conversationId, token]);
+    }, [conversationId, token, current_user_Id]);
+
+    // Newest stored message on screen: the cursor for catching up after a reconnect
+    useEffect(() => {
+        lastSeenIdRef.current = messages.reduce((newest, msg) => Math.max(newest, msg.message_id || 0), 0);
+    }, [messages]);
+
+    // Only jump to the bottom when a newer message arrives, not when older history is prepended
+    const lastMessage = messages[messages.length - 1];
+    const lastMessageKey = lastMessage ? (lastMessage.message_id || lastMessage.timestamp) : null;
 
     useEffect(() => {
         if (messageListRef.current) {
             messageListRef.current.scrollTop = messageListRef.current.scrollHeight;
         }
-    }, [messages]);
+    }, [lastMessageKey]);
 
-    const handleSendMessage = async () => {
-        if (message.trim() === "" || !conversationId) return;
+    // Whatever reaches the bottom of an open chat has been read; the server coalesces these
+    const lastStoredId = lastMessage && !lastMessage.pending ? lastMessage.message_id : null;
+
+    useEffect(() => {
+        if (!conversationId || !lastStoredId) return;
+        if (wsRef.current && wsRef.current.readyState === WebSocket.OPEN) {
+            wsRef.current.send(JSON.stringify({ type: 'read', message_id: lastStoredId }));
+            return;
+        }
+        fetch(`http://localhost:8000/conversations/${conversationId}/read?message_id=${lastStoredId}`, {
+            method: 'POST',
+            headers: {
+                'Authorization': `Bearer ${token}`,
+            },
+        }).catch((error) => console.error("Error marking conversation read:", error));
+    }, [conversationId, lastStoredId, token]);
+
+    // Receipt shown under my newest stored message
+    const lastSent = [...messages].reverse().find(msg => msg.message_id && msg.sender_id === current_user_Id);
+    const receiptLabel = !lastSent ? null
+        : peerReceipt.last_read_message_id >= lastSent.message_id ? 'Seen'
+        : peerReceipt.last_delivered_message_id >= lastSent.message_id ? 'Delivered'
+        : null;
+
+    // Load the page of history just before the oldest message on screen
+    const loadOlderMessages = async () => {
+        const oldest = messages.find(msg => msg.message_id);
+        if (!oldest) return;
 
         try {
-            const response = await fetch(`http://localhost:8000/send-message?conversation_id=${conversationId}&message_text=${message}`, {
-                method: 'POST',
+            const response = await fetch(`http://localhost:8000/conversations/${conversationId}/messages?before_id=${oldest.message_id}&limit=${PAGE_SIZE}`, {
                 headers: {
                     'Authorization': `Bearer ${token}`,
-                    'Content-Type': 'application/json',
                 },
             });
             if (response.ok) {
-                const newMessage = await response.json();
-                if (wsRef.current && wsRef.current.readyState === WebSocket.OPEN) {
-                    wsRef.current.send(JSON.stringify(newMessage));
-                }
-                setMessage(""); // Clear input
+                const data = await response.json();
+                setMessages((prevMessages) => [...data, ...prevMessages]);
+                setHasOlder(data.length === PAGE_SIZE);
             } else {
-                const errorData = await response.json();
-                alert(`Error: ${errorData.detail}`);
+                console.error('Failed to fetch older messages');
             }
         } catch (error) {
-            console.error("Error sending message:", error);
+            console.error("Error fetching older messages:", error);
+        }
+    };
+
+    // Messages are stored and broadcast by the server over the socket; the ack swaps in the stored copy
+    const handleSendMessage = () => {
+        if (message.trim() === "" || !conversationId) return;
+
+        if (!wsRef.current || wsRef.current.readyState !== WebSocket.OPEN) {
+            alert("Not connected, please try again in a moment");
+            return;
+        }
+
+        lastTypingSentRef.current = 0; // the server clears our typing state when the message arrives
+        const clientMsgId = crypto.randomUUID();
+        setMessages((prevMessages) => [...prevMessages, {
+            client_msg_id: clientMsgId,
+            sender_id: current_user_Id,
+            conversation_id: conversationId,
+            message_text: message,
+            pending: true,
+        }]);
+        wsRef.current.send(JSON.stringify({
+            type: 'message',
+            client_msg_id: clientMsgId,
+            message_text: message,
+        }));
+        setMessage(""); // Clear input
+    };
+
+    // At most one typing frame per TYPING_THROTTLE while keys are being pressed
+    const handleInputChange = (e) => {
+        setMessage(e.target.value);
+        const now = Date.now();
+        if (wsRef.current && wsRef.current.readyState === WebSocket.OPEN && now - lastTypingSentRef.current > TYPING_THROTTLE) {
+            lastTypingSentRef.current = now;
+            wsRef.current.send(JSON.stringify({ type: 'typing' }));
         }
     };
 
@@ -127,18 +303,30 @@ function ChatWindow({ username, conversationId }) {
         <div className="chat-window">
             <div className="chat-header">
                 <h2>{username}</h2>
+                <span className="presence">
+                    {peerTyping ? 'typing…'
+                        : peerPresence.online ? 'online'
+                        : peerPresence.last_seen ? `last seen ${new Date(peerPresence.last_seen + 'Z').toLocaleString()}`
+                        : ''}
+                </span>
             </div>
             <div className="message-list" ref={messageListRef} style={{ height: '400px', overflowY: 'scroll' }}>
+                {hasOlder && (
+                    <button className="load-older" onClick={loadOlderMessages}>Load older messages</button>
+                )}
                 {messages.map((msg, index) => (
                     <div
-                        key={index}
-                        className={`message ${msg.sender_id === current_user_Id ? "sent" : "received"}`}
+                        key={msg.message_id || msg.client_msg_id || index}
+                        className={`message ${msg.sender_id === current_user_Id ? "sent" : "received"}${msg.pending ? " pending" : ""}`}
                     >
                         {msg.type === 'image' ? (
                             <img src={msg.data} alt="Sent" style={{ maxWidth: '200px' }} />
                         ) : (
                             <span>{msg.message_text}</span>
                         )}
+                        {receiptLabel && msg === lastSent && (
+                            <span className="receipt">{receiptLabel}</span>
+                        )}
                     </div>
                 ))}
             </div>
@@ -147,7 +335,7 @@ function ChatWindow({ username, conversationId }) {
                     type="text"
                     value={message}
                     placeholder="Type a message... Use Windows + '.' key to enter emojis"
-                    onChange={(e) => setMessage(e.target.value)}
+                    onChange={handleInputChange}
                     onKeyPress={(e) => { if (e.key === 'Enter') handleSendMessage(); }}
                 />
                 <div>
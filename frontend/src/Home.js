@@ -5,7 +5,7 @@ import './styles/Home.css'; // Import the CSS file for Home component
 
 function Home() {
     const [profile, setProfile] = useState(null);
-    const [users, setUsers] = useState([]);
+    const [inbox, setInbox] = useState([]);
     const [selectedUsername, setSelectedUsername] = useState(null);
     const [conversationId, setConversationId] = useState(null);
     const [profileimageUrl, setProfileimageUrl] = useState(null);
@@ -30,11 +30,12 @@ function Home() {
         }
     };
 
-    const fetchUsersInConversations = async () => {
+    // One request for the whole sidebar: conversation id, peer, last message and unread count
+    const fetchInbox = async () => {
         const token = localStorage.getItem('token');
         if (!token) return;
     
-        const response = await fetch('http://localhost:8000/conversations/users', {
+        const response = await fetch('http://localhost:8000/inbox', {
             headers: {
                 'Authorization': `Bearer ${token}`,
             },
@@ -42,15 +43,15 @@ function Home() {
     
         if (response.ok) {
             const data = await response.json();
-            setUsers(data);  // Now data contains both username and profile picture
+            setInbox(data);
         } else {
-            console.error('Failed to fetch users in conversations');
+            console.error('Failed to fetch inbox');
         }
     };    
 
     useEffect(() => {
         fetchProfile();
-        fetchUsersInConversations();
+        fetchInbox();
     }, []);
 
     // Fetch profile image URL when the component loads
@@ -106,28 +107,6 @@ function Home() {
         }
     };
 
-    const fetchConversationId = async (username) => {
-        const token = localStorage.getItem('token');
-
-        try {
-            const response = await fetch(`http://localhost:8000/conversations/get-conversation-id?recipient_username=${username}`, {
-                method: 'GET',
-                headers: {
-                    'Authorization': `Bearer ${token}`,
-                },
-            });
-
-            if (response.ok) {
-                const conversationId = await response.json();
-                setConversationId(conversationId);
-            } else {
-                console.error('Failed to fetch conversation ID');
-            }
-        } catch (error) {
-            console.error("Error fetching conversation ID:", error);
-        }
-    };
-
     const handleAddConversation = async () => {
         const token = localStorage.getItem('token');
         const username = document.getElementById('new-username').value;
@@ -145,7 +124,7 @@ function Home() {
         });
 
         if (response.ok) {
-            fetchUsersInConversations();
+            fetchInbox();
             document.getElementById('new-username').value = ''; // Clear input
         } else {
             const data = await response.json();
@@ -153,9 +132,13 @@ function Home() {
         }
     };
 
-    const handleUserClick = async (username) => {
-        setSelectedUsername(username);
-        await fetchConversationId(username);
+    const handleConversationClick = (entry) => {
+        setSelectedUsername(entry.is_group ? entry.title : entry.peer.username);
+        setConversationId(entry.conversation_id);
+        // ChatWindow marks it read on the server once the messages are on screen
+        setInbox((prevInbox) => prevInbox.map((item) =>
+            item.conversation_id === entry.conversation_id ? { ...item, unread_count: 0 } : item
+        ));
     };
 
     // handle logout
@@ -199,21 +182,31 @@ function Home() {
                 </div>
                 <div className="conversation-list">
                     <h3>Chats</h3>
-                    {users.length > 0 ? (
+                    {inbox.length > 0 ? (
                         <ul>
-                            {users.map((user) => (
+                            {inbox.map((entry) => (
                                 <li
-                                    key={user.user_id}
-                                    className={`conversation-item ${selectedUsername === user.username ? 'active' : ''}`}
-                                    onClick={() => handleUserClick(user.username)}
+                                    key={entry.conversation_id}
+                                    className={`conversation-item ${conversationId === entry.conversation_id ? 'active' : ''}`}
+                                    onClick={() => handleConversationClick(entry)}
                                 >
-                                    {/* Display user's profile picture */}
-                                    <img 
-                                        src={user.profile_image_url} 
-                                        alt={`${user.username}'s profile`} 
-                                        className="user-profile-pic" 
-                                    />
-                                    {user.username}
+                                    {/* Display user's profile picture (groups have none) */}
+                                    {entry.peer && (
+                                        <img 
+                                            src={entry.peer.profile_image_url} 
+                                            alt={`${entry.peer.username}'s profile`} 
+                                            className="user-profile-pic" 
+                                        />
+                                    )}
+                                    <div className="conversation-summary">
+                                        <span className="conversation-name">{entry.is_group ? entry.title : entry.peer.username}</span>
+                                        {entry.last_message && (
+                                            <span className="conversation-preview">{entry.last_message.message_text}</span>
+                                        )}
+                                    </div>
+                                    {entry.unread_count > 0 && (
+                                        <span className="unread-badge">{entry.unread_count}</span>
+                                    )}
                                 </li>
                             ))}
                         </ul>
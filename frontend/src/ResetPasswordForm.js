@@ -3,7 +3,7 @@ import { useNavigate } from "react-router-dom";
 import "./styles/ResetPassword.css"; // Import the new CSS file
 import Footer from "./Footer";
 
-function ResetPasswordForm() {
+function ResetPasswordForm({ username }) {
     const [otp, setOtp] = useState("");
     const [newPassword, setNewPassword] = useState("");
     const [message, setMessage] = useState("");
@@ -18,7 +18,7 @@ function ResetPasswordForm() {
             const response = await fetch("http://localhost:8000/reset-password", {
                 method: "POST",
                 headers: { "Content-Type": "application/json" },
-                body: JSON.stringify({ reset_token: otp, new_password: newPassword }),
+                body: JSON.stringify({ username, reset_token: otp, new_password: newPassword }),
             });
 
             if (response.ok) {
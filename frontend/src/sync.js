@@ -0,0 +1,30 @@
+// Streams POST /sync (NDJSON) and hands every frame to onFrame as soon as its line arrives,
+// so a long catch-up renders progressively instead of after the whole download.
+export async function syncMessages(token, cursors, onFrame, includeNew = true) {
+    const response = await fetch('http://localhost:8000/sync', {
+        method: 'POST',
+        headers: {
+            'Authorization': `Bearer ${token}`,
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ cursors, include_new: includeNew }),
+    });
+    if (!response.ok) {
+        throw new Error(`Sync failed with status ${response.status}`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+        lines.filter(line => line.trim()).forEach(line => onFrame(JSON.parse(line)));
+    }
+    if (buffer.trim()) {
+        onFrame(JSON.parse(buffer));
+    }
+}